@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import pandas as pd
+import numpy as np
+import os, sys, time, glob, pickle, json, hashlib, functools, threading
+from coronita_archive_helper import archive_index, forecast_vintage_for, load_forecast_vintage
+
+# Small read-only HTTP service over the latest archived forecast vintage. Everything is loaded into memory once
+# (and again on reload), and responses are built through an LRU cache keyed on the normalized query, so polling clients
+# never touch disk on the hot path. Every response carries an ETag and If-None-Match gets a 304.
+#
+#   GET /regions
+#   GET /forecast/<region>?metrics=hospitalized,deaths&start=2020-10-01&end=2020-12-31&format=csv
+#   GET /rts/<region>?series=weighted_average&metrics=rt,rt_l95,rt_u95
+#   GET /summary?state=NY,NJ
+#
+# format is json (default, one record per row) or csv.
+
+def latest_output(pattern, output_dir='./output'):
+    list_of_files = glob.glob(os.path.join(output_dir, pattern))
+    if not list_of_files:
+        return None
+    return max(list_of_files, key=os.path.getctime)
+
+def frame_slice(df, metrics=None, start=None, end=None):
+    if metrics:
+        missing = [metric for metric in metrics if metric not in df.columns]
+        if missing:
+            raise KeyError('Unknown metrics: {}'.format(', '.join(missing)))
+        df = df[list(metrics)]
+    if start or end:
+        df = df.loc[pd.Timestamp(start) if start else None:pd.Timestamp(end) if end else None]
+    return df
+
+def frame_body(df, fmt):
+    if fmt == 'csv':
+        return df.to_csv(encoding='utf-8').encode('utf-8'), 'text/csv; charset=utf-8'
+    if fmt == 'json':
+        body = df.reset_index().to_json(orient='records', date_format='iso')
+        return body.encode('utf-8'), 'application/json'
+    raise ValueError('Unknown format: {}'.format(fmt))
+
+class ForecastStore:
+    def __init__(self, output_dir='./output', tab_path='../COVIDoutlook/download/state_data_summary_tab.csv',
+                 archive_dir='./output/archive', rt_archive_dir='./output/archive_rt', cache_size=4096):
+        self.output_dir = output_dir
+        self.tab_path = tab_path
+        self.archive_dir = archive_dir
+        self.rt_archive_dir = rt_archive_dir
+        self.response = functools.lru_cache(maxsize=cache_size)(self._build_response)
+        self._lock = threading.Lock()
+        self.load()
+
+    def latest_vintages(self):
+        # (forecast vintage, weighted Rt vintage, model dicts file) plus a version token. The version leads with
+        # the forecast vintage id; the suffix covers a same-night re-run and a newer Rt vintage or model dicts.
+        try:
+            fore_vintage = forecast_vintage_for(archive_dir=self.archive_dir)
+        except KeyError:
+            raise FileNotFoundError('No forecast vintage archived in {}'.format(self.archive_dir))
+        try:
+            rt_vintage = forecast_vintage_for(archive_dir=self.rt_archive_dir)
+        except KeyError:
+            rt_vintage = None
+        md_file = latest_output('allstate_model_dicts_*.pkl', self.output_dir)
+
+        entries = [entry for entry in archive_index(self.archive_dir) if entry['vintage'] == fore_vintage]
+        entries += [entry for entry in archive_index(self.rt_archive_dir) if entry['vintage'] == rt_vintage]
+        stamp = json.dumps([entries, md_file, os.path.getmtime(md_file) if md_file is not None else None])
+        version = '{}-{}'.format(fore_vintage, hashlib.sha1(stamp.encode('utf-8')).hexdigest()[:8])
+        return (fore_vintage, rt_vintage, md_file), version
+
+    def load(self):
+        (fore_vintage, rt_vintage, md_file), version = self.latest_vintages()
+        df_fore_allstates = load_forecast_vintage(fore_vintage, self.archive_dir)
+        fore_by_region = {region: df_fore_allstates[region].unstack('metric').dropna(how='all')
+                          for region in df_fore_allstates.columns}
+
+        # Per-source Rt confidence bands come from the model dicts; without them fall back to the weighted
+        # average bands archived next to the forecast.
+        rts_by_region = {}
+        if md_file is not None:
+            with open(md_file, 'rb') as handle:
+                allstate_model_dicts = pickle.load(handle)
+            for region, model_dict in allstate_model_dicts.items():
+                if 'df_rts_conf' in model_dict:
+                    rts_by_region[region] = model_dict['df_rts_conf'].unstack('metric')
+        if rt_vintage is not None:
+            df_wavg = load_forecast_vintage(rt_vintage, self.rt_archive_dir)
+            for region in df_wavg.columns:
+                if region not in rts_by_region:
+                    df_rt = df_wavg[region].unstack('metric')
+                    df_rt.columns = pd.MultiIndex.from_product([['weighted_average'], df_rt.columns])
+                    rts_by_region[region] = df_rt
+
+        if self.tab_path is not None and os.path.exists(self.tab_path):
+            df_tab = pd.read_csv(self.tab_path, index_col=0)
+        else:
+            df_tab = pd.DataFrame()
+
+        with self._lock:
+            self.fore_by_region = fore_by_region
+            self.rts_by_region = rts_by_region
+            self.df_tab = df_tab
+            self.version = version
+            self.response.cache_clear()
+        return self.version
+
+    def reload_if_newer(self):
+        # Cheap check for a newer forecast run (two small index reads); call it from a timer, not per request.
+        _, version = self.latest_vintages()
+        if version != self.version:
+            return self.load()
+        return self.version
+
+    def query(self, path):
+        # The version is part of the cache key so a response built from the old frames while a reload is
+        # swapping them in can never be served afterwards.
+        return self.response(self.version, *parse_request(path))
+
+    def _build_response(self, version, kind, region, metrics, start, end, fmt, series):
+        # Arguments are already normalized (tuples, upper-case regions) so equal queries share a cache entry.
+        if kind == 'regions':
+            body = json.dumps({'forecast': sorted(self.fore_by_region), 'rts': sorted(self.rts_by_region)})
+            return self._finish(body.encode('utf-8'), 'application/json')
+        if kind == 'forecast':
+            if region not in self.fore_by_region:
+                raise KeyError('Unknown region: {}'.format(region))
+            df = frame_slice(self.fore_by_region[region], metrics, start, end)
+        elif kind == 'rts':
+            if region not in self.rts_by_region:
+                raise KeyError('Unknown region: {}'.format(region))
+            df_rts = self.rts_by_region[region]
+            if series not in df_rts.columns.get_level_values(0):
+                raise KeyError('Unknown series: {}'.format(series))
+            df = frame_slice(df_rts[series].dropna(how='all'), metrics, start, end)
+        elif kind == 'summary':
+            df = self.df_tab
+            if region:
+                df = df[df['state'].isin(region.split(','))] if 'state' in df.columns else df.iloc[0:0]
+            if metrics:
+                df = frame_slice(df, metrics)
+        else:
+            raise KeyError('Unknown resource: {}'.format(kind))
+        return self._finish(*frame_body(df, fmt))
+
+    def _finish(self, body, content_type):
+        etag = '"{}-{}"'.format(self.version, hashlib.sha1(body).hexdigest()[:16])
+        return body, content_type, etag
+
+def parse_request(path):
+    from urllib.parse import urlsplit, parse_qs
+    url = urlsplit(path)
+    parts = [part for part in url.path.split('/') if part]
+    query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+    kind = parts[0] if parts else 'regions'
+    if kind == 'summary':
+        region = query.get('state', '').upper() or None
+    else:
+        region = parts[1].upper() if len(parts) > 1 else None
+    metrics = tuple(metric for metric in query.get('metrics', '').split(',') if metric) or None
+    return (kind, region, metrics, query.get('start'), query.get('end'), query.get('format', 'json').lower(),
+            query.get('series', 'weighted_average'))
+
+def make_handler(store):
+    from http.server import BaseHTTPRequestHandler
+
+    class ForecastHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            try:
+                body, content_type, etag = store.query(self.path)
+            except KeyError as e:
+                return self._send_error(404, e.args[0])
+            except ValueError as e:
+                return self._send_error(400, str(e))
+
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'public, max-age=60')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_error(self, code, msg):
+            body = json.dumps({'error': msg}).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ForecastHandler
+
+def serve_forecasts(store=None, host='127.0.0.1', port=8050, refresh_secs=300):
+    from http.server import ThreadingHTTPServer
+
+    if store is None:
+        store = ForecastStore()
+
+    if refresh_secs:
+        def refresh():
+            while True:
+                time.sleep(refresh_secs)
+                try:
+                    store.reload_if_newer()
+                except Exception as e:
+                    print('Forecast reload failed: {}'.format(e))
+        threading.Thread(target=refresh, daemon=True).start()
+
+    server = ThreadingHTTPServer((host, port), make_handler(store))
+    print('Serving forecast version {} on http://{}:{}'.format(store.version, host, port))
+    server.serve_forever()
+
+if __name__ == '__main__':
+    serve_forecasts(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8050)
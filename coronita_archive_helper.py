@@ -0,0 +1,154 @@
+import pandas as pd
+import numpy as np
+import os, json
+
+# Archive of nightly forecast vintages. Each vintage lives in its own partition, archive_dir/vintage=YYYY-MM-DD/,
+# as a long (dt, metric, region, value) table with metric and region dictionary encoded. Most vintages only store
+# the cells that changed since the previous vintage (removed cells as nan tombstones), with a full keyframe every
+# keyframe_every vintages to bound how many partitions a read has to touch. vintages.json indexes them for
+# "latest" and "as of" lookups, so nothing has to glob the output folder.
+
+archive_keys = ['dt', 'metric', 'region']
+
+def _archive_fmt():
+    # parquet when pyarrow is installed, pickle otherwise; the format is recorded per vintage.
+    try:
+        import pyarrow
+        return 'parquet'
+    except ImportError:
+        return 'pkl'
+
+def archive_index(archive_dir='./output/archive'):
+    index_path = os.path.join(archive_dir, 'vintages.json')
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path, 'r') as f:
+        return json.load(f)
+
+def _write_archive_index(archive_dir, l_index):
+    index_path = os.path.join(archive_dir, 'vintages.json')
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump(l_index, f, indent=1)
+    os.replace(index_path + '.tmp', index_path)
+
+def forecast_to_long(df_fore_allstates):
+    df_long = df_fore_allstates.stack().rename('value').reset_index()
+    df_long.columns = archive_keys + ['value']
+    df_long['metric'] = df_long['metric'].astype(str)
+    df_long['region'] = df_long['region'].astype(str)
+    return df_long
+
+def long_to_forecast(df_long, metrics, regions):
+    # Back to the df_fore_allstates layout: (dt, metric) rows in the original metric order, one column per region.
+    df_long = df_long.copy()
+    df_long['metric'] = pd.Categorical(df_long['metric'], categories=metrics)
+    df_fore = df_long.set_index(archive_keys)['value'].unstack('region').sort_index()
+    df_fore.index = df_fore.index.set_levels(df_fore.index.levels[1].astype(str), level='metric')
+    df_fore.columns.name = None
+    return df_fore[[region for region in regions if region in df_fore.columns]]
+
+def _write_partition(df_long, path, fmt):
+    df_long = df_long.copy()
+    df_long['metric'] = df_long['metric'].astype('category')
+    df_long['region'] = df_long['region'].astype('category')
+    if fmt == 'parquet':
+        df_long.to_parquet(path, index=False)
+    else:
+        df_long.to_pickle(path)
+
+def _read_partition(path, fmt, regions=None):
+    if fmt == 'parquet':
+        filters = [('region', 'in', list(regions))] if regions is not None else None
+        df_long = pd.read_parquet(path, filters=filters)
+    else:
+        df_long = pd.read_pickle(path)
+        if regions is not None:
+            df_long = df_long[df_long['region'].isin(regions)]
+    df_long['metric'] = df_long['metric'].astype(str)
+    df_long['region'] = df_long['region'].astype(str)
+    return df_long
+
+def _read_vintage_long(archive_dir, l_index, vintage, regions=None):
+    # Walk back to the nearest keyframe, then replay the deltas forward.
+    entries = {entry['vintage']: entry for entry in l_index}
+    chain = [entries[vintage]]
+    while chain[-1]['kind'] == 'delta':
+        chain.append(entries[chain[-1]['prev']])
+
+    s_vintage = None
+    for entry in chain[::-1]:
+        df_part = _read_partition(os.path.join(archive_dir, entry['path']), entry['fmt'], regions)
+        s_part = df_part.set_index(archive_keys)['value']
+        if s_vintage is None:
+            s_vintage = s_part
+        else:
+            s_vintage = pd.concat([s_vintage[~s_vintage.index.isin(s_part.index)], s_part.dropna()])
+    return s_vintage.reset_index()
+
+def archive_forecast(df_fore_allstates, vintage_dt=None, archive_dir='./output/archive', keyframe_every=7):
+    if vintage_dt is None:
+        vintage_dt = pd.Timestamp.today()
+    vintage = pd.Timestamp(vintage_dt).strftime('%Y-%m-%d')
+    os.makedirs(archive_dir, exist_ok=True)
+
+    l_index = archive_index(archive_dir)
+    if l_index and l_index[-1]['vintage'] > vintage:
+        # Deltas only chain forward, so an older vintage can't be slotted in; skip it rather than fail the run.
+        print('Couldn\'t archive vintage {}: older than the latest archived vintage {}'.format(
+            vintage, l_index[-1]['vintage']))
+        return None
+    # Re-running the same night replaces that night's vintage.
+    l_index = [entry for entry in l_index if entry['vintage'] != vintage]
+
+    df_long = forecast_to_long(df_fore_allstates)
+    fmt = _archive_fmt()
+    entry = {'vintage': vintage, 'fmt': fmt,
+             'metrics': list(pd.unique(df_long['metric'])), 'regions': [str(col) for col in df_fore_allstates.columns]}
+
+    prev = l_index[-1] if l_index else None
+    if prev is not None and prev['chain'] + 1 < keyframe_every:
+        df_prev = _read_vintage_long(archive_dir, l_index, prev['vintage'])
+        df_merged = df_prev.merge(df_long, on=archive_keys, how='outer', suffixes=('_prev', ''), indicator=True)
+        value, value_prev = df_merged['value'], df_merged['value_prev']
+        changed = (df_merged['_merge'] != 'both') | ~((value == value_prev) | (value.isna() & value_prev.isna()))
+        df_part = df_merged.loc[changed, archive_keys + ['value']]
+        entry.update(kind='delta', prev=prev['vintage'], chain=prev['chain'] + 1)
+    else:
+        df_part = df_long
+        entry.update(kind='full', prev=None, chain=0)
+
+    part_dir = 'vintage={}'.format(vintage)
+    os.makedirs(os.path.join(archive_dir, part_dir), exist_ok=True)
+    entry['path'] = os.path.join(part_dir, 'forecast.{}'.format(fmt))
+    entry['rows'] = int(df_part.shape[0])
+    _write_partition(df_part, os.path.join(archive_dir, entry['path']), fmt)
+
+    l_index.append(entry)
+    _write_archive_index(archive_dir, l_index)
+    return entry
+
+def forecast_vintage_for(as_of=None, archive_dir='./output/archive'):
+    # Latest vintage on or before as_of (or the latest overall).
+    l_vintages = [entry['vintage'] for entry in archive_index(archive_dir)]
+    if as_of is not None:
+        as_of = pd.Timestamp(as_of).strftime('%Y-%m-%d')
+        l_vintages = [vintage for vintage in l_vintages if vintage <= as_of]
+    if not l_vintages:
+        raise KeyError('No forecast vintage archived as of {}'.format(as_of))
+    return l_vintages[-1]
+
+def load_forecast_vintage(as_of=None, archive_dir='./output/archive', regions=None):
+    l_index = archive_index(archive_dir)
+    vintage = forecast_vintage_for(as_of, archive_dir)
+    entry = [entry for entry in l_index if entry['vintage'] == vintage][0]
+    df_long = _read_vintage_long(archive_dir, l_index, vintage, regions)
+    return long_to_forecast(df_long, entry['metrics'], regions or entry['regions'])
+
+def compare_forecast_vintages(as_of_a, as_of_b, metric='hospitalized', archive_dir='./output/archive',
+                              regions=None):
+    # One metric from two vintages side by side, columns (vintage, region); only those two chains are read.
+    d_vintages = {}
+    for as_of in [as_of_a, as_of_b]:
+        vintage = forecast_vintage_for(as_of, archive_dir)
+        d_vintages[vintage] = load_forecast_vintage(vintage, archive_dir, regions).xs(metric, level='metric')
+    return pd.concat(d_vintages, axis=1, names=['vintage', 'region'])
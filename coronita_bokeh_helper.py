@@ -1,22 +1,14 @@
 import pandas as pd
 import numpy as np
 from collections import OrderedDict
-import io
+import io, os
 
-from bokeh.plotting import figure, show
-from bokeh.io import reset_output, output_notebook, curdoc, output_file, save
-from bokeh.themes import built_in_themes
-from bokeh.layouts import row, column, grid
-from bokeh.models import ColumnDataSource, NumeralTickFormatter, HoverTool, Label, LinearAxis, Range1d, \
-    Span, DatetimeTickFormatter, CustomJS, Select, Button, Patch, Legend, Div, Title, FactorRange
-from bokeh.embed import components, autoload_static
-from bokeh.resources import INLINE, CDN
-
-from jinja2 import Template
+# bokeh is imported inside each function so that importing this module stays cheap for model-only workers.
 
 bk_theme = 'light_minimal'
 
 def add_bokeh_footnote(p):
+    from bokeh.models import Label
     msg1 = 'www.COVIDoutlook.info | twtr: @COVIDoutlook'
     msg2 = 'Chart created on {}'.format(pd.Timestamp.today().strftime("%b %d '%y"))
 
@@ -35,6 +27,7 @@ def add_bokeh_footnote(p):
     return p
 
 def bk_title(p, title="", subtitle=""):
+    from bokeh.models import Title
     p.add_layout(Title(text=subtitle, text_font_style="italic", text_font_size="100%"), 'above')
     p.add_layout(Title(text=title, text_font_style="bold", text_font_size="125%"), 'above')
     return p
@@ -58,6 +51,7 @@ def bk_legend(p, location='center', orientation='horizontal', font_size=1.35):
     return p
 
 def bk_overview_layout(p, num_in_row=1, min_height=360):
+    from bokeh.models import DatetimeTickFormatter
     p = bk_legend(p, location='center', orientation='horizontal')
     # p.legend.visible = False
     p.add_layout(p.legend[0], 'below')
@@ -90,6 +84,7 @@ def bk_overview_layout(p, num_in_row=1, min_height=360):
     return p
 
 def bk_repro_layout(p, num_in_row=1, min_height=360):
+    from bokeh.models import DatetimeTickFormatter
     p = bk_legend(p, location='center', orientation = 'horizontal')
     p.legend.visible = False
     p.add_layout(p.legend[0], 'above')
@@ -121,6 +116,7 @@ def bk_repro_layout(p, num_in_row=1, min_height=360):
 
 def bk_add_event_lines(p, df_int):
     # df_int = df_interventions[df_interventions.state_code.isin([state, 'US'])].groupby('dt').first().reset_index()
+    from bokeh.models import Span
     for thisidx in df_int.index:
         if df_int.loc[thisidx, 'social_distancing_direction'] == 'holiday':
             thislinecolor = '#8900a5'
@@ -143,6 +139,8 @@ def bk_bar_and_line_chart(bar_series, bar_name='bar', bar_color='#008fd5',
                           title='', subtitle='', yformat='{:.1%}',
                           bar2_series=None, bar2_name='bar2', bar2_color='#e5ae38'):
 
+    from bokeh.plotting import figure
+    from bokeh.models import NumeralTickFormatter, HoverTool, Range1d
     p = figure(x_axis_type="datetime",
                tools='pan,wheel_zoom,box_zoom,zoom_in,zoom_out,reset,save')
     p = bk_title(p, title=title, subtitle=subtitle)
@@ -185,6 +183,8 @@ def bk_bar_and_line_chart(bar_series, bar_name='bar', bar_color='#008fd5',
     return p
 
 def bk_rt_confid(model_dict, simplify=True):
+    from bokeh.plotting import figure
+    from bokeh.models import HoverTool, Label, Range1d, Span
     df_rt = model_dict['df_rts_conf'][['weighted_average']].unstack('metric')
     rt_name = df_rt.columns.levels[0][0]
     df_rt = df_rt[rt_name].dropna(how='all').reset_index()
@@ -244,6 +244,8 @@ def bk_rt_confid(model_dict, simplify=True):
     return p
 
 def bk_population_share(model_dict):
+    from bokeh.plotting import figure
+    from bokeh.models import NumeralTickFormatter, HoverTool, Label, LinearAxis, Range1d, Span
     df_agg = model_dict['df_agg']
     col_names = ['susceptible', 'deaths', 'exposed', 'infectious', 'hospitalized', 'recovered']
     legend_names = ['Susceptible', 'Deaths', 'Exposed',
@@ -312,6 +314,8 @@ def bk_population_share(model_dict):
     return p
 
 def bk_postestshare(model_dict):
+    from bokeh.plotting import figure
+    from bokeh.models import NumeralTickFormatter, HoverTool, LinearAxis, Range1d
     df_chart = model_dict['df_hist'][['cases_daily', 'pos_neg_tests_daily']].clip(lower=0)
     df_chart['neg_tests_daily'] = (df_chart['pos_neg_tests_daily'] - df_chart['cases_daily']).clip(lower=0)
     df_chart = df_chart.div(df_chart[['cases_daily','pos_neg_tests_daily']].max(axis=1), axis=0).dropna(how='all')
@@ -375,6 +379,8 @@ def bk_totaltests(model_dict):
     return p
 
 def bk_detection_rt(df_agg, model_dict):
+    from bokeh.plotting import figure
+    from bokeh.models import NumeralTickFormatter, HoverTool
     df_chart = model_dict['df_hist']['cases_daily'].rolling(7).mean().div(df_agg['exposed_daily']).dropna()
     df_chart = df_chart.reset_index()
     df_chart.columns = ['dt','detection_rt']
@@ -397,6 +403,8 @@ def bk_detection_rt(df_agg, model_dict):
     return p
 
 def bk_googmvmt(model_dict):
+    from bokeh.plotting import figure
+    from bokeh.models import NumeralTickFormatter, HoverTool
     df_chart = model_dict['df_mvmt']
     col_names = ['retail_and_recreation_percent_change_from_baseline',
          'grocery_and_pharmacy_percent_change_from_baseline',
@@ -435,6 +443,10 @@ def bk_googmvmt(model_dict):
 
 def bk_compare_exposures(df_census, df_fore_allstates):
     # df_chart = df_fore_allstates.stack().unstack('metric')['exposed_daily'].unstack(1)
+    from bokeh.plotting import figure
+    from bokeh.io import curdoc
+    from bokeh.layouts import row, column
+    from bokeh.models import ColumnDataSource, NumeralTickFormatter, HoverTool, Label, LinearAxis, Range1d, Span, DatetimeTickFormatter, CustomJS, Select
     s_pop = df_census.loc[(df_census.SUMLEV == 40)].set_index('state')['pop2019']
     df_exposed_daily_per100k = df_fore_allstates.stack().unstack('metric')[
         'exposed_daily'].unstack(1).div(s_pop).mul(1e5)
@@ -548,4 +560,118 @@ def bk_compare_exposures(df_census, df_fore_allstates):
 
     curdoc().theme = bk_theme
     layout = column(row(select1, select2), row(p1), sizing_mode='scale_width')
-    return layout
\ No newline at end of file
+    return layout
+
+
+# Lazy-loaded embedding. bk_lazy_components() is components() for a page of many plots: each ColumnDataSource with
+# at least lazy_min_rows rows is emptied in the page script and written out as its own compact json file, which
+# the page fetches once the plot scrolls into view. Floats are stored as integers at lazy_digits decimals and come
+# back as Float32Arrays, dates as whole days when they fall on midnight. Files are named by a hash of their
+# content, so glyphs sharing the same frame share one file.
+lazy_min_rows = 50
+lazy_digits = 3
+
+lazy_loader_js = '''
+(function() {
+  const lazy = %s;
+  function decode(payload) {
+    const data = {};
+    Object.keys(payload).forEach(function(name) {
+      const col = payload[name];
+      if (col.values !== undefined) { data[name] = col.values; return; }
+      const arr = col.dtype == 'float32' ? new Float32Array(col.q.length) : new Float64Array(col.q.length);
+      for (let i = 0; i < col.q.length; i++) {
+        arr[i] = col.q[i] === null ? NaN : col.q[i] * col.mul / col.div;
+      }
+      data[name] = arr;
+    });
+    return data;
+  }
+  function get_model(id) {
+    if (window.Bokeh === undefined || Bokeh.documents === undefined) { return null; }
+    for (let i = 0; i < Bokeh.documents.length; i++) {
+      const model = Bokeh.documents[i].get_model_by_id(id);
+      if (model) { return model; }
+    }
+    return null;
+  }
+  function load(items) {
+    items.forEach(function(item) {
+      fetch(item.url).then(function(res) { return res.json(); }).then(function(payload) {
+        get_model(item.source).data = decode(payload);
+      });
+    });
+  }
+  function watch() {
+    if (lazy.length && get_model(lazy[lazy.length - 1].source) === null) { setTimeout(watch, 100); return; }
+    const by_root = {};
+    lazy.forEach(function(item) { (by_root[item.root] = by_root[item.root] || []).push(item); });
+    const observer = window.IntersectionObserver === undefined ? null : new IntersectionObserver(function(entries) {
+      entries.forEach(function(entry) {
+        if (!entry.isIntersecting) { return; }
+        observer.unobserve(entry.target);
+        load(by_root[entry.target.getAttribute('data-root-id')]);
+      });
+    }, {rootMargin: '200px'});
+    Object.keys(by_root).forEach(function(root) {
+      const el = document.querySelector('[data-root-id="' + root + '"]');
+      if (observer === null || el === null) { load(by_root[root]); } else { observer.observe(el); }
+    });
+  }
+  if (document.readyState != "loading") watch();
+  else document.addEventListener("DOMContentLoaded", watch);
+})();
+'''
+
+def bk_lazy_column(values, digits=lazy_digits):
+    values = np.asarray(values)
+    if values.dtype.kind == 'M':
+        ms = values.astype('datetime64[ms]').astype('int64')
+        if np.all(ms % 86400000 == 0):
+            return {'q': (ms // 86400000).tolist(), 'mul': 86400000, 'div': 1, 'dtype': 'float64'}
+        return {'q': ms.tolist(), 'mul': 1, 'div': 1, 'dtype': 'float64'}
+    if values.dtype.kind in 'biu':
+        return {'q': values.astype('int64').tolist(), 'mul': 1, 'div': 1, 'dtype': 'float64'}
+    if values.dtype.kind == 'f':
+        q = np.round(values.astype('float64') * 10 ** digits)
+        return {'q': [None if np.isnan(val) else int(val) for val in q], 'mul': 1, 'div': 10 ** digits,
+                'dtype': 'float32'}
+    return {'values': values.tolist()}
+
+def bk_lazy_components(plots, data_dir, data_url, min_rows=lazy_min_rows, digits=lazy_digits, n_workers=None):
+    # Same (script, divs) as bokeh's components(plots), except the script comes back unwrapped, ready to be
+    # written to a .js file, and the big sources' data live in data_dir (served at data_url). This empties those
+    # sources on the plots passed in, so they can't be shown or embedded again afterwards. data_dir belongs to
+    # this page: json files in it from earlier builds are deleted.
+    import json, hashlib
+    from concurrent.futures import ThreadPoolExecutor
+    from bokeh.embed import components
+    from bokeh.models import ColumnDataSource
+
+    d_files = {}
+    l_lazy = []
+    for plot in plots:
+        for source in plot.select(type=ColumnDataSource):
+            if len(source.data) == 0 or len(next(iter(source.data.values()))) < min_rows:
+                continue
+            payload = json.dumps({name: bk_lazy_column(values, digits) for name, values in source.data.items()},
+                                 separators=(',', ':'))
+            file_name = '{}.json'.format(hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16])
+            d_files[file_name] = payload
+            l_lazy.append({'root': plot.id, 'source': source.id, 'url': '{}/{}'.format(data_url, file_name)})
+            source.data = {name: [] for name in source.data}
+
+    def write_file(item):
+        file_name, payload = item
+        with open(os.path.join(data_dir, file_name), 'w') as f:
+            f.write(payload)
+
+    os.makedirs(data_dir, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        list(executor.map(write_file, d_files.items()))
+    for file_name in os.listdir(data_dir):
+        if file_name.endswith('.json') and file_name not in d_files:
+            os.remove(os.path.join(data_dir, file_name))
+
+    script, divs = components(plots, wrap_script=False)
+    return script + lazy_loader_js % json.dumps(l_lazy), divs
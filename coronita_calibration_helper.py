@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import pandas as pd
+import numpy as np
+import os, sys, time, glob, pickle, collections
+
+from coronita_model_helper import default_ode_params, run_ode_model, worker_budget
+
+# Calibration of the ODE engine (seir_model_ode) against reported hospital and death data, following
+# param_min_sequence in SEIRDSModelUpdateDev.ipynb. Rather than one state and one lmfit method at a time, every
+# (state, starting point, method) fit is a task on a process pool. The observed targets are aligned into arrays once
+# per state and shared with the workers, objective evaluations are cached on the parameter vector, and each state
+# gets a wall-time budget and stops early once new fits stop improving on its best.
+
+ode_epoch = pd.Timestamp('2020-01-01')
+calib_target_cols = ['hosp_concur', 'hosp_admits', 'deaths_daily']
+calib_vary = ['start_dt', 'mort_rt', 'mort_rt_curr', 'd_til_death_curr', 'mort_logistic_steepness']
+calib_methods = ['leastsq', 'nelder', 'powell']
+
+def calibration_param_spec(covid_params):
+    # name -> (initial value, min, max); start_dt is in days after ode_epoch.
+    return collections.OrderedDict([
+        ('d_incub', (covid_params['d_incub'], 2, 5)),
+        ('d_infect', (covid_params['d_infect'], 2, 7)),
+        ('d_to_hosp', (covid_params['d_to_hosp'], 2, 10)),
+        ('d_in_hosp', (covid_params['d_in_hosp'], 2, 20)),
+        ('d_til_death', (covid_params['d_til_death'], 5, 30)),
+        ('d_til_death_curr', (covid_params['d_til_death'], 8, 45)),
+        ('mort_rt', (covid_params['mort_rt'], 0.001, 0.04)),
+        ('mort_logistic_steepness', (0.25, 0.05, 1)),
+        ('mort_rt_curr', (0.0075, 0.001, 0.02)),
+        ('hosp_rt', (covid_params['hosp_rt'], 0.01, 0.15)),
+        ('start_dt', (25, 0, 100)),
+    ])
+
+def prepare_calibration(model_dict, n_days=365, hrs_per_point=24):
+    # Everything the objective needs for one state, as plain arrays.
+    data = model_dict['df_hist'][[col for col in calib_target_cols if col in model_dict['df_hist'].columns]]
+    data = data.dropna(how='all').replace(0, np.nan).dropna(axis=1, thresh=180).dropna(how='any')
+    data = data.clip(lower=data.quantile(0.01), upper=data.quantile(0.99), axis=1)
+
+    s_rt = model_dict['df_rts']['weighted_average'].dropna()
+    s_rt = s_rt.loc[s_rt.loc[:'2020-04-15'].idxmax():]
+    s_rt = s_rt.reindex(pd.date_range(ode_epoch, periods=365 * 2, freq='1D'))
+    s_rt = s_rt.interpolate().fillna(method='ffill').fillna(method='bfill')
+
+    initial_conditions = np.zeros(11)
+    initial_conditions[0] = model_dict['tot_pop']
+    initial_conditions[1:3] = 1e1
+
+    prep = {}
+    prep['cols'] = list(data.columns)
+    prep['obs'] = data.to_numpy(dtype='float64')
+    prep['obs_day'] = ((data.index - ode_epoch) / pd.Timedelta(days=1)).to_numpy().astype('int64')
+    prep['scale'] = data.max().to_numpy(dtype='float64')
+    prep['r_full'] = s_rt.to_numpy(dtype='float64')
+    prep['initial_conditions'] = initial_conditions
+    prep['n_days'] = n_days
+    prep['hrs_per_point'] = hrs_per_point
+    prep['spec'] = calibration_param_spec(model_dict['covid_params'])
+    return prep
+
+def calibration_residuals(prep, values):
+    # Scaled model-minus-observed on the observed dates; nan where the run doesn't cover a date.
+    start_day = values['start_dt']
+    start_dt = ode_epoch + pd.Timedelta(days=start_day)
+    # Rt for day k of the run is the value k days after the start's calendar day (k + 1 for a part-day start).
+    first_rt = int(np.floor(start_day)) + int(start_day % 1 > 0)
+    df_daily = run_ode_model(values, prep['initial_conditions'], start_dt, prep['r_full'][first_rt:],
+                             prep['n_days'], prep['hrs_per_point'])
+
+    model = df_daily[prep['cols']].to_numpy()
+    pos = prep['obs_day'] - (df_daily.index[0] - ode_epoch).days
+    in_run = (pos >= 0) & (pos < model.shape[0])
+    resid = np.full(prep['obs'].shape, np.nan)
+    resid[in_run] = model[pos[in_run]] - prep['obs'][in_run]
+    return (resid / prep['scale']).ravel()
+
+_calib_shared = {}
+_calib_cache = {}
+calib_cache_size = 20000
+
+def _init_calibration_worker(preps):
+    _calib_shared.clear()
+    _calib_shared.update(preps)
+    _calib_cache.clear()
+
+def cached_residuals(region, values):
+    key = (region,) + tuple(round(float(values[name]), 10) for name in _calib_shared[region]['spec'])
+    resid = _calib_cache.get(key)
+    if resid is None:
+        if len(_calib_cache) >= calib_cache_size:
+            _calib_cache.clear()
+        resid = calibration_residuals(_calib_shared[region], values)
+        _calib_cache[key] = resid
+    return resid
+
+def run_calibration_task(region, method, start_values, vary, deadline, max_nfev=200):
+    # One lmfit fit. Keeps the best point it evaluates and stops at the state's deadline, so a timed-out fit
+    # still reports something useful.
+    from lmfit import minimize, Parameters
+    from lmfit.minimizer import AbortFitException
+
+    params = Parameters()
+    for name, (value, p_min, p_max) in _calib_shared[region]['spec'].items():
+        params.add(name, value=start_values.get(name, value), min=p_min, max=p_max, vary=name in vary)
+
+    best = {'chisqr': np.inf, 'values': None, 'n_evals': 0}
+    def objective(params):
+        values = params.valuesdict()
+        resid = cached_residuals(region, values)
+        chisqr = np.nansum(np.square(resid))
+        best['n_evals'] += 1
+        if chisqr < best['chisqr']:
+            best['chisqr'], best['values'] = chisqr, dict(values)
+        return resid
+
+    def past_deadline(params, iter, resid, *args, **kwargs):
+        return time.time() > deadline
+
+    # Some methods re-evaluate after an abort and raise it again; the best point is kept either way.
+    try:
+        result = minimize(objective, params, method=method, max_nfev=max_nfev, nan_policy='omit',
+                          iter_cb=past_deadline)
+        aborted = bool(result.aborted)
+    except AbortFitException:
+        aborted = True
+    return {'region': region, 'method': method, 'chisqr': best['chisqr'], 'values': best['values'],
+            'n_evals': best['n_evals'], 'aborted': aborted}
+
+def calibration_starts(spec, vary, n_starts, rng):
+    # The spec's own values first, then uniform draws inside the bounds for the varied parameters.
+    starts = [{name: value for name, (value, p_min, p_max) in spec.items()}]
+    for _ in range(n_starts - 1):
+        starts.append({name: (rng.uniform(p_min, p_max) if name in vary else value)
+                       for name, (value, p_min, p_max) in spec.items()})
+    return starts
+
+def calibrate_regions(allstate_model_dicts, regions=None, vary=calib_vary, methods=calib_methods, n_starts=4,
+                      n_workers=None, budget_secs=300, patience=4, rel_tol=1e-3, max_nfev=200, seed=0):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+    if regions is None:
+        regions = [region for region in allstate_model_dicts if region != 'US']
+    if n_workers is None:
+        n_workers = worker_budget()
+    rng = np.random.default_rng(seed)
+
+    preps = {}
+    for region in regions:
+        try:
+            preps[region] = prepare_calibration(allstate_model_dicts[region])
+        except Exception as e:
+            print('Couldn\'t prepare calibration data for {}: {}'.format(region, e))
+
+    # Region-major queue: a state's fits run next to each other, and its budget starts with its first fit.
+    queue = collections.deque((region, method, start) for region in preps
+                              for start in calibration_starts(preps[region]['spec'], vary, n_starts, rng)
+                              for method in methods)
+    status = {region: {'best': None, 'deadline': None, 'since_best': 0, 'n_fits': 0, 'n_skipped': 0,
+                       'started': None, 'finished': None, 'stopped': False} for region in preps}
+
+    # Platform default start method; each worker gets the prepared data through initargs.
+    mp_context = multiprocessing.get_context()
+
+    in_flight = {}
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp_context,
+                             initializer=_init_calibration_worker, initargs=(preps,)) as executor:
+        while queue or in_flight:
+            while queue and len(in_flight) < n_workers:
+                region, method, start = queue.popleft()
+                reg_status = status[region]
+                now = time.time()
+                if reg_status['deadline'] is None:
+                    reg_status['started'], reg_status['deadline'] = now, now + budget_secs
+                if reg_status['stopped'] or now > reg_status['deadline']:
+                    reg_status['n_skipped'] += 1
+                    continue
+                future = executor.submit(run_calibration_task, region, method, start, list(vary),
+                                         reg_status['deadline'], max_nfev)
+                in_flight[future] = region
+            if not in_flight:
+                break
+
+            done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+            for future in done:
+                region = in_flight.pop(future)
+                reg_status = status[region]
+                reg_status['n_fits'] += 1
+                reg_status['finished'] = time.time()
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print('Calibration fit for {} failed: {}'.format(region, e))
+                    continue
+                if result['values'] is None:
+                    continue
+
+                best = reg_status['best']
+                if best is None or result['chisqr'] < best['chisqr'] * (1 - rel_tol):
+                    reg_status['best'], reg_status['since_best'] = result, 0
+                else:
+                    reg_status['since_best'] += 1
+                    if reg_status['since_best'] >= patience:
+                        reg_status['stopped'] = True
+
+    l_rows = []
+    for region, reg_status in status.items():
+        row = {'region': region, 'n_fits': reg_status['n_fits'], 'n_skipped': reg_status['n_skipped']}
+        if reg_status['started'] is not None and reg_status['finished'] is not None:
+            row['secs'] = reg_status['finished'] - reg_status['started']
+        if reg_status['best'] is not None:
+            row.update(reg_status['best']['values'])
+            row['chisqr'] = reg_status['best']['chisqr']
+            row['method'] = reg_status['best']['method']
+        l_rows.append(row)
+    return pd.DataFrame(l_rows).set_index('region')
+
+def calibrated_ode_params(df_calib, region, covid_params):
+    # ode_params for seir_model_ode from one row of calibrate_regions, plus the calibrated start date.
+    ode_params = default_ode_params(covid_params)
+    row = df_calib.loc[region]
+    for name in ode_params:
+        if name in row.index and pd.notnull(row[name]):
+            ode_params[name] = float(row[name])
+    return ode_params, ode_epoch + pd.Timedelta(days=float(row['start_dt']))
+
+if __name__ == '__main__':
+    list_of_files = glob.glob('./output/allstate_model_dicts_*.pkl') # * means all if need specific format then *.csv
+    latest_file = max(list_of_files, key=os.path.getctime)
+    print(latest_file)
+    with open(latest_file, 'rb') as handle:
+        allstate_model_dicts = pickle.load(handle)
+
+    df_calib = calibrate_regions(allstate_model_dicts, regions=sys.argv[1:] or None)
+    print(df_calib)
+    df_calib.to_csv('./output/df_ode_calib_{}.csv'.format(pd.Timestamp.today().strftime("%Y%m%d")), encoding='utf-8')
+    df_calib.to_pickle('./output/df_ode_calib_{}.pkl'.format(pd.Timestamp.today().strftime("%Y%m%d")))
@@ -3,13 +3,8 @@ import numpy as np
 from collections import OrderedDict
 import io
 
-from coronita_model_helper import outlier_removal
-
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-from mpl_toolkits.axes_grid1.inset_locator import inset_axes, mark_inset
-import matplotlib.dates as mdates
-import matplotlib.units as munits
+# matplotlib (and plotly) are imported inside each chart function so that importing this module stays cheap
+# for model-only workers.
 
 # plt.style.use('fivethirtyeight')
 # personalsitestyle = 'fivethirtyeight'
@@ -54,6 +49,7 @@ def add_event_lines(ax, df_interventions):
     return
 
 def add_logo(ax):
+    import matplotlib as mpl
     logo = mpl.image.imread(
         "./data/logo_wonb_small.png")
     imagebox = mpl.offsetbox.OffsetImage(logo)
@@ -68,6 +64,8 @@ def bar_and_line_chart(bar_series, bar_name='', bar_color='#008fd5',
                        line_series = False, line_name='', line_color='#fc4f30',
                        chart_title='', yformat='{:.1%}',
                        bar2_series = None, bar2_name='', bar2_color='#e5ae38', footnote_str=''):
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
     fig, ax = plt.subplots(figsize=(14, 8))
     ax.bar(bar_series.index, bar_series, color=bar_color, label=bar_name, width=1.0)
     if isinstance(bar2_series, pd.Series):
@@ -162,6 +160,8 @@ def hospcap_vline(ax, model_dict):
 ### SINGLE REGION CHARTS ###
 def ch_exposed_infectious(model_dict):
 
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
     param_str = param_str_maker(model_dict)
     df_agg = model_dict['df_agg']
 
@@ -207,6 +207,8 @@ def ch_exposed_infectious(model_dict):
 
 def ch_cumul_infections(model_dict):
 
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
     param_str = param_str_maker(model_dict)
     df_agg = model_dict['df_agg']
 
@@ -233,6 +235,9 @@ def ch_cumul_infections(model_dict):
     return ax
 
 def ch_daily_exposures(model_dict):
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
+    from coronita_model_helper import outlier_removal
     reported_name = 'cases_tot'
     forecast_name = 'exposed_daily'
     full_name = 'Daily Exposures'
@@ -277,6 +282,8 @@ def ch_daily_exposures(model_dict):
     return ax
 
 def ch_hosp(model_dict):
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
     param_str = param_str_maker(model_dict)
     df_agg = model_dict['df_agg']
 
@@ -316,6 +323,9 @@ def ch_hosp(model_dict):
 
 
 def ch_hosp_concur(model_dict):
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
+    from coronita_model_helper import outlier_removal
     reported_name = 'hosp_concur'
     forecast_name = 'hospitalized'
     full_name = 'Concurrent Hospitalizations'
@@ -404,6 +414,9 @@ def ch_hosp_concur(model_dict):
     return ax
 
 def ch_hosp_admits(model_dict):
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
+    from coronita_model_helper import outlier_removal
     reported_name = 'hosp_admits'
     forecast_name = 'hosp_admits'
     full_name = 'Daily Hospital Admissions'
@@ -445,6 +458,9 @@ def ch_hosp_admits(model_dict):
     return ax
 
 def ch_deaths_tot(model_dict):
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
+    from coronita_model_helper import outlier_removal
     reported_name = 'deaths_tot'
     forecast_name = 'deaths'
     full_name = 'Total Deaths'
@@ -486,6 +502,9 @@ def ch_deaths_tot(model_dict):
     return ax
 
 def ch_daily_deaths(model_dict):
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
+    from coronita_model_helper import outlier_removal
     reported_name = 'deaths_daily'
     forecast_name = 'deaths'
     full_name = 'Daily Deaths'
@@ -533,6 +552,8 @@ def ch_daily_deaths(model_dict):
     return ax
 
 def ch_doubling_rt(model_dict):
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
     param_str = param_str_maker(model_dict)
     df_agg = model_dict['df_agg']
 
@@ -581,6 +602,8 @@ def ch_doubling_rt(model_dict):
     return ax
 
 def ch_population_share(model_dict):
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
     param_str = param_str_maker(model_dict)
     df_agg = model_dict['df_agg']
 
@@ -627,6 +650,7 @@ def ch_population_share(model_dict):
     return ax
 
 def ch_rts(model_dict):
+    import matplotlib.pyplot as plt
     param_str = param_str_maker(model_dict)
 
     # solo_rts = [x for x in model_dict['df_rts'].columns if x in
@@ -662,6 +686,7 @@ def ch_rts(model_dict):
     return ax
 
 def ch_rt_confid(model_dict):
+    import matplotlib.pyplot as plt
     df_rt = model_dict['df_rts_conf'][['weighted_average']].unstack('metric')
     param_str = param_str_maker(model_dict)
     rt_name = df_rt.columns.levels[0][0]
@@ -722,6 +747,10 @@ def ch_positivetests(model_dict):
     return ax
 
 def ch_postestshare(model_dict):
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
+    from mpl_toolkits.axes_grid1.inset_locator import inset_axes, mark_inset
+    import matplotlib.dates as mdates
     df_chart = model_dict['df_hist'][['cases_daily', 'pos_neg_tests_daily']].clip(lower=0)
     df_chart['neg_tests_daily'] = (df_chart['pos_neg_tests_daily'] - df_chart['cases_daily']).clip(lower=0)
     df_chart = df_chart.div(df_chart[['cases_daily', 'pos_neg_tests_daily']].max(axis=1), axis=0).dropna(how='all')
@@ -785,6 +814,10 @@ def ch_postestshare(model_dict):
     return ax
 
 def ch_googmvmt(model_dict):
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
+    from mpl_toolkits.axes_grid1.inset_locator import inset_axes, mark_inset
+    import matplotlib.dates as mdates
     colors = ['#008fd5', '#fc4f30', '#e5ae38', '#6d904f', '#8b8b8b', '#810f7c']
     df_chart = model_dict['df_mvmt']
     df_chart = df_chart[['retail_and_recreation_percent_change_from_baseline',
@@ -840,6 +873,8 @@ def ch_googmvmt(model_dict):
     return ax
 
 def ch_detection_rt(model_dict):
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
     param_str = param_str_maker(model_dict)
     df_agg = model_dict['df_agg']
 
@@ -938,111 +973,125 @@ def ch_exposure_prob(df_fore_allstates, s_pop):
 
     return fig
 
-def ch_exposure_prob_anim(df_fore_allstates, df_census):
-    from covid_data_helper import abbrev_us_state
-    s_pop = df_census[df_census.SUMLEV == 40].set_index('state')['pop2019']
-    colorbar_name = 'Probability'
-    df_chart = df_fore_allstates.unstack('dt').loc[['exposed', 'infectious']].T.sum(axis=1)
-    df_chart = df_chart.unstack(0).div(s_pop).dropna(how='all', axis=1)
-    df_chart = df_chart.loc[:pd.Timestamp.today()].stack()
-    df_chart = (1 - (1 - df_chart) ** 10).reset_index()
-    df_chart.columns = ['dt', 'state', colorbar_name]
-    df_chart['fullstatename'] = df_chart['state'].replace(abbrev_us_state)
-    df_chart[colorbar_name] = df_chart[colorbar_name].mul(100).round(1)
-    # df_firstframe = df_chart[df_chart.dt == df_chart.dt.max()].copy()
-    # df_firstframe['dt'] = 'Today (' + df_firstframe.dt.dt.strftime('%B %d, %Y') + ')'
-    df_chart = df_chart[df_chart.dt.isin(
-        pd.date_range(
-            end=pd.Timestamp.today().normalize(),
-            start=pd.Timestamp('2020-03-01'),
-            # periods=100,
-            freq='3d'
-        ).append( pd.Index([pd.Timestamp.today().normalize()]) )
-    ) ]
-    df_chart['dt'] =df_chart.dt.dt.strftime('%B %d, %Y')
-    # df_chart = pd.concat([df_firstframe,df_chart])
-
-    import plotly.express as px
+def exposure_prob_matrix(df_fore_allstates, s_pop, end_dt=None):
+    # dates x states, chance in % that at least one of 10 contacts is exposed or infectious, up to end_dt.
+    if end_dt is None:
+        end_dt = pd.Timestamp.today()
+    df_active = df_fore_allstates.xs('exposed', level='metric').fillna(0) \
+        .add(df_fore_allstates.xs('infectious', level='metric').fillna(0), fill_value=0).sort_index()
+    df_prob = df_active.div(s_pop).dropna(how='all', axis=1).loc[:end_dt]
+    return (1 - (1 - df_prob) ** 10).mul(100).round(1)
+
+def exposure_anim_dates(df_prob, max_frames=150, step_days=3, min_change=0.5):
+    # Candidates every step_days back from the last date. A candidate becomes a frame when some state has moved at
+    # least min_change points since the previous frame; min_change doubles until the frames fit in max_frames. The
+    # first and last dates are always frames.
+    df_cand = df_prob.iloc[::-step_days].iloc[::-1]
+    z = np.nan_to_num(df_cand.to_numpy(dtype='float64'))
+    max_frames = max(max_frames, 2)
+    while True:
+        keep = [0]
+        for i_cand in range(1, z.shape[0] - 1):
+            if np.abs(z[i_cand] - z[keep[-1]]).max() >= min_change:
+                keep.append(i_cand)
+        if z.shape[0] > 1:
+            keep.append(z.shape[0] - 1)
+        if len(keep) <= max_frames:
+            return df_cand.index[keep]
+        min_change *= 2
+
+def ch_exposure_prob_anim(df_fore_allstates, df_census, max_frames=150, max_bytes=1000000, step_days=3,
+                          min_change=0.5):
+    # Frames only carry the z values; locations, hover names and the hovertemplate live on the one base trace.
+    # max_bytes caps the frame and slider json, which sets how many frames we can afford as the history grows.
+    import json
     import plotly.graph_objects as go
+    from covid_data_helper import abbrev_us_state
 
-    chart_title = 'US: Model-Estimated COVID-19 Exposure Probability Per 10 Contacts'
+    s_pop = df_census[df_census.SUMLEV == 40].set_index('state')['pop2019']
+    df_prob = exposure_prob_matrix(df_fore_allstates, s_pop)
+    states = list(df_prob.columns)
 
-    fig = px.choropleth(df_chart,
-                        locations=df_chart['state'],
-                        locationmode="USA-states",
-                        color=colorbar_name,
-                        color_continuous_scale="BuPu",
-                        range_color=(0, 10),
-                        title=chart_title,
-                        projection='albers usa',
-                        animation_group='state',
-                        animation_frame='dt',
-                        hover_name='fullstatename',
-                        hover_data=[colorbar_name]
-                        )
+    def z_values(dt):
+        return [None if pd.isnull(val) else val for val in df_prob.loc[dt].tolist()]
 
-    fig.update_layout(autosize=True)
+    def frame_step(label):
+        return {'args': [[label], {'frame': {'duration': 0, 'redraw': True}, 'mode': 'immediate',
+                                   'fromcurrent': True, 'transition': {'duration': 0, 'easing': 'linear'}}],
+                'label': label, 'method': 'animate'}
 
-    fig = go.Figure(fig)
+    last_label = df_prob.index[-1].strftime('%B %d, %Y')
+    frame_bytes = len(json.dumps({'data': [{'type': 'choropleth', 'z': z_values(df_prob.index[-1])}],
+                                  'name': last_label, 'traces': [0]})) + len(json.dumps(frame_step(last_label)))
+    max_frames = min(max_frames, max_bytes // frame_bytes)
+    anim_dates = exposure_anim_dates(df_prob, max_frames=max_frames, step_days=step_days, min_change=min_change)
+    labels = [dt.strftime('%B %d, %Y') for dt in anim_dates]
 
-    fig_dict = fig.to_dict()
+    chart_title = 'US: Model-Estimated COVID-19 Exposure Probability Per 10 Contacts'
 
-    fig_dict["layout"]["updatemenus"] = [
-        {
-            "buttons": [
-                {
-                    "args": [None, {"frame": {"duration": 0, "redraw": True},
-                                    "fromcurrent": True}],
-                    "label": "Play",
-                    "method": "animate"
+    fig = go.Figure(
+        data=[go.Choropleth(locations=states, locationmode='USA-states', z=z_values(anim_dates[-1]),
+                            coloraxis='coloraxis', hovertext=[abbrev_us_state.get(state, state) for state in states],
+                            hovertemplate='<b>%{hovertext}</b><br>Exposure Probability: %{z}%<extra></extra>')],
+        frames=[go.Frame(name=label, data=[go.Choropleth(z=z_values(dt))], traces=[0])
+                for dt, label in zip(anim_dates, labels)])
+
+    fig.update_layout(
+        title=chart_title,
+        autosize=True,
+        geo={'projection': {'type': 'albers usa'}},
+        margin={'b': 130, 'l': 0, 'r': 0, 't': 30},
+        coloraxis={
+            'colorscale': 'BuPu', 'cmin': 0, 'cmax': 10,
+            'colorbar': {
+                'title': {'text': 'Probability'},
+                'thickness': .035, 'thicknessmode': 'fraction', 'xpad': 5, 'ypad': 5,
+                'len': 0.75, 'lenmode': 'fraction',
+                'tickvals': [0, 2, 4, 6, 8, 10],
+                'ticktext': ['0%', '2%', '4%', '6%', '8%', '10%+']}},
+        updatemenus=[
+            {
+                "buttons": [
+                    {
+                        "args": [None, {"frame": {"duration": 0, "redraw": True},
+                                        "fromcurrent": True}],
+                        "label": "Play",
+                        "method": "animate"
+                    },
+                    {
+                        "args": [[None], {"frame": {"duration": 0, "redraw": False},
+                                          "mode": "immediate",
+                                          "transition": {"duration": 0}}],
+                        "label": "Pause",
+                        "method": "animate"
+                    }
+                ],
+                "direction": "left",
+                "pad": {"r": 10, "t": 50, 'b': 10},
+                "showactive": True,
+                "type": "buttons",
+                "x": 0.1,
+                "xanchor": "right",
+                "y": 0,
+                "yanchor": "top"
+            }
+        ],
+        sliders=[
+            {
+                'active': len(labels) - 1,
+                'currentvalue': {
+                    "font": {"size": 20, "family": 'Roboto'},
+                    "prefix": "<b>Date: ", "suffix": "</b>",
+                    "visible": True,
+                    "xanchor": "right"
                 },
-                {
-                    "args": [[None], {"frame": {"duration": 0, "redraw": False},
-                                      "mode": "immediate",
-                                      "transition": {"duration": 0}}],
-                    "label": "Pause",
-                    "method": "animate"
-                }
-            ],
-            "direction": "left",
-            "pad": {"r": 10, "t": 50, 'b': 10},
-            "showactive": True,
-            "type": "buttons",
-            "x": 0.1,
-            "xanchor": "right",
-            "y": 0,
-            "yanchor": "top"
-        }
-    ]
-
-    fig_dict["layout"]["sliders"][0]['currentvalue'] = {
-        "font": {"size": 20, "family": 'Roboto'},
-        "prefix": "<b>Date: ", "suffix": "</b>",
-        "visible": True,
-        "xanchor": "right"
-    }
-    fig_dict["layout"]["sliders"][0]['len'] = 0.95
-    fig_dict['layout']['sliders'][0]['pad'] = {'b': 10, 't': 20, 'l': 10, 'r': 10}
-    fig_dict['layout']['sliders'][0]['transition'] = {"duration": 0, "easing": "linear"}
-    fig_dict['layout']['margin'] = {'b': 130, 'l': 0, 'r': 0, 't': 30}
-    fig_dict['layout']['coloraxis']['colorbar'] = {
-        'thickness': .035, 'thicknessmode': 'fraction', 'xpad': 5, 'ypad': 5,
-        'len': 0.75, 'lenmode': 'fraction',
-        # 'title':'Exposure Probability',
-        'tickvals':[0, 2, 4, 6, 8, 10],
-        'ticktext':['0%', '2%', '4%', '6%', '8%', '10%+']}
-
-    for frame in range(len(fig.frames)):
-        this_ht = fig_dict['frames'][frame]['data'][0]['hovertemplate'].replace('<br>dt=', '')
-        this_ht = this_ht.replace('<br>state=%{location}<extra></extra>', '%')
-        this_ht = this_ht.replace('Probability=', 'Exposure Probability: ')
-        fig_dict['frames'][frame]['data'][0]['hovertemplate'] = this_ht
-
-
-    fig = go.Figure(fig_dict)
-    fig.layout.sliders[0]['active'] = len(fig.frames) - 1
-    fig.update_traces(z=fig.frames[-1].data[0].z,
-                     hovertemplate=fig.frames[-1].data[0].hovertemplate)
+                'len': 0.95,
+                'pad': {'b': 10, 't': 20, 'l': 10, 'r': 10},
+                'transition': {"duration": 0, "easing": "linear"},
+                'x': 0.1, 'xanchor': 'left', 'y': 0, 'yanchor': 'top',
+                'steps': [frame_step(label) for label in labels]
+            }
+        ])
 
     return fig
 
@@ -1098,14 +1147,18 @@ def ch_statemap2(df_chart, region_name, scale_max, counties, fitbounds='location
 
     return fig
 
-def ch_statemap_casechange(model_dict, df_counties, counties_geo, fitbounds='locations'):
+def ch_statemap_casechange(model_dict, df_counties, counties_geo, fitbounds='locations', df_county_reg=None):
+    from covid_data_helper import get_county_registry, county_labels
+    if df_county_reg is None:
+        df_county_reg = get_county_registry()
     region_name = model_dict['region_name']
 
     df_chart = df_counties['cases_per100k']
-    df_chart = df_chart.unstack(['state', 'county', 'fips']).diff(periods=14)
+    df_chart = df_chart.unstack('cty_code').diff(periods=14)
     df_chart = df_chart.dropna(how='all', axis=1)
-    df_chart = df_chart.apply(lambda x: x[x.last_valid_index()]).reset_index()
-    df_chart = df_chart.rename(columns={0: 'cases_norm_14d_chg'})
+    df_chart = df_chart.apply(lambda x: x[x.last_valid_index()])
+    df_chart = pd.concat([county_labels(df_county_reg, df_chart.index),
+                          pd.Series(df_chart.to_numpy(), name='cases_norm_14d_chg')], axis=1)
     df_chart['county'] = df_chart['county'] + ', ' + df_chart['state']
 
     scale_max = df_chart.cases_norm_14d_chg.quantile(.9)
@@ -1158,13 +1211,17 @@ def ch_statemap_casechange(model_dict, df_counties, counties_geo, fitbounds='loc
 
     return fig
 
-def ch_statemap_casechange_anim(model_dict, df_counties, counties_geo, fitbounds='locations'):
+def ch_statemap_casechange_anim(model_dict, df_counties, counties_geo, fitbounds='locations', df_county_reg=None):
+    from covid_data_helper import get_county_registry, county_labels
+    if df_county_reg is None:
+        df_county_reg = get_county_registry()
     region_name = model_dict['region_name']
     df_chart = df_counties['cases_per100k']
-    df_chart = df_chart.unstack(['state', 'county', 'fips']).fillna(0).diff(periods=14)
+    df_chart = df_chart.unstack('cty_code').fillna(0).diff(periods=14)
     df_chart = df_chart.dropna(how='all', axis=1)
-    df_chart = df_chart.unstack('dt').reset_index().dropna()
+    df_chart = df_chart.unstack('dt').reset_index().dropna().reset_index(drop=True)
     df_chart = df_chart.rename(columns={0: 'cases_norm_14d_chg'})
+    df_chart = pd.concat([county_labels(df_county_reg, df_chart['cty_code']), df_chart], axis=1)
     # df_chart[(df_chart.dt + pd.Timedelta(days=1)).dt.day == 1] ## Last day of the month
     df_chart = df_chart[df_chart.dt.dt.day == df_chart.dt.max().day]
     df_chart['dt'] =df_chart.dt.dt.strftime('%B %d, %Y')
@@ -1203,138 +1260,192 @@ def ch_statemap_casechange_anim(model_dict, df_counties, counties_geo, fitbounds
     fig.update_geos(fitbounds='locations', visible=True, showsubunits=True, subunitcolor="black")
     return fig
 
-def calc_trend(series, threshold):
-    df = series.rolling(14).mean() - series.rolling(28).mean().fillna(0)
-    df = pd.cut(df.stack(), [-np.inf, -1*threshold, threshold, np.inf], labels=['▼','▶','▲'])
-    return df.unstack().iloc[-1]
-
-def tab_summary(df_st_testing_fmt, df_fore_allstates, df_census, df_wavg_rt_conf_allregs, df_hhs_hosp):
+# Summary table. summary_metrics() does the numbers: the testing metrics it needs are pulled out of the panel as one
+# (date, metric, state) array, forward-filled/differenced once in numpy, and every latest value, 14/28-day window
+# and trend class is read off the last summary_tail_days rows of that array. format_summary() turns the result
+# into the strings and html of the web table, so the table and its csv can be refreshed without touching charts.
+summary_tail_days = 90
+summary_testing_cols = ['deaths', 'cases', 'posNeg', 'hospitalizedCurrently', 'hospitalizedCumulative']
+
+def _ffill_rows(arr):
+    idx = np.where(np.isnan(arr), 0, np.arange(arr.shape[0]).reshape((-1,) + (1,) * (arr.ndim - 1)))
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    return np.take_along_axis(arr, idx, axis=0)
+
+def _diff_rows(arr):
+    return np.concatenate([np.full((1,) + arr.shape[1:], np.nan), arr[1:] - arr[:-1]])
+
+def _rolling_rows(arr, window, how='mean'):
+    # Trailing window ending at each row, nan unless the whole window is there (pandas rolling(window)).
+    from numpy.lib.stride_tricks import sliding_window_view
+    out = np.full(arr.shape, np.nan)
+    if arr.shape[0] >= window:
+        windows = sliding_window_view(arr, window, axis=0)
+        out[window - 1:] = windows.mean(axis=-1) if how == 'mean' else windows.sum(axis=-1)
+    return out
+
+def trend_class(arr, threshold):
+    # 14-day mean less 28-day mean at the last row that has one, cut into ▼/▶/▲ at +/- threshold. Only rows whose
+    # 28-day window lies inside arr are looked at, so a tail gives the same answer as the full history.
+    diff = _rolling_rows(arr, 14) - np.nan_to_num(_rolling_rows(arr, 28), nan=0)
+    has_value = ~np.isnan(diff).all(axis=1)
+    has_value[:27] = False
+    codes = np.full(arr.shape[1], -1)
+    if has_value.any():
+        last = diff[np.flatnonzero(has_value)[-1]]
+        codes = np.select([last <= -threshold, last <= threshold, last > threshold], [0, 1, 2], -1)
+    return pd.Categorical.from_codes(codes, categories=['▼', '▶', '▲'], ordered=True)
+
+def _last_valid(df):
+    arr = df.to_numpy(dtype='float64')
+    return pd.Series(_ffill_rows(arr)[-1], index=df.columns) if arr.shape[0] else pd.Series(np.nan, index=df.columns)
+
+def summary_metrics(df_st_testing_fmt, df_fore_allstates, df_census, df_wavg_rt_conf_allregs, df_hhs_hosp,
+                    today=None):
+    if today is None:
+        today = pd.Timestamp.today()
     df_tab = df_census[df_census.SUMLEV == 40].copy()
     df_tab = df_tab.set_index('state')
+    pop = df_tab['pop2019'].to_numpy(dtype='float64')
+
+    # (date, metric, code) over every code in the panel, so the US positivity sees the same states as before.
+    codes = df_st_testing_fmt.columns.get_level_values(-1).unique().union(df_tab.index)
+    panel = df_st_testing_fmt.reindex(columns=pd.MultiIndex.from_product([summary_testing_cols, codes]))
+    panel = panel.to_numpy(dtype='float64').reshape(len(df_st_testing_fmt.index), len(summary_testing_cols), len(codes))
+    d_cols = {col: i_col for i_col, col in enumerate(summary_testing_cols)}
+    ffilled = _ffill_rows(panel)
+    admits = _ffill_rows(_diff_rows(panel[:, d_cols['hospitalizedCumulative']]))
+
+    # Everything below reads the tail only; the extra row gives the first tail diff its predecessor.
+    n_tail = min(summary_tail_days, panel.shape[0])
+    raw_tail = panel[-(n_tail + 1):]
+    ffill_tail = ffilled[-(n_tail + 1):]
+    i_state = codes.get_indexer(df_tab.index)
+
+    ffill_diff = _diff_rows(ffill_tail)[1:]
+    raw_diff = _diff_rows(raw_tail)[1:]
+    avg_14 = _rolling_rows(ffill_diff[:, :, i_state], 14)[-1]
+    latest = ffill_tail[-1][:, i_state]
+    cases_14 = _rolling_rows(raw_diff[:, d_cols['cases']], 14, 'sum')
+    tests_14 = _rolling_rows(raw_diff[:, d_cols['posNeg']], 14, 'sum')
+    admits_tail = admits[-n_tail:, i_state]
 
     # Days to Hosp Capacity
     # df_tab['hosp_cap'] = df_tab['pop2019'] / 1000 * 2.7 * 0.2
-    df_tab['hosp_cap'] = df_hhs_hosp['hosp_beds_avail'].unstack('state').fillna(method='ffill').iloc[-1] + \
-                         df_st_testing_fmt['hospitalizedCurrently'].fillna(method='ffill').iloc[-1]
-    df_hosp_concur = df_fore_allstates[[col for col in df_fore_allstates.columns if col != 'US']] \
-                        .unstack('dt').loc['hospitalized'].T.unstack(0).loc[
-                    pd.Timestamp.today() - pd.Timedelta(days=30):]
-    df_hosp_cap_rat = df_hosp_concur.div(df_tab.hosp_cap)
-    hosp_cap_dates = df_hosp_cap_rat.mask(df_hosp_cap_rat < 1).apply(lambda x: x.first_valid_index())
-    df_tab['Days to Hospital Capacity'] = (hosp_cap_dates-pd.Timestamp.today()).dt.days
-
-    # Deaths
-    df_tab['Total Deaths'] = df_st_testing_fmt['deaths'].fillna(method='ffill').iloc[-1]
-    df_tab['Total Deaths per 100k'] = df_tab['Total Deaths'].div(df_tab.pop2019).mul(1e5)
-    df_tab['14-Day Avg Daily Deaths'] = df_st_testing_fmt['deaths'].fillna(method='ffill').diff().rolling(14).mean().iloc[-1]
-    df_tab['14-Day Avg Daily Deaths per 100k'] = df_tab['14-Day Avg Daily Deaths'].div(df_tab.pop2019).mul(1e5)
-    df_tab['deaths_trend'] = calc_trend(
-        df_st_testing_fmt['deaths'].fillna(method='ffill').div(df_tab.pop2019).mul(1e5).diff(),
-        0.02)
-
-    # Cases
-    df_tab['Total Cases'] = df_st_testing_fmt['cases'].fillna(method='ffill').iloc[-1]
-    df_tab['Total Cases per 100k'] = df_tab['Total Cases'].div(df_tab.pop2019).mul(1e5)
-    df_tab['14-Day Avg Daily Cases'] = df_st_testing_fmt['cases'].fillna(method='ffill') \
-        .diff().rolling(14).mean().iloc[-1]
-    df_tab['14-Day Avg Daily Cases per 100k'] = df_tab['14-Day Avg Daily Cases'].div(df_tab.pop2019).mul(1e5)
-    df_tab['cases_trend'] = calc_trend(
-        df_st_testing_fmt['cases'].fillna(method='ffill').div(df_tab.pop2019).mul(1e5).diff(),
-        0.5)
-    # Positivity Rate
-    df_tab['Positivity Rate'] = df_st_testing_fmt['cases'].diff().rolling(14).sum().iloc[-1].div(
-        df_st_testing_fmt['posNeg'].diff().rolling(14).sum().iloc[-1])
-    df_tab['positivity_trend'] = calc_trend(
-        df_st_testing_fmt['cases'].diff().rolling(14).sum().div(
-            df_st_testing_fmt['posNeg'].diff().rolling(14).sum()),
-        0.005)
-    # Hospitalizations
-    df_tab['Hospitalized'] = df_st_testing_fmt['hospitalizedCurrently'].fillna(method='ffill').iloc[-1]
-    df_tab['Hospitalized per 100k'] = df_tab['Hospitalized'].div(df_tab.pop2019).mul(1e5)
-    df_tab['hospconcur_trend'] = calc_trend(
-        df_st_testing_fmt['hospitalizedCurrently'].fillna(method='ffill').div(df_tab.pop2019).mul(1e5),
-        0.5)
-    df_tab['14-Day Avg Daily Hosp Admits'] = df_st_testing_fmt['hospitalizedCumulative'].diff().fillna(method='ffill') \
-        .rolling(14).mean().iloc[-1]
-    df_tab['14-Day Avg Daily Hosp Admits per 100k'] = df_tab['14-Day Avg Daily Hosp Admits'].div(df_tab.pop2019).mul(1e5)
-    df_tab['hospadmits_trend'] = calc_trend(
-        df_st_testing_fmt['hospitalizedCumulative'].diff().fillna(method='ffill').div(df_tab.pop2019).mul(1e5),
-        0.05)
-
-    # df_tab.loc[:, [col for col in df_tab.columns if '_trend' in col]] = df_tab.loc[:, [col for col in df_tab.columns if '_trend' in col]].fillna('')
+    df_tab['hosp_cap'] = _last_valid(df_hhs_hosp['hosp_beds_avail'].unstack('state')) + \
+                         pd.Series(latest[d_cols['hospitalizedCurrently']], index=df_tab.index)
+    df_fore_states = df_fore_allstates[[col for col in df_fore_allstates.columns if col != 'US']]
+    df_hosp_concur = df_fore_states.xs('hospitalized', level='metric').sort_index() \
+        .loc[today - pd.Timedelta(days=30):].reindex(columns=df_tab.index)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        over_cap = df_hosp_concur.to_numpy(dtype='float64') / df_tab['hosp_cap'].to_numpy(dtype='float64') >= 1
+    days_to_cap = np.full(len(df_tab.index), np.nan)
+    if over_cap.shape[0]:
+        first_over = pd.DatetimeIndex(df_hosp_concur.index[over_cap.argmax(axis=0)])
+        days_to_cap = np.where(over_cap.any(axis=0), (first_over - today).days, np.nan)
+    df_tab['Days to Hospital Capacity'] = days_to_cap
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Deaths
+        df_tab['Total Deaths'] = latest[d_cols['deaths']]
+        df_tab['Total Deaths per 100k'] = df_tab['Total Deaths'].div(df_tab.pop2019).mul(1e5)
+        df_tab['14-Day Avg Daily Deaths'] = avg_14[d_cols['deaths']]
+        df_tab['14-Day Avg Daily Deaths per 100k'] = df_tab['14-Day Avg Daily Deaths'].div(df_tab.pop2019).mul(1e5)
+        df_tab['deaths_trend'] = trend_class(
+            _diff_rows(ffill_tail[:, d_cols['deaths'], i_state] / pop * 1e5)[1:], 0.02)
+
+        # Cases
+        df_tab['Total Cases'] = latest[d_cols['cases']]
+        df_tab['Total Cases per 100k'] = df_tab['Total Cases'].div(df_tab.pop2019).mul(1e5)
+        df_tab['14-Day Avg Daily Cases'] = avg_14[d_cols['cases']]
+        df_tab['14-Day Avg Daily Cases per 100k'] = df_tab['14-Day Avg Daily Cases'].div(df_tab.pop2019).mul(1e5)
+        df_tab['cases_trend'] = trend_class(
+            _diff_rows(ffill_tail[:, d_cols['cases'], i_state] / pop * 1e5)[1:], 0.5)
+        # Positivity Rate
+        positivity = cases_14 / tests_14
+        df_tab['Positivity Rate'] = positivity[-1, i_state]
+        df_tab['positivity_trend'] = trend_class(positivity[13:], 0.005)[i_state]
+        # Hospitalizations
+        df_tab['Hospitalized'] = latest[d_cols['hospitalizedCurrently']]
+        df_tab['Hospitalized per 100k'] = df_tab['Hospitalized'].div(df_tab.pop2019).mul(1e5)
+        df_tab['hospconcur_trend'] = trend_class(
+            ffill_tail[1:, d_cols['hospitalizedCurrently'], i_state] / pop * 1e5, 0.5)
+        df_tab['14-Day Avg Daily Hosp Admits'] = _rolling_rows(admits_tail, 14)[-1]
+        df_tab['14-Day Avg Daily Hosp Admits per 100k'] = df_tab['14-Day Avg Daily Hosp Admits'].div(df_tab.pop2019).mul(1e5)
+        df_tab['hospadmits_trend'] = trend_class(admits_tail / pop * 1e5, 0.05)
 
     # Modeled
-    df_tab['Model Est\'d Active Infections'] = \
-        df_fore_allstates[[col for col in df_fore_allstates.columns if col != 'US']] \
-            .unstack('dt').loc[['exposed', 'infectious']].T.sum(axis=1) \
-            .unstack(0).loc[pd.Timestamp.today().date()]
+    df_active = df_fore_states.xs('exposed', level='metric').fillna(0) \
+        .add(df_fore_states.xs('infectious', level='metric').fillna(0), fill_value=0)
+    df_tab['Model Est\'d Active Infections'] = df_active.loc[today.normalize()]
     df_tab['Model Est\'d Active Infections per 100k'] = df_tab['Model Est\'d Active Infections'].div(df_tab.pop2019).mul(1e5)
     df_tab = df_tab.sort_values(by='Model Est\'d Active Infections per 100k', ascending=False)
-    df_tab['Current Reproduction Rate (Rt)'] = df_wavg_rt_conf_allregs.unstack('metric').swaplevel(axis=1)['rt'].fillna(method='ffill').iloc[-1]
-    # df_tab['rt'] = df_wavg_rt_conf_allregs.unstack('metric').swaplevel(axis=1)['rt'].fillna(method='ffill').iloc[-1]
-    # df_tab['Current Reproduction Rate (Rt)'] = '<span style="color: red">'
+    s_rt = _last_valid(df_wavg_rt_conf_allregs.xs('rt', level='metric').sort_index())
+    df_tab['Current Reproduction Rate (Rt)'] = s_rt
 
     df_tab = df_tab.reset_index()
     df_tab['Riskiest State Rank'] = df_tab.index + 1
+    df_tab = df_tab.rename(columns={'pop2019': 'Population'})
+
+    ## US Table ##
+    df_tab_us = pd.DataFrame(df_tab.select_dtypes('number').sum(skipna=False)).T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df_tab_us['Positivity Rate'] = np.nansum(cases_14[-1]) / np.nansum(tests_14[-1])
+    df_tab_us['Current Reproduction Rate (Rt)'] = s_rt.get('US', np.nan)
+    ##############
+
+    return df_tab, df_tab_us
+
+summary_format_dict = {
+    'Riskiest State Rank': '{0:.0f}',
+    'Population': '{0:,.0f}',
+    'Model Est\'d Active Infections per 100k': '{0:,.0f}',
+    'Current Reproduction Rate (Rt)': '{0:.2f}',
+    'Total Cases per 100k': '{0:,.0f}',
+    '14-Day Avg Daily Cases per 100k': '{0:,.1f}',
+    'Positivity Rate': '{:.1%}',
+    'Total Deaths per 100k': '{0:,.0f}',
+    '14-Day Avg Daily Deaths per 100k': '{0:,.1f}',
+    'Hospitalized per 100k': '{0:,.2f}',
+    '14-Day Avg Daily Hosp Admits per 100k': '{0:,.2f}',
+    'Model Est\'d Active Infections': '{0:,.0f}',
+    'Total Cases': '{0:,.0f}',
+    '14-Day Avg Daily Cases': '{0:,.1f}',
+    'Total Deaths': '{0:,.0f}',
+    '14-Day Avg Daily Deaths': '{0:,.1f}',
+    'Hospitalized': '{0:,.0f}',
+    '14-Day Avg Daily Hosp Admits': '{0:,.2f}',
+    'Days to Hospital Capacity': '{0:,.0f}'
+               }
+
+# (value column, trend column) pairs that get the trend arrow appended.
+summary_trend_cols = [
+    ('14-Day Avg Daily Deaths per 100k', 'deaths_trend'),
+    ('14-Day Avg Daily Cases per 100k', 'cases_trend'),
+    ('Positivity Rate', 'positivity_trend'),
+    ('Hospitalized per 100k', 'hospconcur_trend'),
+    ('14-Day Avg Daily Hosp Admits per 100k', 'hospadmits_trend'),
+    ('14-Day Avg Daily Deaths', 'deaths_trend'),
+    ('14-Day Avg Daily Cases', 'cases_trend'),
+    ('Hospitalized', 'hospconcur_trend'),
+    ('14-Day Avg Daily Hosp Admits', 'hospadmits_trend'),
+]
+
+def format_summary(df_tab, df_tab_us):
+    df_tab = df_tab.copy()
+    df_tab_us = df_tab_us.copy()
 
     # Formatting
     # df_tab['State'] = df_tab.county  # + ' (' + df_tab.state + ')'
     df_tab['State'] = '<a href="/forecasts/' + df_tab.state + '" target="_top">' + df_tab.county + '</a>'
-    dict_col_names = {'pop2019': 'Population'}
-    df_tab = df_tab.rename(columns=dict_col_names)
 
-    ## US Table ##
-    df_tab_us = pd.DataFrame(df_tab.sum(skipna=False)).T
-    df_tab_us['Positivity Rate'] = (df_st_testing_fmt['cases'].diff().rolling(14).sum().sum(axis=1).iloc[-1]
-                                    / df_st_testing_fmt['posNeg'].diff().rolling(14).sum().sum(axis=1).iloc[-1])
-    df_tab_us['Current Reproduction Rate (Rt)'] = df_wavg_rt_conf_allregs.unstack('metric').swaplevel(axis=1)['rt'].fillna(method='ffill')['US'].iloc[-1]
-    ##############
-
-    format_dict = {
-        'Riskiest State Rank': '{0:.0f}',
-        'Population': '{0:,.0f}',
-        'Model Est\'d Active Infections per 100k': '{0:,.0f}',
-        'Current Reproduction Rate (Rt)': '{0:.2f}',
-        'Total Cases per 100k': '{0:,.0f}',
-        '14-Day Avg Daily Cases per 100k': '{0:,.1f}',
-        'Positivity Rate': '{:.1%}',
-        'Total Deaths per 100k': '{0:,.0f}',
-        '14-Day Avg Daily Deaths per 100k': '{0:,.1f}',
-        'Hospitalized per 100k': '{0:,.2f}',
-        '14-Day Avg Daily Hosp Admits per 100k': '{0:,.2f}',
-        'Model Est\'d Active Infections': '{0:,.0f}',
-        'Total Cases': '{0:,.0f}',
-        '14-Day Avg Daily Cases': '{0:,.1f}',
-        'Total Deaths': '{0:,.0f}',
-        '14-Day Avg Daily Deaths': '{0:,.1f}',
-        'Hospitalized': '{0:,.0f}',
-        '14-Day Avg Daily Hosp Admits': '{0:,.2f}',
-        'Days to Hospital Capacity': '{0:,.0f}'
-                   }
-
-    for key, value in format_dict.items():
+    for key, value in summary_format_dict.items():
         df_tab[key] = df_tab[key].map(value.format)
         df_tab_us[key] = df_tab_us[key].map(value.format)
 
     ## Add Trend Arrows ##
-    df_tab['14-Day Avg Daily Deaths per 100k'] = df_tab['14-Day Avg Daily Deaths per 100k'] \
-                                                 + df_tab['deaths_trend'].astype(str)
-    df_tab['14-Day Avg Daily Cases per 100k'] = df_tab['14-Day Avg Daily Cases per 100k'] \
-                                                + df_tab['cases_trend'].astype(str)
-    df_tab['Positivity Rate'] = df_tab['Positivity Rate'] \
-                                + df_tab['positivity_trend'].astype(str)
-    df_tab['Hospitalized per 100k'] = df_tab['Hospitalized per 100k'] \
-                                      + df_tab['hospconcur_trend'].astype(str)
-    df_tab['14-Day Avg Daily Hosp Admits per 100k'] = df_tab['14-Day Avg Daily Hosp Admits per 100k'] \
-                                                      + df_tab['hospadmits_trend'].astype(str)
-    df_tab['14-Day Avg Daily Deaths'] = df_tab['14-Day Avg Daily Deaths'] \
-                                                 + df_tab['deaths_trend'].astype(str)
-    df_tab['14-Day Avg Daily Cases'] = df_tab['14-Day Avg Daily Cases'] \
-                                                + df_tab['cases_trend'].astype(str)
-    df_tab['Hospitalized'] = df_tab['Hospitalized'] \
-                                      + df_tab['hospconcur_trend'].astype(str)
-    df_tab['14-Day Avg Daily Hosp Admits'] = df_tab['14-Day Avg Daily Hosp Admits'] \
-                                                      + df_tab['hospadmits_trend'].astype(str)
+    for col, trend_col in summary_trend_cols:
+        df_tab[col] = df_tab[col] + df_tab[trend_col].astype(str)
     ######################
 
     rt_temp = df_tab['Current Reproduction Rate (Rt)'].copy()
@@ -1383,8 +1494,14 @@ def tab_summary(df_st_testing_fmt, df_fore_allstates, df_census, df_wavg_rt_conf
 
     return tab_html, df_tab, df_tab_us
 
+def tab_summary(df_st_testing_fmt, df_fore_allstates, df_census, df_wavg_rt_conf_allregs, df_hhs_hosp):
+    df_tab, df_tab_us = summary_metrics(df_st_testing_fmt, df_fore_allstates, df_census, df_wavg_rt_conf_allregs,
+                                        df_hhs_hosp)
+    return format_summary(df_tab, df_tab_us)
+
 
 def run_all_charts(model_dict, scenario_name='', pdf_out=False, show_charts=True, pub2web=False):
+    import matplotlib.pyplot as plt
     model_dict['chart_title'] = "{0}: {1} Scenario".format(
         model_dict['region_name'], scenario_name)
 
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import pandas as pd
+import numpy as np
+import os, sys, queue, threading
+
+from covid_data_helper import *
+from coronita_model_helper import make_region_bundles, make_model_dict_region, model_find_start, worker_budget
+from coronita_smoothing_helper import gaussian_weights
+from coronita_shm_helper import SharedPanels, attach_panels
+
+# Long-lived runner for per-region forecast and render jobs. Reference data (census, testing, hospital, policy,
+# mobility, county geo) is loaded once in the parent and handed to a pool of warm workers, which then take
+# 'forecast' and 'render' jobs for single regions off a local queue. The big panels go through shared memory
+# (coronita_shm_helper), so adding workers doesn't add copies of them.
+#
+# state_forecasts.py runs its nightly forecasts and COVIDoutlook state charts through it, then builds the pages
+# in its own process from the frames it already has. python coronita_job_runner.py [regions] runs it standalone.
+
+default_covid_params = {'d_incub': 3., 'd_infect': 4., 'mort_rt': 0.01, 'd_in_hosp': 11, 'hosp_rt': 0.04,
+                        'd_to_hosp': 7.0, 'd_in_hosp_mild': 11.0, 'icu_rt': 13./41., 'd_in_icu': 13.0,
+                        'vent_rt': 0.4, 'd_til_death': 30.0, 'policy_trigger': True, 'policy_trigger_once': True}
+
+render_chart_names = ['ch_positivetests', 'ch_totaltests', 'ch_postestshare', 'ch_rt_confid', 'ch_detection_rt',
+                      'ch_googmvmt', 'ch_exposed_infectious', 'ch_hosp_concur', 'ch_deaths_tot',
+                      'ch_population_share', 'ch_cumul_infections', 'ch_daily_exposures', 'ch_hosp_admits',
+                      'ch_daily_deaths']
+
+shared_panel_names = ['df_st_testing_fmt', 'df_hhs_hosp', 'df_counties']
+
+_worker_ref = {}
+
+def load_reference_data():
+    ref_data = {}
+    ref_data['df_census'] = get_census_pop()
+    ref_data['df_st_testing_fmt'] = get_covid19_tracking_panel()
+    ref_data['df_hhs_hosp'] = get_hhs_hosp()
+    try:
+        ref_data['df_interventions'] = get_state_policy_events()
+    except:
+        ref_data['df_interventions'] = pd.DataFrame()
+
+    df_goog_mob_us = get_goog_mvmt_us()
+    ref_data['df_goog_mob_state'] = get_goog_mvmt_state(df_goog_mob_us)
+
+    ref_data['df_counties'] = get_complete_county_data()
+    ref_data['df_county_reg'] = get_county_registry()
+    ref_data['counties_geo'] = get_counties_geo()
+    return ref_data
+
+def _init_job_worker(ref_data, render, panel_descriptors=None):
+    # Runs once per worker. Small reference frames arrive pickled through initargs; the shared panels arrive
+    # as descriptors and are attached as read-only views.
+    _worker_ref.clear()
+    _worker_ref.update(ref_data)
+    if panel_descriptors:
+        _worker_ref.update(attach_panels(panel_descriptors))
+
+    # Warm the kernels and, for render workers, the plotting stack so the first job doesn't pay for them.
+    for window, std in [(7, 1), (7, 2), (14, 2)]:
+        gaussian_weights(window, std)
+    if render:
+        import matplotlib
+        matplotlib.use('Agg')
+        import coronita_chart_helper
+        import web_gen_covidoutlook
+
+def forecast_region(region_code, covid_params=None, d_to_forecast=150, first_guess=None, n_workers=1):
+    if covid_params is None:
+        covid_params = default_covid_params
+    ref = _worker_ref
+    bundle = make_region_bundles(abbrev_us_state, ref['df_census'], ref['df_st_testing_fmt'], ref['df_hhs_hosp'],
+                                 df_mvmt=ref['df_goog_mob_state'], df_interventions=ref['df_interventions'],
+                                 regions=[region_code])[region_code]
+    model_dict = make_model_dict_region(bundle, covid_params, d_to_forecast)
+
+    if first_guess is None:
+        local_r0_date = model_dict['df_rts'].loc['2020-02-01':'2020-04-30', 'weighted_average'].idxmax()
+        first_guess = local_r0_date - pd.Timedelta(days=28)
+
+    model_dict = model_find_start(first_guess, model_dict, n_workers=n_workers)
+    model_dict['chart_title'] = r'No Change in Future $R_{t}$ Until Reaching Hospital Capacity Triggers Lockdown'
+    return model_dict
+
+def render_region(model_dict, out_dir='../COVIDoutlook', footnote_str=None):
+    # A region's COVIDoutlook charts, drawn the way web_gen_covidoutlook.py draws them (style and footnotes).
+    import matplotlib.pyplot as plt
+    import coronita_chart_helper
+    from web_gen_covidoutlook import covidoutlook_style, footnote_str_maker, add_plotly_footnote
+
+    plt.style.use(covidoutlook_style)
+    ref = _worker_ref
+    region_code = model_dict['region_code']
+    if footnote_str is None:
+        footnote_str = footnote_str_maker()
+    model_dict['footnote_str'] = footnote_str
+
+    l_files = []
+    fig = coronita_chart_helper.ch_statemap_casechange(model_dict, ref['df_counties'], ref['counties_geo'],
+                                                       df_county_reg=ref['df_county_reg'])
+    fig = add_plotly_footnote(fig)
+    filename = os.path.join(out_dir, 'forecasts/plotly/{}_casepercap_cnty_map.html'.format(region_code))
+    fig.write_html(filename, include_plotlyjs='cdn')
+    l_files.append(filename)
+
+    for ch_name in render_chart_names:
+        try:
+            getattr(coronita_chart_helper, ch_name)(model_dict)
+            filename = os.path.join(out_dir, 'assets/images/covid19/{}_{}.png'.format(region_code, ch_name))
+            plt.savefig(filename, bbox_inches='tight')
+            l_files.append(filename)
+        except:
+            print('Couldn\'t create {} {} chart.'.format(region_code, ch_name))
+        finally:
+            plt.close('all')
+    return l_files
+
+job_fns = {'forecast': forecast_region, 'render': render_region}
+
+class JobRunner:
+    # Feeds jobs from a local queue into a pool of warm workers. A job is (job_type, region_code, kwargs).
+    # Finished forecasts land in model_dicts and, with chain_render, queue that region's render job.
+
+    def __init__(self, ref_data=None, n_workers=None, render=True, chain_render=True, render_kwargs=None,
+                 shared_panels=True):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        if ref_data is None:
+            ref_data = load_reference_data()
+        if n_workers is None:
+            n_workers = worker_budget()
+        # Platform default start method; workers get the reference data through initargs and shared memory.
+        mp_context = multiprocessing.get_context()
+
+        # Regions already run side by side in the pool; each one's start-date search gets its share of the budget.
+        self.search_workers = worker_budget(n_workers)
+        self.chain_render = chain_render and render
+        self.render_kwargs = render_kwargs or {}
+        self.model_dicts = {}
+        self.rendered = {}
+        self.errors = {}
+        self.jobs = queue.Queue()
+        self._lock = threading.Lock()
+
+        self._panels = None
+        panel_descriptors = None
+        if shared_panels:
+            self._panels = SharedPanels({name: ref_data[name] for name in shared_panel_names if name in ref_data})
+            panel_descriptors = self._panels.descriptors
+            ref_data = {name: value for name, value in ref_data.items() if name not in panel_descriptors}
+        self._pool = ProcessPoolExecutor(max_workers=n_workers, mp_context=mp_context, initializer=_init_job_worker,
+                                         initargs=(ref_data, render, panel_descriptors))
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    def put(self, job_type, region_code, **kwargs):
+        if job_type not in job_fns:
+            raise ValueError('Unknown job type: {}'.format(job_type))
+        self.jobs.put((job_type, region_code, kwargs))
+
+    def _dispatch(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                return
+            job_type, region_code, kwargs = job
+            try:
+                if job_type == 'render' and 'model_dict' not in kwargs:
+                    with self._lock:
+                        kwargs = dict(kwargs, model_dict=self.model_dicts[region_code])
+                if job_type == 'forecast':
+                    kwargs = dict({'n_workers': self.search_workers}, **kwargs)
+                    future = self._pool.submit(job_fns[job_type], region_code, **kwargs)
+                else:
+                    future = self._pool.submit(job_fns[job_type], **kwargs)
+            except Exception as e:
+                print('Couldn\'t start {} job for {}: {}'.format(job_type, region_code, e))
+                with self._lock:
+                    self.errors[(job_type, region_code)] = e
+                self.jobs.task_done()
+                continue
+            future.add_done_callback(
+                lambda f, job_type=job_type, region_code=region_code: self._job_done(job_type, region_code, f))
+
+    def _job_done(self, job_type, region_code, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            print('{} job for {} failed: {}'.format(job_type, region_code, e))
+            with self._lock:
+                self.errors[(job_type, region_code)] = e
+        else:
+            with self._lock:
+                if job_type == 'forecast':
+                    self.model_dicts[region_code] = result
+                else:
+                    self.rendered[region_code] = result
+            if job_type == 'forecast' and self.chain_render:
+                self.put('render', region_code, **self.render_kwargs)
+        finally:
+            # Chained jobs are queued before this one is marked done, so join() also waits for them.
+            self.jobs.task_done()
+
+    def join(self):
+        self.jobs.join()
+        return self.model_dicts
+
+    def close(self):
+        self.jobs.put(None)
+        self._dispatcher.join()
+        self._pool.shutdown()
+        if self._panels is not None:
+            self._panels.close()
+
+if __name__ == '__main__':
+    runner = JobRunner()
+    regions = sys.argv[1:] or list(get_census_pop().state.unique())
+    for region_code in regions:
+        runner.put('forecast', region_code)
+    runner.join()
+    runner.close()
+    print('Forecast {} regions, rendered {}, {} failed jobs.'.format(
+        len(runner.model_dicts), len(runner.rendered), len(runner.errors)))
@@ -1,35 +1,48 @@
 import pandas as pd
 import numpy as np
+import os
 from scipy.stats import gamma
-from statsmodels.stats.weightstats import DescrStatsW
+from coronita_smoothing_helper import gaussian_smooth, gaussian_smooth_std
 # from coronita_chart_helper import *
 
-def outlier_removal(raw_series, num_std=3):
-    rolling_avg = raw_series.rolling(7, center=True, min_periods=3).mean().fillna(method='bfill').fillna(method='ffill')
-    noise = raw_series - rolling_avg
-    cleaned_series = raw_series[(np.abs(noise) < (noise.std() * num_std))].reindex(raw_series.index)
-
-    outlier_idx = raw_series[(np.abs(noise) >= (noise.std() * num_std))].index
-    if outlier_idx.shape[0] > 0:
-        before_first_outlier = raw_series.loc[:outlier_idx[0]].iloc[:-1]
-        after_last_outlier = raw_series.loc[outlier_idx[-1]:].iloc[1:]
-
-        if ((before_first_outlier.shape[0] > 1)
-                and (before_first_outlier.sum() == 0)
-                and (before_first_outlier.std() == 0)):
-            cleaned_series.loc[:outlier_idx[0]] = np.nan
-
-        if ((after_last_outlier.shape[0] > 1)
-                and (after_last_outlier.sum() == 0)
-                and (after_last_outlier.std() == 0)):
-            cleaned_series.loc[:outlier_idx[0]] = np.nan
+def outlier_removal_frame(df_raw, num_std=3):
+    # Cleans every column of df_raw at once. A point is an outlier when its distance from the centered 7-day mean
+    # is at least num_std (scalar or one per column) standard deviations of that column's noise. Returns the
+    # cleaned frame and, per column, the share of observations that survived.
+    raw = df_raw.to_numpy(dtype='float64')
+    n_rows = raw.shape[0]
+    rolling_avg = df_raw.rolling(7, center=True, min_periods=3).mean().fillna(method='bfill').fillna(method='ffill')
+    noise = raw - rolling_avg.to_numpy(dtype='float64')
+
+    with np.errstate(invalid='ignore'):
+        noise_std = np.nanstd(noise, axis=0, ddof=1)
+        threshold = noise_std * np.asarray(num_std, dtype='float64')
+        is_outlier = np.abs(noise) >= threshold
+        cleaned = np.where(np.abs(noise) < threshold, raw, np.nan)
+
+    # If the series is flat at zero before the first outlier (or after the last one), the outlier is the start
+    # of reporting rather than noise, so blank everything up to and including the first outlier.
+    has_outlier = is_outlier.any(axis=0)
+    first_outlier = np.where(has_outlier, is_outlier.argmax(axis=0), n_rows)
+    last_outlier = np.where(has_outlier, n_rows - 1 - is_outlier[::-1].argmax(axis=0), -1)
+    row_num = np.arange(n_rows)[:, None]
+
+    def flat_zero(segment):
+        is_obs = ~np.isnan(raw) & segment
+        return (is_obs.sum(axis=0) > 1) & ~((raw != 0) & is_obs).any(axis=0)
+
+    blank_start = has_outlier & (flat_zero(row_num < first_outlier) | flat_zero(row_num > last_outlier))
+    cleaned[(row_num <= first_outlier) & blank_start] = np.nan
+    cleaned[cleaned == 0] = np.nan
+
+    df_cleaned = pd.DataFrame(cleaned, index=df_raw.index, columns=df_raw.columns)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        s_retained = pd.Series((~np.isnan(cleaned)).sum(axis=0) / (~np.isnan(raw)).sum(axis=0), index=df_raw.columns)
+    return df_cleaned, s_retained
 
-    firstnonzero = cleaned_series.replace(0, np.nan).first_valid_index()
-    cleaned_series.loc[:firstnonzero] = cleaned_series.replace(0, np.nan)
-    lastnonzero = cleaned_series.replace(0, np.nan).first_valid_index()
-    cleaned_series.loc[lastnonzero:] = cleaned_series.replace(0, np.nan)
-
-    return cleaned_series
+def outlier_removal(raw_series, num_std=3):
+    df_cleaned, _ = outlier_removal_frame(raw_series.to_frame(), num_std=num_std)
+    return df_cleaned.iloc[:, 0].rename(raw_series.name)
 
 def lvl_adj_forecast(s_hist_lvl, s_fore_lvl): #lvl_adj_forecast(model_dict, hist_lvl_name, fore_lvl_name):
     # df_agg = model_dict['df_agg'].copy()
@@ -51,6 +64,39 @@ def lvl_adj_forecast(s_hist_lvl, s_fore_lvl): #lvl_adj_forecast(model_dict, hist
 
     return fore_lvl_adjusted
 
+class LevelAdjuster:
+    # Incremental lvl_adj_forecast for a forecast filled in one day at a time from fore_start_dt. Days after the
+    # last historical observation are shifted so the forecast continues from the observed level; each step is
+    # O(1) and adjust_array() gives the same result as lvl_adj_forecast on the finished series.
+    def __init__(self, s_hist_lvl, fore_start_dt):
+        hist_last_day = s_hist_lvl.last_valid_index()
+        self.hist_last = None
+        self.base_pos = 0
+        self.base_value = None
+        if hist_last_day is not None:
+            self.hist_last = s_hist_lvl.loc[hist_last_day]
+            self.base_pos = max(int(np.ceil((hist_last_day - pd.Timestamp(fore_start_dt)) / pd.Timedelta(days=1))), 0)
+
+    def step(self, t_, fore_value):
+        if t_ == self.base_pos:
+            self.base_value = fore_value
+        if (self.hist_last is None) or (t_ <= self.base_pos):
+            return fore_value
+        return self.hist_last + fore_value - self.base_value
+
+    def adjust_array(self, fore_lvl):
+        fore_lvl = np.asarray(fore_lvl, dtype='float64')
+        adjusted = fore_lvl.copy()
+        if (self.hist_last is not None) and (self.base_pos < fore_lvl.shape[0]):
+            adjusted[self.base_pos + 1:] = self.hist_last + fore_lvl[self.base_pos + 1:] - fore_lvl[self.base_pos]
+        return adjusted
+
+    def adjust_at(self, t_, fore_lvl):
+        # Adjusted value on day t_ alone; fore_lvl only needs to be final up to t_.
+        if (self.hist_last is None) or (t_ <= self.base_pos):
+            return fore_lvl[t_]
+        return self.hist_last + fore_lvl[t_] - fore_lvl[self.base_pos]
+
 def normal_hosp_cap(model_dict):
     covid_hosp_capacity = model_dict['df_hist']['hosp_beds_avail'].replace(0, np.nan).dropna()
     covid_hosp_capacity = covid_hosp_capacity + model_dict['df_hist']['hosp_concur'].dropna()
@@ -162,180 +208,354 @@ def daily_cohort_model(cohort_strt, d_to_fore, covid_params, E_0, I_0=0):
 
     return df_out
 
-def seir_model_cohort(start_dt, model_dict, exposed_0=100, infectious_0=100):
-    suspop = [model_dict['tot_pop'] - exposed_0 - infectious_0]
-    next_infectious = infectious_0
-    next_hospitalized = 0
-    _gamma = 1 / (model_dict['covid_params']['d_infect'])
-
-    t = np.linspace(0, model_dict['d_to_forecast'], model_dict['d_to_forecast'] + 1)
-
-    df_all_cohorts = pd.DataFrame()
-    df_all_cohorts.columns.name = 'cohort_dt'
-
-    r_t = pd.Series(np.nan, index=pd.date_range(start_dt,
-                                                start_dt + pd.Timedelta(days=model_dict['d_to_forecast']) ) )
+cohort_metrics = ['exposed', 'infectious', 'recovered', 'hospitalized', 'deaths', 'hosp_admits', 'icu', 'vent']
+cohort_pop_metrics = ['exposed', 'deaths', 'hospitalized', 'infectious', 'recovered']
 
+def covid_hosp_capacity(model_dict):
+    if 'hosp_beds_avail' in model_dict['df_hist'].columns:
+        covid_hosp_capacity = model_dict['df_hist']['hosp_beds_avail'].replace(0,np.nan).rolling(7).mean().dropna().iloc[-1]
+        covid_hosp_capacity = covid_hosp_capacity + model_dict['df_hist']['hosp_concur'].dropna().iloc[-1]
+    else:
+        tot_hosp_capacity = model_dict['tot_pop']/1000 * 2.7
+        covid_hosp_capacity = tot_hosp_capacity * 0.2
+    return covid_hosp_capacity
+
+# How seir_model_cohort checks its population invariants: 'fast' once over the finished arrays, 'strict' after
+# every simulated day (stops at the first bad day, for debugging). Set COVID_VALIDATION or pass validation=.
+cohort_validation = os.environ.get('COVID_VALIDATION', 'fast')
+
+def prefix_std(x):
+    # std(x[:n], ddof=1) for every n, from running sums of the deviations from x[0]; nan for n < 2.
+    dev = x - x[0]
+    n = np.arange(1, x.shape[0] + 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var = (np.cumsum(np.square(dev)) - np.square(np.cumsum(dev)) / n) / (n - 1)
+    return np.where(n > 1, np.sqrt(np.clip(var, 0, None)), np.nan)
+
+def check_cohort_invariants(start_dt, tot_pop, cohort_pop_std, agg_pop, suspop_end, first_day=0):
+    # Each cohort keeps its population over time (the std of its daily totals rounds to 0), and cohorts plus
+    # susceptibles add up to tot_pop. Arrays run per day from first_day; strict mode passes one day at a time.
+    bad = np.flatnonzero(np.round(cohort_pop_std, 1) != 0.0)
+    if bad.shape[0] > 0:
+        t_ = first_day + bad[0]
+        raise Exception('Daily Cohort total population varies significantly: cohort of {} has a std of {} '
+                        'across its days (bad cohorts: {})'.format(
+                            (start_dt + pd.Timedelta(days=int(t_))).strftime('%Y-%m-%d'),
+                            round(cohort_pop_std[bad[0]], 1), bad.shape[0]))
+
+    bad = np.flatnonzero(np.abs((agg_pop + suspop_end) / tot_pop - 1) > 1e-4)
+    if bad.shape[0] > 0:
+        t_ = first_day + bad[0]
+        raise Exception('Agg total population varies by more than 0.01% on {}: cohorts {} + susceptible {} = {} '
+                        'vs totpop {} (bad days: {})'.format(
+                            (start_dt + pd.Timedelta(days=int(t_))).strftime('%Y-%m-%d'), round(agg_pop[bad[0]]),
+                            round(suspop_end[bad[0]]), round(agg_pop[bad[0]] + suspop_end[bad[0]]), round(tot_pop),
+                            bad.shape[0]))
+
+def seir_model_cohort(start_dt, model_dict, exposed_0=100, infectious_0=100, fit_bound=None, validation=None):
+    # The daily loop works on integer day offsets from start_dt and plain arrays. agg[t, m] holds the sum over
+    # cohorts of metric m on day t; cohort k contributes cohort_scale[k] * the unit cohort from day k onwards.
+    # With a FitBound the run raises SimulationAborted as soon as it can no longer win a start-date search.
+    start_dt = pd.Timestamp(start_dt)
+    n_days = model_dict['d_to_forecast']
+    tot_pop = model_dict['tot_pop']
+    strict = (validation or cohort_validation) == 'strict'
+    covid_params = model_dict['covid_params']
+    _gamma = 1 / (covid_params['d_infect'])
+    one_day = pd.Timedelta(days=1)
+
+    m_idx = {metric: i for i, metric in enumerate(cohort_metrics)}
+    pop_cols = [m_idx[metric] for metric in cohort_pop_metrics]
+    i_rec, i_inf, i_hosp = m_idx['recovered'], m_idx['infectious'], m_idx['hospitalized']
+
+    dates = pd.date_range(start_dt, start_dt + pd.Timedelta(days=n_days))
+
+    r_t = pd.Series(np.nan, index=dates)
     if 'rt_scenario' in model_dict['df_rts'].columns:
         r_t = r_t.fillna(model_dict['df_rts']['rt_scenario']).fillna(method='bfill').fillna(method='ffill')
     else:
         local_r0_date = model_dict['df_rts'].loc['2020-02-01':'2020-04-30', 'weighted_average'].idxmax()
-        # print('local_r0_date: ', local_r0_date)
         r_t = r_t.fillna(model_dict['df_rts'].loc[local_r0_date:, 'weighted_average'])
         r_t = r_t.fillna(method='bfill').fillna(method='ffill')
+    r_t = r_t.to_numpy(dtype='float64').copy()
 
     last_obs_rt = model_dict['df_rts']['weighted_average'].last_valid_index()
+    last_obs_pos = (last_obs_rt - start_dt) / one_day
 
-    model_dict['df_rts'] = model_dict['df_rts'].reindex(r_t.index)
-    model_dict['df_rts']['policy_triggered'] = 0
+    model_dict['df_rts'] = model_dict['df_rts'].reindex(dates)
+    policy_triggered = np.zeros(n_days + 1, dtype='int64')
+    n_policy_triggered = 0
     model_dict['hosp_cap_dt'] = None
+    hosp_capacity = None
 
-    last_r = r_t.iloc[0]
+    hosp_adjuster = LevelAdjuster(model_dict['df_hist'].get('hosp_concur', pd.Series(dtype='float64')), start_dt)
+    deaths_adjuster = LevelAdjuster(model_dict['df_hist']['deaths_tot'], start_dt)
+    i_deaths = m_idx['deaths']
 
-    for t_ in t[:-1]:
-        cohort_strt = start_dt + pd.Timedelta(days=t_)
-
-        if (model_dict['covid_params']['policy_trigger']
-                and (cohort_strt > last_obs_rt) ):
+    if 'vaccine_prop_t' in model_dict.keys():
+        loop_dates = dates[:-1]
+        vax_new = model_dict['vaccine_prop_t'].diff().reindex(loop_dates - pd.Timedelta(days=7)).to_numpy() * tot_pop
+        vax_prev = model_dict['vaccine_prop_t'].reindex(loop_dates - one_day).to_numpy()
+        vax_new, vax_prev = np.nan_to_num(vax_new), np.nan_to_num(vax_prev)
+    else:
+        vax_new = vax_prev = np.zeros(n_days)
+    # Without negative vaccination steps susceptibles only ever fall, so a low share early stays low.
+    susceptible_falls = not np.any(vax_new < 0)
+
+    # Unit cohort (1e6 newly exposed) reused for every cohort after the first, and the seed cohort itself.
+    unit_cohort = daily_cohort_model(start_dt, n_days + 1, covid_params, E_0=1e6, I_0=0)[cohort_metrics].to_numpy() / 1e6
+    seed_cohort = daily_cohort_model(start_dt, n_days + 1, covid_params,
+                                     E_0=exposed_0, I_0=infectious_0)[cohort_metrics].to_numpy()
+    # unit_pop_std[n] is the std of the unit cohort's total population over its first n days.
+    unit_pop_std = np.append(np.nan, prefix_std(unit_cohort[:, pop_cols].sum(axis=1)))
+    seed_pop_std = seed_cohort[:, pop_cols].sum(axis=1).std(ddof=1)
+
+    agg = np.zeros((n_days + 1, len(cohort_metrics)))
+    cohort_scale = np.zeros(n_days)
+    vax_recovered = np.zeros(n_days)
+    suspop = np.zeros(n_days + 1)
+    suspop[0] = tot_pop - exposed_0 - infectious_0
+    next_suspop = suspop_lastdayofobs = suspop[0]
+    next_infectious = infectious_0
+    next_hospitalized = 0
 
-            if 'hosp_beds_avail' in model_dict['df_hist'].columns:
-                covid_hosp_capacity = model_dict['df_hist']['hosp_beds_avail'].replace(0,np.nan).rolling(7).mean().dropna().iloc[-1]
-                covid_hosp_capacity = covid_hosp_capacity + model_dict['df_hist']['hosp_concur'].dropna().iloc[-1]
-            else:
-                tot_hosp_capacity = model_dict['tot_pop']/1000 * 2.7
-                covid_hosp_capacity = tot_hosp_capacity * 0.2
-
-            if ( (next_hospitalized > covid_hosp_capacity)
-                    or (model_dict['covid_params']['policy_trigger_once']
-                        and model_dict['df_rts']['policy_triggered'].sum() > 1) ):
-                r_t.loc[cohort_strt] = 0.9
-                model_dict['df_rts'].loc[cohort_strt, 'policy_triggered'] = 1
+    for t_ in range(n_days):
+        if (covid_params['policy_trigger']
+                and (t_ > last_obs_pos) ):
+            if hosp_capacity is None:
+                hosp_capacity = covid_hosp_capacity(model_dict)
+
+            if ( (next_hospitalized > hosp_capacity)
+                    or (covid_params['policy_trigger_once']
+                        and n_policy_triggered > 1) ):
+                r_t[t_] = 0.9
+                policy_triggered[t_] = 1
+                n_policy_triggered += 1
                 if model_dict['hosp_cap_dt'] == None:
-                    model_dict['hosp_cap_dt'] = cohort_strt
+                    model_dict['hosp_cap_dt'] = start_dt + pd.Timedelta(days=t_)
 
         # ACCOUNT FOR EFFECT OF IMMUNITY IN FORECAST PERIOD #
-        # Math:
-        # rt / (suspop_lastdayofobs / tot_pop) * (suspop_t / tot_pop)
-        # rt * (tot_pop / suspop_lastdayofobs) * (suspop_t / tot_pop)
-        # # tot_pop cancels
-        # rt * suspop_t / suspop_lastdayofobs
-        if cohort_strt == last_obs_rt:
+        # rt / (suspop_lastdayofobs / tot_pop) * (suspop_t / tot_pop) = rt * suspop_t / suspop_lastdayofobs
+        if t_ == last_obs_pos:
             suspop_lastdayofobs = next_suspop
-        elif (cohort_strt > last_obs_rt):
-            suspop_t = next_suspop #df_agg.loc[cohort_strt - pd.Timedelta(days=1), 'susceptible']
-            r_t.loc[cohort_strt] = r_t.loc[cohort_strt] * (suspop_t / suspop_lastdayofobs)
+        elif t_ > last_obs_pos:
+            r_t[t_] = r_t[t_] * (next_suspop / suspop_lastdayofobs)
 
-        this_r = r_t.loc[cohort_strt]
-        beta = this_r * _gamma
-
-        d_to_fore = t[-1] - t_ + 1
-
-        if this_r != last_r:
-            last_r = this_r
+        beta = r_t[t_] * _gamma
+        d_to_fore = n_days + 1 - t_
 
         if t_ == 0:
             dS = 0
-
-            df_daily_cohort = daily_cohort_model(
-                cohort_strt, d_to_fore,
-                model_dict['covid_params'], E_0=exposed_0, I_0=infectious_0)
-
-            df_all_cohorts[cohort_strt] = df_daily_cohort.stack()
-
-            df_daily_cohort_scalar = daily_cohort_model(
-                cohort_strt, d_to_fore,
-                model_dict['covid_params'], E_0=1e6, I_0=0).reset_index(drop=True)
-
+            agg += seed_cohort
         else:
-            # dS = -1 * min(beta * suspop[-1] * next_infectious / model_dict['tot_pop'], suspop[-1])
-            dS = -1 * min(beta * next_infectious , suspop[-1])
-
-            df_daily_cohort = dS * -1 * df_daily_cohort_scalar.iloc[:int(d_to_fore)] / 1e6
-
-            df_daily_cohort.index = pd.date_range(cohort_strt,
-                                                  cohort_strt + pd.Timedelta(days=d_to_fore - 1))
-            df_all_cohorts[cohort_strt] = df_daily_cohort.stack()
-            # print(cohort_strt, ' rt: ', this_r)
-
-        d_cohort_totpop_std = round(df_daily_cohort[
-                                        ['exposed', 'deaths', 'hospitalized', 'infectious', 'recovered']
-                                    ].dropna().sum(axis=1).std(), 1)
-
-        if d_cohort_totpop_std != 0.0:
-            print(cohort_strt, d_cohort_totpop_std)
-            print(df_daily_cohort)
-            raise Exception('Daily Cohort total population varies significantly')
-
-
-        df_agg = df_all_cohorts.sum(axis=1).unstack()
-        df_agg.index = pd.DatetimeIndex(df_agg.index).normalize()
+            dS = -1 * min(beta * next_infectious, suspop[t_])
+            cohort_scale[t_] = -1 * dS
+            agg[t_:] += cohort_scale[t_] * unit_cohort[:d_to_fore]
 
         # VACCINE IMPACT #
-        if 'vaccine_prop_t' in model_dict.keys():
-            newly_vaccinated = model_dict['vaccine_prop_t'].diff().loc[cohort_strt - pd.Timedelta(days=7)] * model_dict['tot_pop']
-            # We need to make an adjustment for the fact that some people in the recovered population are also getting vaccinated.
-            prop_recovered = df_agg.loc[cohort_strt, 'recovered'] / model_dict['tot_pop']
-            prop_vaxxed = model_dict['vaccine_prop_t'].loc[cohort_strt - pd.Timedelta(days=1)]
-            # Proportion of population recovered by not yet vaccinated...
-            prop_recovered_unvax = prop_recovered - prop_vaxxed
-            new_justvax_recovered = newly_vaccinated * (1 - prop_recovered_unvax)
-        else:
-            new_justvax_recovered = 0
-        idx = pd.IndexSlice
-        df_all_cohorts.loc[idx[:, ['recovered']], cohort_strt] = df_all_cohorts.loc[idx[:, ['recovered']], cohort_strt] + new_justvax_recovered
-
-        df_agg = df_all_cohorts.sum(axis=1).unstack()
-        df_agg.index = pd.DatetimeIndex(df_agg.index).normalize()
-
-        next_infectious = df_agg.loc[cohort_strt, 'infectious']
-        # next_hospitalized = df_agg.loc[cohort_strt, 'hospitalized']
-        next_hospitalized = lvl_adj_forecast(model_dict['df_hist']['hosp_concur'], df_agg['hospitalized']).loc[cohort_strt]
-        next_suspop = max(suspop[-1] + dS - new_justvax_recovered, 0)
-        suspop.append(next_suspop)
-
-        totpopchk = df_agg.loc[cohort_strt, ['exposed', 'infectious', 'recovered', 'hospitalized', 'deaths']].sum()
-
-        # if (round(totpopchk + suspop[-1]) != round(model_dict['tot_pop'])):
-        if abs((totpopchk + suspop[-1]) / model_dict['tot_pop'] - 1) > 1e-4:
-            print(df_all_cohorts)
-            print(df_all_cohorts.sum(axis=1).unstack())
-            print(cohort_strt)
-            print('totpop: ', round(model_dict['tot_pop']))
-            print('dS ', dS)
-            print('sum of df_agg', totpopchk)
-            print('suspop[-1]', suspop[-1])
-            print('sum of both', round(totpopchk + suspop[-1]))
-            raise Exception('Agg total population varies by more than 0.01%')
-
+        # Some people in the recovered population are also getting vaccinated, so only count the share of
+        # newly vaccinated people who were not already recovered.
+        prop_recovered_unvax = agg[t_, i_rec] / tot_pop - vax_prev[t_]
+        new_justvax_recovered = vax_new[t_] * (1 - prop_recovered_unvax)
+        vax_recovered[t_] = new_justvax_recovered
+        agg[t_:, i_rec] += new_justvax_recovered
+
+        next_infectious = agg[t_, i_inf]
+        next_hospitalized = hosp_adjuster.step(t_, agg[t_, i_hosp])
+        next_suspop = max(suspop[t_] + dS - new_justvax_recovered, 0)
+        suspop[t_ + 1] = next_suspop
+
+        if strict:
+            cohort_pop_std = seed_pop_std if t_ == 0 else cohort_scale[t_] * unit_pop_std[d_to_fore]
+            check_cohort_invariants(start_dt, tot_pop, np.array([cohort_pop_std]),
+                                    agg[t_:t_ + 1, pop_cols].sum(axis=1), suspop[t_ + 1:t_ + 2], t_)
+
+        if fit_bound is not None:
+            if susceptible_falls:
+                fit_bound.check_susceptible(next_suspop)
+            if fit_bound.scores_day(t_):
+                deaths_t = deaths_adjuster.adjust_at(t_, agg[:, i_deaths])
+                fit_bound.add_day(t_, {'hospitalized': next_hospitalized, 'deaths': deaths_t,
+                                       'deaths_daily': deaths_t - deaths_adjuster.adjust_at(t_ - 1, agg[:, i_deaths])})
+
+    if not strict:
+        # Row t of agg is final once day t has run, so this sees exactly what the per-day checks would.
+        cohort_pop_std = np.append(seed_pop_std, cohort_scale[1:] * unit_pop_std[n_days + 1 - np.arange(1, n_days)])
+        check_cohort_invariants(start_dt, tot_pop, cohort_pop_std, agg[:n_days, pop_cols].sum(axis=1), suspop[1:])
+
+    model_dict['df_rts']['policy_triggered'] = policy_triggered
     model_dict['df_rts']['rt_scenario'] = r_t
 
-    df_agg = df_all_cohorts.sum(axis=1).unstack()
-    df_agg.index = pd.DatetimeIndex(df_agg.index).normalize()
-
-    s_suspop = pd.Series(suspop, index=pd.date_range(
-        start_dt - pd.Timedelta(days=1),
-        start_dt + pd.Timedelta(days=model_dict['d_to_forecast'] - 1)))
+    df_agg = pd.DataFrame(agg, index=dates.rename('dt'), columns=cohort_metrics)
+    df_agg.columns.name = 'metric'
 
-    df_agg['susceptible'] = pd.Series(s_suspop)
-    exposed_daily = df_all_cohorts.stack().unstack(['metric'])[['exposed']].reset_index()
-    df_agg['exposed_daily'] = exposed_daily[(exposed_daily.dt == exposed_daily.cohort_dt)].set_index(['dt'])['exposed']
+    # suspop[k] is the susceptible population at the end of day k - 1; the last day has no value.
+    df_agg['susceptible'] = np.append(suspop[1:], np.nan)
+    df_agg['exposed_daily'] = np.append(np.append(seed_cohort[0, m_idx['exposed']], cohort_scale[1:]), np.nan)
     df_agg['deaths_daily'] = df_agg['deaths'].diff()
 
     df_agg['hospitalized_fitted'] = df_agg['hospitalized']
-    df_agg['hospitalized'] = lvl_adj_forecast(model_dict['df_hist']['hosp_concur'], df_agg['hospitalized'])
+    df_agg['hospitalized'] = hosp_adjuster.adjust_array(agg[:, i_hosp])
     df_agg['deaths_fitted'] = df_agg['deaths']
-    df_agg['deaths'] = lvl_adj_forecast(model_dict['df_hist']['deaths_tot'], df_agg['deaths'])
+    df_agg['deaths'] = deaths_adjuster.adjust_array(agg[:, i_deaths])
 
     model_dict['df_agg'] = df_agg.dropna()
-    model_dict['df_all_cohorts'] = df_all_cohorts
+    model_dict['df_all_cohorts'] = cohorts_to_frame(dates, seed_cohort, unit_cohort, cohort_scale, vax_recovered)
+
+    return model_dict
 
-    # model_dict = lvl_adj_forecast(model_dict, 'hosp_concur', 'hospitalized')
-    # model_dict = lvl_adj_forecast(model_dict, 'deaths_tot', 'deaths')
+def cohorts_to_frame(dates, seed_cohort, unit_cohort, cohort_scale, vax_recovered):
+    # Rebuilds the (dt, metric) x cohort_dt table from the per-cohort scales once the simulation is done.
+    n_dates, n_metrics = seed_cohort.shape
+    n_cohorts = cohort_scale.shape[0]
+    i_rec = cohort_metrics.index('recovered')
+
+    all_cohorts = np.full((n_dates, n_metrics, n_cohorts), np.nan)
+    all_cohorts[:, :, 0] = seed_cohort
+    for k in range(1, n_cohorts):
+        all_cohorts[k:, :, k] = cohort_scale[k] * unit_cohort[:n_dates - k]
+    all_cohorts[:, i_rec, :] = all_cohorts[:, i_rec, :] + vax_recovered
+
+    df_all_cohorts = pd.DataFrame(all_cohorts.reshape(n_dates * n_metrics, n_cohorts),
+                                  index=pd.MultiIndex.from_product([dates, cohort_metrics], names=['dt', 'metric']),
+                                  columns=pd.Index(dates[:n_cohorts], name='cohort_dt'))
+    return df_all_cohorts
+
+# Non-cohort compartmental engine, promoted from SEIRDSModelUpdateDev.ipynb. E_new and H_Admits are not stocks:
+# they relax towards the current inflow, a per-day rate, so their daily mean is the daily new exposures and
+# admissions whatever hrs_per_point is.
+ode_compartments = ['N', 'E', 'E_new', 'I_Mild', 'I_Sev', 'I_Fatal', 'H_Sev', 'H_Fatal', 'H_Admits', 'R', 'D']
+ode_daily_agg = {'N': 'mean', 'E': 'mean', 'E_new': 'mean', 'I_Mild': 'mean', 'I_Sev': 'mean', 'I_Fatal': 'mean',
+                 'H_Sev': 'mean', 'H_Fatal': 'mean', 'H_Admits': 'mean', 'R': 'max', 'D': 'max'}
+
+def default_ode_params(covid_params):
+    ode_params = {key: covid_params[key] for key in ['d_incub', 'd_infect', 'd_to_hosp', 'd_in_hosp',
+                                                     'd_til_death', 'mort_rt', 'hosp_rt']}
+    # Mortality and time-to-death drift from their early values to the current ones along a logistic
+    # centered 182 days after the start date.
+    ode_params['d_til_death_curr'] = covid_params['d_til_death']
+    ode_params['mort_rt_curr'] = 0.0075
+    ode_params['mort_logistic_steepness'] = 0.25
+    return ode_params
+
+def make_noncohort_ode_rhs(r_ts, ode_params):
+    # Right-hand side for odeint. r_ts[k] is Rt k days after the start date, so the lookup is plain indexing.
+    # ode_params may be a dict of floats or lmfit Parameters; everything is resolved to floats once, here.
+    import math
+    p = {key: float(getattr(val, 'value', val)) for key, val in ode_params.items()}
+    _sigma = 1 / p['d_incub']
+    _gamma = 1 / p['d_infect']
+    _nu = 1 / p['d_to_hosp']
+    _rho = 1 / p['d_in_hosp']
+    steepness = p['mort_logistic_steepness']
+    d_til_death_curr, d_til_death_gap = p['d_til_death_curr'], p['d_til_death'] - p['d_til_death_curr']
+    mort_rt_curr, mort_rt_gap = p['mort_rt_curr'], p['mort_rt'] - p['mort_rt_curr']
+    p_recov_sev = p['hosp_rt'] - p['mort_rt']
+    last_day = r_ts.shape[0] - 1
+    dz = np.empty(len(ode_compartments))
+
+    def noncohort_ode_rhs(z, t_):
+        S, E, E_new, I_Mild, I_Sev, I_Fatal, H_Sev, H_Fatal, H_Admits, R, D = z
+        I = I_Mild + I_Sev + I_Fatal
+        r_t = r_ts[min(max(int(t_), 0), last_day)]
+
+        logistic = 1 / (1 + math.exp(steepness * (t_ - 182)))
+        _mu = 1 / (d_til_death_gap * logistic + d_til_death_curr)
+        p_fatal = mort_rt_gap * logistic + mort_rt_curr
+        p_recov_mild = 1 - p_fatal - p_recov_sev
+
+        infections = min(r_t * _gamma * I, S)
+        dz[0] = -infections
+        dz[1] = infections - _sigma * E
+        dz[2] = infections - E_new
+        dz[3] = p_recov_mild * _sigma * E - _gamma * I_Mild
+        dz[4] = p_recov_sev * _sigma * E - _nu * I_Sev
+        dz[5] = p_fatal * _sigma * E - _nu * I_Fatal
+        dz[6] = _nu * I_Sev - _rho * H_Sev
+        dz[7] = _nu * I_Fatal - _mu * H_Fatal
+        dz[8] = _nu * I_Sev + _nu * I_Fatal - H_Admits
+        dz[9] = _gamma * I_Mild + _rho * H_Sev
+        dz[10] = _mu * H_Fatal
+        return dz
+
+    return noncohort_ode_rhs
+
+def ode_sol_daily(sol, start_dt, hrs_per_point):
+    # Calendar-day aggregation of the sub-daily solution, the same bins resample('D') would use, via reduceat.
+    start_dt = pd.Timestamp(start_dt)
+    n_points = sol.shape[0]
+    start_hr = (start_dt - start_dt.normalize()) / pd.Timedelta(hours=1)
+    day_num = ((start_hr + np.arange(n_points) * hrs_per_point) // 24).astype('int64')
+    day_starts = np.flatnonzero(np.r_[True, day_num[1:] != day_num[:-1]])
+    n_per_day = np.diff(np.r_[day_starts, n_points])
+
+    daily = {'sum': np.add.reduceat(sol, day_starts, axis=0),
+             'max': np.maximum.reduceat(sol, day_starts, axis=0)}
+    daily['mean'] = daily['sum'] / n_per_day[:, None]
+
+    dates = start_dt.normalize() + pd.to_timedelta(day_num[day_starts], unit='D')
+    df_sol_daily = pd.DataFrame({comp: daily[how][:, ode_compartments.index(comp)]
+                                 for comp, how in ode_daily_agg.items()}, index=dates.rename('dt'))
+    df_sol_daily['deaths_tot'] = df_sol_daily['D']
+    df_sol_daily['deaths_daily'] = df_sol_daily['D'].diff()
+    df_sol_daily['hosp_admits'] = df_sol_daily['H_Admits']
+    df_sol_daily['hosp_concur'] = df_sol_daily['H_Sev'] + df_sol_daily['H_Fatal']
+    return df_sol_daily
+
+def run_ode_model(ode_params, initial_conditions, start_dt, r_ts, n_days, hrs_per_point=6):
+    from scipy.integrate import odeint
+    tspan = np.arange(0, n_days, hrs_per_point / 24.)
+    sol = odeint(make_noncohort_ode_rhs(r_ts, ode_params), np.asarray(initial_conditions, dtype='float64'), tspan)
+    return ode_sol_daily(sol, start_dt, hrs_per_point)
+
+def seir_model_ode(start_dt, model_dict, exposed_0=10, infectious_0=0, ode_params=None, hrs_per_point=6):
+    # Compartmental counterpart to seir_model_cohort with the same inputs. Leaves the daily solution in
+    # df_sol_daily and the cohort-style metrics in df_agg.
+    start_dt = pd.Timestamp(start_dt)
+    n_days = model_dict['d_to_forecast'] + 1
+    if ode_params is None:
+        ode_params = default_ode_params(model_dict['covid_params'])
+    dates = pd.date_range(start_dt.normalize(), periods=n_days + 1)
 
+    if 'rt_scenario' in model_dict['df_rts'].columns:
+        s_rt = model_dict['df_rts']['rt_scenario'].dropna()
+    else:
+        s_rt = model_dict['df_rts']['weighted_average'].dropna()
+        s_rt = s_rt.loc[s_rt.loc[:'2020-04-15'].idxmax():]
+    s_rt = s_rt.reindex(s_rt.index.union(dates)).interpolate().fillna(method='ffill').fillna(method='bfill')
+    r_ts = s_rt.reindex(dates).to_numpy(dtype='float64')
+
+    initial_conditions = np.zeros(len(ode_compartments))
+    initial_conditions[ode_compartments.index('N')] = model_dict['tot_pop']
+    initial_conditions[ode_compartments.index('E')] = exposed_0
+    initial_conditions[ode_compartments.index('E_new')] = exposed_0
+    initial_conditions[ode_compartments.index('I_Mild')] = infectious_0
+
+    df_sol_daily = run_ode_model(ode_params, initial_conditions, start_dt, r_ts, n_days, hrs_per_point)
+
+    df_agg = pd.DataFrame(index=df_sol_daily.index)
+    df_agg['exposed'] = df_sol_daily['E']
+    df_agg['infectious'] = df_sol_daily[['I_Mild', 'I_Sev', 'I_Fatal']].sum(axis=1)
+    df_agg['recovered'] = df_sol_daily['R']
+    df_agg['hospitalized'] = df_sol_daily['hosp_concur']
+    df_agg['deaths'] = df_sol_daily['D']
+    df_agg['hosp_admits'] = df_sol_daily['hosp_admits']
+    df_agg['susceptible'] = df_sol_daily['N']
+
+    model_dict['df_sol_daily'] = df_sol_daily
+    model_dict['df_agg'] = df_agg
     return model_dict
 
+seir_engines = {'cohort': seir_model_cohort, 'ode': seir_model_ode}
+
+def run_seir_model(start_dt, model_dict, engine=None, **kwargs):
+    # engine defaults to model_dict['engine'], then to the cohort model.
+    engine = engine or model_dict.get('engine', 'cohort')
+    if engine not in seir_engines:
+        raise ValueError('Unknown model engine: {}'.format(engine))
+    return seir_engines[engine](start_dt, model_dict, **kwargs)
+
 def fore_rmse(obs_metric, pred_metric):
-    from sklearn.metrics import mean_squared_error
     df_compare = pd.DataFrame()
 
     df_compare['obs_metric'] = obs_metric
@@ -343,17 +563,212 @@ def fore_rmse(obs_metric, pred_metric):
 
     df_compare = df_compare.dropna()
     df_compare = df_compare.iloc[-60:]
-    rmse = np.sqrt(mean_squared_error(df_compare['obs_metric'], df_compare['pred_metric']))
+    rmse = np.sqrt(np.mean(np.square(df_compare['obs_metric'] - df_compare['pred_metric'])))
     # norm_rmse = rmse / (df_compare['obs_metric'].max() - df_compare['obs_metric'].min()) * 1e3
     norm_rmse = rmse / df_compare['obs_metric'].mean() * 1e3
     avg_error = df_compare['obs_metric'].sub(df_compare['pred_metric']).mean()
     rel_error = df_compare['obs_metric'].div(df_compare['pred_metric']).mean()
     return pd.Series([norm_rmse, avg_error, rel_error], index=['rmse', 'avg_error', 'rel_error'])
 
-def model_find_start(this_guess, model_dict, exposed_0=None, infectious_0=None):
-    from sklearn.metrics import mean_squared_error
-    # from sklearn.metrics import mean_absolute_error
-
+# (observed column in df_hist, simulated column in df_agg, weight on rmse and avg_error)
+fit_target_defs = [('deaths_tot', 'deaths', 1.0),
+                   ('deaths_daily', 'deaths_daily', 1.0),
+                   ('hosp_concur', 'hospitalized', 2.0)]
+
+def make_fit_targets(model_dict, lookback=60):
+    # Observed fit targets aligned once per region: one column per target on the df_hist dates.
+    df_hist = model_dict['df_hist']
+    l_obs, pred_cols, weights = [], [], []
+    for hist_col, pred_col, weight in fit_target_defs:
+        if hist_col in df_hist.columns:
+            obs = df_hist[hist_col]
+            if hist_col == 'deaths_daily':
+                obs = obs.rolling(7).mean()
+            l_obs.append(obs.to_numpy(dtype='float64'))
+            pred_cols.append(pred_col)
+            weights.append(weight)
+
+    fit_targets = {'dates': df_hist.index,
+                   'obs': np.column_stack(l_obs) if len(l_obs) > 0 else np.empty((df_hist.shape[0], 0)),
+                   'pred_cols': pred_cols,
+                   'weights': np.array(weights),
+                   'lookback': lookback}
+    return fit_targets
+
+def fit_metrics(fit_targets, df_agg):
+    # Vectorized fore_rmse over all targets: each target is scored on its last `lookback` dates where both the
+    # observation and the simulation exist. Returns the weighted averages model_find_start works with.
+    obs = fit_targets['obs']
+    pred_pos = df_agg.index.get_indexer(fit_targets['dates'])
+    pred = df_agg[fit_targets['pred_cols']].to_numpy(dtype='float64')[pred_pos]
+    pred[pred_pos < 0] = np.nan
+
+    valid = ~np.isnan(obs) & ~np.isnan(pred)
+    valid = valid & (np.cumsum(valid[::-1], axis=0)[::-1] <= fit_targets['lookback'])
+    n_obs = valid.sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        obs_v = np.where(valid, obs, 0.0)
+        pred_v = np.where(valid, pred, 0.0)
+        obs_mean = obs_v.sum(axis=0) / n_obs
+        rmse = np.sqrt(np.square(obs_v - pred_v).sum(axis=0) / n_obs) / obs_mean * 1e3
+        avg_error = (obs_v - pred_v).sum(axis=0) / n_obs
+        rel_error = np.where(valid, obs / pred, 0.0).sum(axis=0) / n_obs
+
+    weights = fit_targets['weights']
+    with np.errstate(invalid='ignore'):
+        l_metrics = [np.nanmean(rmse * weights) if np.any(~np.isnan(rmse)) else np.nan,
+                     np.nanmean(avg_error * weights) if np.any(~np.isnan(avg_error)) else np.nan,
+                     np.nanmean(rel_error) if np.any(~np.isnan(rel_error)) else np.nan]
+    return pd.Series(l_metrics, index=['rmse', 'avg_error', 'rel_error'])
+
+class SimulationAborted(Exception):
+    def __init__(self, reason, rmse_bound):
+        super().__init__(reason)
+        self.reason = reason
+        self.rmse_bound = rmse_bound
+
+class FitBound:
+    # Running lower bound on the fit_metrics rmse of one start guess, fed by seir_model_cohort a day at a time.
+    # A simulated day is final once the loop has passed it, so the squared error summed over the scored window
+    # only grows. The run is aborted once that bound passes the incumbent's rmse, or once susceptibles drop
+    # below the way-too-early share (they never come back, so the end-of-run check would fail too).
+    def __init__(self, fit_targets, start_dt, n_days, tot_pop, incumbent_rmse=None, min_susceptible=0.1):
+        obs = fit_targets['obs']
+        day = ((fit_targets['dates'] - pd.Timestamp(start_dt)) / pd.Timedelta(days=1)).to_numpy(dtype='float64')
+        # Same window as fit_metrics: df_agg keeps days 1 to n_days - 1 of the run.
+        in_run = (day >= 1) & (day <= n_days - 1) & (day % 1 == 0)
+        valid = ~np.isnan(obs) & in_run[:, None]
+        valid = valid & (np.cumsum(valid[::-1], axis=0)[::-1] <= fit_targets['lookback'])
+        n_obs = valid.sum(axis=0)
+        scored = n_obs > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            obs_mean = np.where(valid, obs, 0.0).sum(axis=0) / n_obs
+
+        self.pred_cols = fit_targets['pred_cols']
+        self.tot_pop = tot_pop
+        self.min_susceptible = min_susceptible
+        self.win_obs = np.full((n_days + 1, obs.shape[1]), np.nan)
+        rows, cols = np.nonzero(valid)
+        self.win_obs[day[rows].astype('int64'), cols] = obs[rows, cols]
+        self.win_days = ~np.all(np.isnan(self.win_obs), axis=1)
+        self.sse = np.zeros(obs.shape[1])
+        self.n_obs = n_obs[scored]
+        self.scored = scored
+        self.coef = (fit_targets['weights'] / obs_mean * 1e3)[scored]
+
+        # A non-positive observed mean flips the sign of that target's rmse, so there's nothing to bound.
+        self.incumbent_rmse = incumbent_rmse
+        if (incumbent_rmse is None) or np.isnan(incumbent_rmse) or (not np.any(scored)) or np.any(
+                ~(obs_mean[scored] > 0)):
+            self.incumbent_rmse = None
+
+    def check_susceptible(self, suspop):
+        if suspop / self.tot_pop < self.min_susceptible:
+            raise SimulationAborted('way_too_early', np.inf)
+
+    def scores_day(self, t_):
+        return (self.incumbent_rmse is not None) and self.win_days[t_]
+
+    def lower_bound(self):
+        return np.mean(np.sqrt(self.sse[self.scored] / self.n_obs) * self.coef)
+
+    def add_day(self, t_, day_values):
+        sq_err = np.square(self.win_obs[t_] - np.array([day_values[col] for col in self.pred_cols]))
+        self.sse += np.where(np.isnan(sq_err), 0.0, sq_err)
+        rmse_bound = self.lower_bound()
+        if rmse_bound > self.incumbent_rmse * (1 + 1e-9):
+            raise SimulationAborted('worse_than_incumbent', rmse_bound)
+
+def worker_budget(n_outer=1):
+    # Worker processes available to one job when n_outer jobs (e.g. states) already run side by side. The
+    # global budget is COVID_MAX_WORKERS if set, otherwise the number of CPUs.
+    tot_workers = int(os.environ.get('COVID_MAX_WORKERS', os.cpu_count() or 1))
+    return max(1, tot_workers // max(1, n_outer))
+
+score_cols = ['rmse', 'avg_error', 'rel_error', 'way_too_early', 'aborted']
+
+def score_start_guess(this_guess, model_dict, exposed_0, infectious_0, fit_targets=None, prune=False,
+                      incumbent_rmse=None):
+    # With prune, a guess that goes way too early or provably can't beat incumbent_rmse stops mid-run. Its rmse
+    # is then inf (way too early) or the lower bound it had reached, and the other errors are nan.
+    if fit_targets is None:
+        fit_targets = make_fit_targets(model_dict)
+    model_dict = model_dict.copy()
+    model_dict['d_to_forecast'] = (pd.Timestamp.today() - this_guess).days
+
+    fit_bound = None
+    if prune:
+        fit_bound = FitBound(fit_targets, this_guess, model_dict['d_to_forecast'], model_dict['tot_pop'],
+                             incumbent_rmse)
+    try:
+        model_dict = seir_model_cohort(this_guess, model_dict, exposed_0, infectious_0, fit_bound=fit_bound)
+    except SimulationAborted as e:
+        return pd.Series([e.rmse_bound, np.nan, np.nan, e.reason == 'way_too_early', True], index=score_cols)
+    df_agg = model_dict['df_agg']
+
+    s_score = fit_metrics(fit_targets, df_agg)
+    s_score['way_too_early'] = df_agg['susceptible'].iloc[-1]/model_dict['tot_pop'] < 0.1
+    s_score['aborted'] = False
+    return s_score
+
+_stencil_worker_args = {}
+
+def _init_stencil_worker(model_dict, exposed_0, infectious_0, fit_targets, prune):
+    _stencil_worker_args.update(model_dict=model_dict, exposed_0=exposed_0, infectious_0=infectious_0,
+                                fit_targets=fit_targets, prune=prune)
+
+def _score_stencil_guess(this_guess, incumbent_rmse=None):
+    return score_start_guess(this_guess, _stencil_worker_args['model_dict'],
+                             _stencil_worker_args['exposed_0'], _stencil_worker_args['infectious_0'],
+                             _stencil_worker_args['fit_targets'], _stencil_worker_args['prune'], incumbent_rmse)
+
+def model_find_start_stencil(this_guess, model_dict, exposed_0, infectious_0, n_workers, fit_targets=None,
+                             max_rounds=30, prune=True):
+    # Pattern search over start dates: score the stencil (t-7, t-1, t, t+1, t+7) concurrently, move to the best
+    # date found so far and stop once the center beats all of its neighbours. Each round's guesses are bounded
+    # against the best rmse of the earlier rounds, since only a guess that beats it can move the center.
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Platform default start method; the workers get everything they need through initargs.
+    mp_context = multiprocessing.get_context()
+
+    if fit_targets is None:
+        fit_targets = make_fit_targets(model_dict)
+    df_scores = pd.DataFrame(columns=score_cols)
+    center = this_guess
+    incumbent_rmse = None
+
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp_context, initializer=_init_stencil_worker,
+                             initargs=(model_dict, exposed_0, infectious_0, fit_targets, prune)) as executor:
+        for _ in range(max_rounds):
+            stencil = [center + pd.Timedelta(days=d) for d in [-7, -1, 0, 1, 7]]
+            if (center in df_scores.index) and df_scores.loc[center, 'way_too_early']:
+                stencil.append(center + pd.Timedelta(days=14))
+            stencil = [x for x in stencil if x not in df_scores.index]
+            print('Stencil guesses: ', ', '.join([x.strftime('%Y-%m-%d') for x in stencil]))
+
+            for guess, score in zip(stencil, executor.map(_score_stencil_guess, stencil,
+                                                          [incumbent_rmse] * len(stencil))):
+                df_scores.loc[guess] = score
+
+            candidates = df_scores[~df_scores['way_too_early'].astype(bool)]
+            if candidates.shape[0] == 0:
+                center = df_scores.index.max() + pd.Timedelta(days=14)
+                continue
+            best_guess = candidates['rmse'].astype(float).idxmin()
+            incumbent_rmse = float(candidates.loc[best_guess, 'rmse'])
+            print('Best guess so far: ', best_guess, ' rmse: ', incumbent_rmse)
+            if best_guess == center:
+                break
+            center = best_guess
+
+    return df_scores
+
+def model_find_start(this_guess, model_dict, exposed_0=None, infectious_0=None, n_workers=1, prune=True):
+    # prune stops losing stencil guesses early (see score_start_guess). The serial walk steps on the change in
+    # rmse and the average and relative errors of every guess, so it always runs each guess in full.
     this_guess = pd.Timestamp(this_guess)
 
     first_hist_obs = model_dict['df_hist'][
@@ -364,6 +779,7 @@ def model_find_start(this_guess, model_dict, exposed_0=None, infectious_0=None):
 
     last_guess = this_guess
     rmses = pd.Series(dtype='float64')
+    way_too_early = pd.Series(dtype='bool')
     change_in_error = -1
     orig_model_dict = model_dict.copy()
 
@@ -371,87 +787,70 @@ def model_find_start(this_guess, model_dict, exposed_0=None, infectious_0=None):
         exposed_0 = max(min(model_dict['df_hist']['cases_tot'].max() / 100, 100), 10)
     if infectious_0 == None:
         infectious_0 = max(min(model_dict['df_hist']['cases_tot'].max() / 100, 100), 10)
-    # print(infectious_0, exposed_0)
-
-    # Change in error used to be < 0, but this makes a req for a big enough change.
-    while ( ( (change_in_error <= 0) or override_cie )
-            # and ( this_guess >= ( first_hist_obs - pd.Timedelta(days=60) ) )
-            # and ( this_guess <= ( first_hist_obs + pd.Timedelta(days=60) ) )
-    ):
-        model_dict = orig_model_dict.copy()
-        print('This guess: ', this_guess)
-        model_dict['d_to_forecast'] = (pd.Timestamp.today() - this_guess).days
-        model_dict = seir_model_cohort(this_guess, model_dict, exposed_0, infectious_0)
-        df_agg = model_dict['df_agg']
-
-        # df_compare = pd.DataFrame()
-        #
-        # if 'deaths_tot' in model_dict['df_hist'].columns:
-        #     df_compare['obs_metric'] = model_dict['df_hist']['deaths_tot']
-        #     df_compare['pred_metric'] = df_agg['deaths']
-        # elif 'hosp_concur' in model_dict['df_hist'].columns:
-        #     df_compare['obs_metric'] = model_dict['df_hist']['hosp_concur']
-        #     df_compare['pred_metric'] = df_agg['hospitalized']
-        #
-        # df_compare = df_compare.dropna()
-        # df_compare = df_compare.iloc[-60:]
-        # rmses.loc[this_guess] = np.sqrt(mean_squared_error(df_compare['obs_metric'], df_compare['pred_metric']))
-
-        df_thiserror = pd.DataFrame()
-        if 'deaths_tot' in model_dict['df_hist'].columns:
-            df_thiserror['deaths_tot'] = fore_rmse(model_dict['df_hist']['deaths_tot'], df_agg['deaths'])
-        if 'deaths_daily' in model_dict['df_hist'].columns:
-            df_thiserror['deaths_daily'] = fore_rmse(model_dict['df_hist']['deaths_daily'].rolling(7).mean(), df_agg['deaths_daily'])
-        if 'hosp_concur' in model_dict['df_hist'].columns:
-            df_thiserror['hosp_concur'] = fore_rmse(model_dict['df_hist']['hosp_concur'], df_agg['hospitalized'])
-            df_thiserror.loc['rmse','hosp_concur'] = df_thiserror.loc['rmse','hosp_concur'] * 2
-            df_thiserror.loc['avg_error','hosp_concur'] = df_thiserror.loc['avg_error','hosp_concur'] * 2
-        rmses.loc[this_guess] = df_thiserror.loc['rmse'].mean()
-
-        print('This rmse: ', rmses.loc[this_guess])
-
-        if last_guess != this_guess:
-            change_in_error = rmses.loc[this_guess] - rmses.loc[last_guess]
-        print('Change in rmse: ', change_in_error)
-
-        last_guess = this_guess
-        # avg_error = df_compare['obs_metric'].sub(df_compare['pred_metric']).mean()
-        avg_error = df_thiserror.loc['avg_error'].mean()
-        rel_error = df_thiserror.loc['rel_error'].mean()
-        print('Average Error: ', avg_error)
-        if df_agg['susceptible'].iloc[-1]/model_dict['tot_pop'] < 0.1:
-            print('Way too early starting date.')
-            this_guess = this_guess + pd.Timedelta(days=14)
-            override_cie = True
-        elif avg_error < 0:
-            if rel_error < 0.5:
-                this_guess = this_guess + pd.Timedelta(days=7)
-                override_cie = True
-            else:
-                this_guess = this_guess + pd.Timedelta(days=1)
-                override_cie = False
-        else:
-            if rel_error > 2:
-                this_guess = this_guess - pd.Timedelta(days=7)
+
+    fit_targets = make_fit_targets(model_dict)
+
+    if n_workers > 1:
+        df_scores = model_find_start_stencil(this_guess, orig_model_dict, exposed_0, infectious_0, n_workers,
+                                             fit_targets, prune=prune)
+        rmses = df_scores['rmse'].astype(float)
+        # Same rule as the stencil: a way-too-early guess can't be the start date, even if (unpruned) its rmse is
+        # the lowest.
+        candidates = rmses[~df_scores['way_too_early'].astype(bool)]
+        this_guess = candidates.idxmin() if candidates.shape[0] > 0 else rmses.idxmin()
+        best_guess = this_guess
+    else:
+        # Change in error used to be < 0, but this makes a req for a big enough change.
+        while ( ( (change_in_error <= 0) or override_cie )
+                # and ( this_guess >= ( first_hist_obs - pd.Timedelta(days=60) ) )
+                # and ( this_guess <= ( first_hist_obs + pd.Timedelta(days=60) ) )
+        ):
+            print('This guess: ', this_guess)
+            s_score = score_start_guess(this_guess, orig_model_dict, exposed_0, infectious_0, fit_targets)
+            rmses.loc[this_guess] = s_score['rmse']
+            way_too_early.loc[this_guess] = bool(s_score['way_too_early'])
+
+            print('This rmse: ', rmses.loc[this_guess])
+
+            if last_guess != this_guess:
+                change_in_error = rmses.loc[this_guess] - rmses.loc[last_guess]
+            print('Change in rmse: ', change_in_error)
+
+            last_guess = this_guess
+            avg_error = s_score['avg_error']
+            rel_error = s_score['rel_error']
+            print('Average Error: ', avg_error)
+            if s_score['way_too_early']:
+                print('Way too early starting date.')
+                this_guess = this_guess + pd.Timedelta(days=14)
                 override_cie = True
+            elif avg_error < 0:
+                if rel_error < 0.5:
+                    this_guess = this_guess + pd.Timedelta(days=7)
+                    override_cie = True
+                else:
+                    this_guess = this_guess + pd.Timedelta(days=1)
+                    override_cie = False
             else:
-                this_guess = this_guess - pd.Timedelta(days=1)
-                override_cie = False
-
-        # from coronita_chart_helper import ch_deaths_tot, ch_exposed_infectious
-        # import matplotlib.pyplot as plt
-        # ch_deaths_tot(model_dict); plt.show()
-        # ch_exposed_infectious(model_dict);
-        # plt.show()
+                if rel_error > 2:
+                    this_guess = this_guess - pd.Timedelta(days=7)
+                    override_cie = True
+                else:
+                    this_guess = this_guess - pd.Timedelta(days=1)
+                    override_cie = False
+        # Same rule as the stencil path.
+        candidates = rmses[~way_too_early]
+        best_guess = candidates.idxmin() if candidates.shape[0] > 0 else rmses.idxmin()
 
     model_dict = orig_model_dict
     model_dict['d_to_forecast'] = (pd.Timestamp.today() - this_guess).days + model_dict['d_to_forecast']
-    model_dict = seir_model_cohort(rmses.idxmin(), model_dict, exposed_0, infectious_0)
-    print('Best starting date: ', rmses.idxmin())
+    model_dict = seir_model_cohort(best_guess, model_dict, exposed_0, infectious_0)
+    print('Best starting date: ', best_guess)
     model_dict['rmses'] = rmses
     return model_dict
 
 def est_all_rts(model_dict):
+    from statsmodels.stats.weightstats import DescrStatsW
     df_hist = model_dict['df_hist'].copy()
     df_hist = df_hist.dropna(how='all', axis=1)
     df_hist = df_hist[[col for col in df_hist.columns if df_hist[col].std() > 0]]
@@ -466,15 +865,51 @@ def est_all_rts(model_dict):
     df_hist_shifted = pd.DataFrame(index=df_hist.index)
     df_rts_conf = pd.DataFrame()
 
+    # Outlier screening for every input series in one pass. A cleaned series is only used when it keeps more
+    # than 80% of the observations. Positive and negative tests are screened at 4 std but cleaned at 3 std.
+    df_inputs = pd.DataFrame(index=model_dict['df_hist'].index)
+    input_num_std = {}
+
+    if 'cases_daily' in df_hist.columns:
+        df_inputs['cases_daily'] = df_hist['cases_daily'].add(1.0)
+        input_num_std['cases_daily'] = 4
+
+    if ('cases_daily' in df_hist.columns) and ('pos_neg_tests_daily' in df_hist.columns):
+        pos_neg_tests_7da = model_dict['df_hist']['pos_neg_tests_daily'].add(1.0)
+        df_inputs['pos_neg_tests_daily'] = pos_neg_tests_7da.rolling(lookback, center=False, min_periods=1).mean()
+        df_inputs['pos_neg_tests_daily_3std'] = df_inputs['pos_neg_tests_daily']
+        input_num_std.update(pos_neg_tests_daily=4, pos_neg_tests_daily_3std=3)
+
+    for col in ['deaths_daily', 'hosp_concur']:
+        if col in df_hist.columns:
+            df_inputs[col] = df_hist[col].add(1.0).rolling(lookback, center=False, min_periods=1).mean()
+            input_num_std[col] = 4
+
+    if 'hosp_admits' in df_hist.columns:
+        if 'hosp_concur' in df_hist.columns:
+            df_hist.loc[df_hist['hosp_admits'] < df_hist['hosp_concur'].diff(), 'hosp_admits'] = np.nan
+
+        hosp_admits = df_hist['hosp_admits']
+        first_hosp_admit = hosp_admits.replace(0, np.nan).dropna().first_valid_index()
+        if hosp_admits.loc[first_hosp_admit] > hosp_admits.loc[first_hosp_admit:].quantile(.95):
+            first_hosp_admit = first_hosp_admit + pd.Timedelta(days=1)
+        hosp_admits = hosp_admits.loc[first_hosp_admit:].reindex(df_hist.index).add(1.0)
+        df_inputs['hosp_admits'] = hosp_admits.rolling(lookback, center=False, min_periods=1).mean()
+        input_num_std['hosp_admits'] = 4
+
+    df_inputs_cleaned, s_retained = outlier_removal_frame(df_inputs, num_std=[input_num_std[x] for x in df_inputs.columns])
+
+    def screened_input(col, cleaned_col=None):
+        if s_retained[col] > 0.8:
+            return df_inputs_cleaned[cleaned_col or col].reindex(df_hist.index)
+        return df_inputs[col].reindex(df_hist.index)
+
     if 'cases_daily' in df_hist.columns:
         keepcols.append('cases_daily')
         df_weights['cases_daily'] = 0.5
         cases_shift = int(model_dict['covid_params']['d_incub'] + 2) * -1
 
-        cases_daily = df_hist['cases_daily'].add(1.0)
-        if outlier_removal(cases_daily, num_std=4).dropna().shape[0] / cases_daily.dropna().shape[0] > 0.8:
-            cases_daily = outlier_removal(cases_daily, num_std=4)
-        # cases_daily = outlier_removal(cases_daily, num_std=4).add(1.0)
+        cases_daily = screened_input('cases_daily')
         cases_daily = cases_daily.rolling(lookback, center=False, min_periods=1).mean()
         df_hist_shifted['cases_daily'] = cases_daily.shift(cases_shift)
 
@@ -486,19 +921,7 @@ def est_all_rts(model_dict):
         df_weights['test_share'] = 1.0
         test_share_shift = int(model_dict['covid_params']['d_incub'] + 2) * -1
 
-        cases_daily_7da = df_hist['cases_daily'].add(1.0)
-        if outlier_removal(cases_daily_7da, num_std=4).dropna().shape[0] / cases_daily_7da.dropna().shape[0] > 0.8:
-            cases_daily_7da = outlier_removal(cases_daily_7da, num_std=4)
-        # cases_daily_7da = outlier_removal(cases_daily_7da).add(1.0)
-        cases_daily_7da = cases_daily_7da.rolling(lookback, center=False, min_periods=1).mean()
-
-        pos_neg_tests_7da = model_dict['df_hist']['pos_neg_tests_daily'].add(1.0)
-        pos_neg_tests_7da = pos_neg_tests_7da.rolling(lookback, center=False, min_periods=1).mean()
-        if outlier_removal(pos_neg_tests_7da, num_std=4).dropna().shape[0] / pos_neg_tests_7da.dropna().shape[0] > 0.8:
-            pos_neg_tests_7da = outlier_removal(pos_neg_tests_7da)
-        # pos_neg_tests_7da = pos_neg_tests_7da.rolling(lookback, center=False, min_periods=1).mean()
-
-        test_share = cases_daily_7da.div(pos_neg_tests_7da)
+        test_share = cases_daily.div(screened_input('pos_neg_tests_daily', 'pos_neg_tests_daily_3std'))
 
         test_share = test_share.replace([np.inf, -np.inf], np.nan)
         test_share = test_share.mask(test_share >= 1)
@@ -514,14 +937,9 @@ def est_all_rts(model_dict):
         df_weights['deaths_daily'] = 2.0
         deaths_shift = int(model_dict['covid_params']['d_incub'] + model_dict['covid_params']['d_til_death']) * -1
 
-        deaths_daily = df_hist['deaths_daily'].add(1.0)
-        deaths_daily = deaths_daily.rolling(lookback, center=False, min_periods=1).mean()
-        if outlier_removal(deaths_daily, num_std=4).dropna().shape[0] / deaths_daily.dropna().shape[0] > 0.8:
-            deaths_daily = outlier_removal(deaths_daily, num_std=4)
-        else:
+        deaths_daily = screened_input('deaths_daily')
+        if s_retained['deaths_daily'] <= 0.8:
             print('didnt remove death outliers.')
-        # deaths_daily = outlier_removal(deaths_daily, num_std=4).add(1.0)
-        # deaths_daily = deaths_daily.rolling(lookback, center=False, min_periods=1).mean()
         df_hist_shifted['deaths_daily'] = deaths_daily.shift(deaths_shift)
         print('deaths shifted by: ', deaths_shift)
 
@@ -536,12 +954,7 @@ def est_all_rts(model_dict):
                                  + model_dict['covid_params']['d_in_hosp'] / 2)
                              * -1)
 
-        hosp_concur = df_hist['hosp_concur'].add(1.0)
-        hosp_concur = hosp_concur.rolling(lookback, center=False, min_periods=1).mean()
-        if outlier_removal(hosp_concur, num_std=4).dropna().shape[0] / hosp_concur.dropna().shape[0] > 0.8:
-            hosp_concur = outlier_removal(hosp_concur, num_std=4)
-        # hosp_concur = outlier_removal(hosp_concur, num_std=4).add(1.0)
-        # hosp_concur = hosp_concur.rolling(lookback, center=False, min_periods=1).mean()
+        hosp_concur = screened_input('hosp_concur')
         df_hist_shifted['hosp_concur'] = hosp_concur.shift(hosp_concur_shift)
 
         df_rt = est_rt_wconf(df_hist_shifted['hosp_concur'], lookback, d_infect)
@@ -554,26 +967,13 @@ def est_all_rts(model_dict):
                                  + model_dict['covid_params']['d_to_hosp'])
                              * -1)
 
-        if 'hosp_concur' in df_hist.columns:
-            df_hist.loc[df_hist['hosp_admits'] < df_hist['hosp_concur'].diff(), 'hosp_admits'] = np.nan
-
-        hosp_admits = df_hist['hosp_admits']
-        first_hosp_admit = hosp_admits.replace(0, np.nan).dropna().first_valid_index()
-        if hosp_admits.loc[first_hosp_admit] > hosp_admits.loc[first_hosp_admit:].quantile(.95):
-            first_hosp_admit = first_hosp_admit + pd.Timedelta(days=1)
-        hosp_admits = hosp_admits.loc[first_hosp_admit:].reindex(df_hist.index).add(1.0)
-        hosp_admits = hosp_admits.rolling(lookback, center=False, min_periods=1).mean()
-        if outlier_removal(hosp_admits, num_std=4).dropna().shape[0] / hosp_admits.dropna().shape[0] > 0.8:
-            hosp_admits = outlier_removal(hosp_admits, num_std=4)
-        # hosp_admits = outlier_removal(hosp_admits, num_std=4).add(1.0)
-        # hosp_admits = hosp_admits.rolling(lookback, center=False, min_periods=1).mean()
+        hosp_admits = screened_input('hosp_admits')
         df_hist_shifted['hosp_admits'] = hosp_admits.shift(hosp_admits_shift)
 
         df_rt = est_rt_wconf(df_hist_shifted['hosp_admits'], lookback, d_infect)
         df_rts_conf = pd.concat([df_rts_conf, df_rt.stack('metric')], axis=1)
 
-    df_hist_shifted_ravg = df_hist_shifted.rolling(lookback, win_type='gaussian', center=True, min_periods=3).mean(
-        std=1) # Normal
+    df_hist_shifted_ravg = gaussian_smooth(df_hist_shifted, lookback, std=1, min_periods=3) # Normal
     # df_hist_shifted_ravg = df_hist_shifted.rolling(lookback, center=True, min_periods=3).mean() # Exp. Version for NYS
 
     df_lambdas = df_hist_shifted_ravg.copy()
@@ -582,7 +982,7 @@ def est_all_rts(model_dict):
     if 'hosp_concur' in df_lambdas.columns:
         df_lambdas['hosp_concur'] = df_lambdas['hosp_concur'].pow(1.4)
     df_lambdas = df_lambdas.replace([np.inf, -np.inf], np.nan)
-    df_lambdas = df_lambdas.apply(outlier_removal, num_std=3)
+    df_lambdas, _ = outlier_removal_frame(df_lambdas, num_std=3)
 
     # df_lambdas = df_lambdas.rolling(lookback, win_type='gaussian', center=True).mean(std=4) # Normal
     # df_lambdas = df_lambdas.rolling(lookback, win_type='gaussian', center=True).mean(std=1) # Exp. Version for NYS
@@ -604,7 +1004,7 @@ def est_all_rts(model_dict):
     ###### Detrended Std Deviation ######
     std_lookback = lookback * 2
     df_detrended = df_lambdas[keepcols].sub(df_lambdas['weighted_average'], axis=0)
-    df_detrended = df_detrended.rolling(std_lookback, win_type='gaussian', center=True).mean(std=2)
+    df_detrended = gaussian_smooth(df_detrended, std_lookback, std=2)
     df_detrended_abs = df_detrended.apply(np.abs)
     df_detrended_abs_ffill = df_detrended_abs.apply(
         lambda x:
@@ -624,14 +1024,14 @@ def est_all_rts(model_dict):
     stddev = df_detrended_abs.apply(np.square).rolling(std_lookback, center=True, min_periods=1).sum().sum(axis=1).div(
         df_detrended_abs.count(axis=1).rolling(std_lookback, center=True, min_periods=1).sum().sub(1)).apply(np.sqrt)
 
-    stddev = stddev.rolling(std_lookback, win_type='gaussian', center=True, min_periods=1).mean(std=2)
+    stddev = gaussian_smooth(stddev, std_lookback, std=2, min_periods=1)
 
     stddev = stddev.fillna(method='ffill').fillna(method='bfill')
     #####################################
 
     s_lambda = df_lambdas['weighted_average']
     # s_lambda = s_lambda.rolling(lookback, win_type='gaussian', center=False).mean(std=2)
-    s_lambda = s_lambda.rolling(lookback, win_type='gaussian', center=True).mean(std=2) # Normal Version
+    s_lambda = gaussian_smooth(s_lambda, lookback, std=2) # Normal Version
     # s_lambda = s_lambda.rolling(lookback, win_type='gaussian', center=True).mean(std=1) # Exp. Version for NYS
 
     s_lambda = s_lambda.loc[:s_lambda.last_valid_index()]
@@ -681,17 +1081,10 @@ def est_rt_wconf(lvl_series, lookback, d_infect):
     pct_series = lvl_series.rolling(lookback, center=True).mean().pct_change(fill_method=None)
     pct_series = pct_series.replace([np.inf, -np.inf], np.nan)
 
-    stddev = pct_series.rolling(lookback,
-                                             win_type='gaussian',
-                                             min_periods=lookback-1,
-                                             center=True
-                                             ).std(std=2).fillna(method='ffill').fillna(method='bfill')
+    stddev = gaussian_smooth_std(pct_series, lookback, std=2, min_periods=lookback-1
+                                 ).fillna(method='ffill').fillna(method='bfill')
 
-    s_lambda = pct_series.rolling(lookback,
-                                               win_type='gaussian',
-                                               min_periods=lookback-1,
-                                               center=True
-                                               ).mean(std=2)
+    s_lambda = gaussian_smooth(pct_series, lookback, std=2, min_periods=lookback-1)
 
     s_lambda = s_lambda.loc[:s_lambda.last_valid_index()]
     s_lambda = s_lambda.clip(lower=-1.0)
@@ -710,47 +1103,123 @@ def est_rt_wconf(lvl_series, lookback, d_infect):
 
     return df_rt
 
+testing_bundle_cols = ['deaths', 'hospitalizedCurrently', 'hospitalizedIncrease', 'cases', 'posNeg']
+hhs_bundle_cols = ['Total Inpatient Beds', 'hosp_beds_avail']
+
+def make_region_bundles(abbrev_us_state, df_census, df_st_testing_fmt, df_hhs_hosp, df_mvmt=pd.DataFrame(),
+                        df_interventions=pd.DataFrame(), regions=None):
+    # Splits the shared inputs into one compact record per state in a single pass: the testing and HHS series as
+    # float arrays on the testing date index (one index object shared by every bundle), plus the state's
+    # population, mobility and policy rows. make_model_dict_region() needs nothing else, so bundles can be built
+    # once and handed out to workers region by region.
+    s_pop = df_census[df_census.SUMLEV == 40].drop_duplicates('state').set_index('state')['pop2019']
+    if regions is None:
+        regions = list(s_pop.index)
+    testing_regions = set(df_st_testing_fmt.columns.get_level_values(1))
+    for region in regions:
+        if region not in testing_regions:
+            print('Couldn\'t find testing data for {}'.format(region))
+    regions = [region for region in regions if region in testing_regions]
+
+    dates = df_st_testing_fmt.index
+    # (region, date) arrays, so each region's series is one contiguous row.
+    d_testing = {metric: np.ascontiguousarray(df_st_testing_fmt[metric][regions].to_numpy(dtype='float64').T)
+                 for metric in testing_bundle_cols}
+
+    d_hhs = {}
+    if all(col in df_hhs_hosp.columns for col in hhs_bundle_cols):
+        for region, df_reg in df_hhs_hosp[hhs_bundle_cols].groupby(level=0):
+            df_reg = df_reg.droplevel(0)
+            if (region in testing_regions) and df_reg.index.is_unique:
+                d_hhs[region] = df_reg.reindex(dates).to_numpy(dtype='float64').T
+
+    d_mvmt = {}
+    if df_mvmt.shape[0] > 0:
+        d_mvmt = {region: df_reg.droplevel(0) for region, df_reg in df_mvmt.groupby(level=0)}
+
+    d_policy = {}
+    if df_interventions.shape[0] > 0:
+        # The state's own rows plus the national ones, in their original order, first non-null value per date.
+        df_policy = df_interventions.reset_index(drop=True)
+        d_policy_rows = {code: df_code for code, df_code in df_policy.groupby('state_code')}
+        df_us = d_policy_rows.get('US', df_policy.iloc[0:0])
+        for region in regions:
+            df_reg = pd.concat([d_policy_rows.get(region, df_policy.iloc[0:0]), df_us]).sort_index()
+            d_policy[region] = df_reg[~df_reg.index.duplicated()].groupby('dt').first().reset_index()
+
+    bundles = {}
+    for i, region in enumerate(regions):
+        bundle = {'region_code': region,
+                  'region_name': abbrev_us_state[region],
+                  'tot_pop': s_pop[region],
+                  'dates': dates,
+                  'testing': {metric: values[i] for metric, values in d_testing.items()},
+                  'hhs': None,
+                  'df_mvmt': df_mvmt,
+                  'df_interventions': df_interventions}
+        if region in d_hhs:
+            bundle['hhs'] = dict(zip(hhs_bundle_cols, d_hhs[region]))
+        if df_mvmt.shape[0] > 0:
+            bundle['df_mvmt'] = d_mvmt.get(region)
+        if df_interventions.shape[0] > 0:
+            bundle['df_interventions'] = d_policy[region]
+        bundles[region] = bundle
+    return bundles
+
+def _daily_from_tot(tot):
+    daily = np.diff(tot, prepend=np.nan)
+    daily[daily < 0] = np.nan
+    return daily
+
 def make_model_dict_state(state_code, abbrev_us_state, df_census, df_st_testing_fmt, df_hhs_hosp, covid_params, d_to_forecast = 75,
                         df_mvmt=pd.DataFrame(), df_interventions=pd.DataFrame()):
+    # One-off form; loops over many states should build make_region_bundles() once and use make_model_dict_region.
+    bundle = make_region_bundles(abbrev_us_state, df_census, df_st_testing_fmt, df_hhs_hosp, df_mvmt, df_interventions,
+                                 regions=[state_code])[state_code]
+    return make_model_dict_region(bundle, covid_params, d_to_forecast)
+
+def make_model_dict_region(bundle, covid_params, d_to_forecast=75):
     model_dict = {}
 
+    state_code = bundle['region_code']
     model_dict['region_code'] = state_code
-    model_dict['region_name'] = abbrev_us_state[model_dict['region_code']]
-    model_dict['tot_pop'] = df_census.loc[(df_census.SUMLEV == 40)
-                                                  & (df_census.state == model_dict['region_code']),
-                                                  'pop2019'].values[0]
+    model_dict['region_name'] = bundle['region_name']
+    model_dict['tot_pop'] = bundle['tot_pop']
 
-    model_dict['df_hist'] = pd.DataFrame()
+    testing = bundle['testing']
+    d_hist = {}
 
-    if df_st_testing_fmt['deaths'][model_dict['region_code']].dropna().shape[0] > 0:
-        model_dict['df_hist']['deaths_tot'] = df_st_testing_fmt['deaths'][model_dict['region_code']]
-        deaths_daily = model_dict['df_hist']['deaths_tot'].diff()
-        model_dict['df_hist']['deaths_daily'] = deaths_daily.mask(deaths_daily < 0)
+    if np.any(~np.isnan(testing['deaths'])):
+        d_hist['deaths_tot'] = testing['deaths'].copy()
+        d_hist['deaths_daily'] = _daily_from_tot(testing['deaths'])
 
-    if df_st_testing_fmt['hospitalizedCurrently'][model_dict['region_code']].dropna().shape[0] > 0:
-        model_dict['df_hist']['hosp_concur'] = df_st_testing_fmt['hospitalizedCurrently'][model_dict['region_code']]
+    if np.any(~np.isnan(testing['hospitalizedCurrently'])):
+        d_hist['hosp_concur'] = testing['hospitalizedCurrently'].copy()
 
-    if df_st_testing_fmt['hospitalizedIncrease'][model_dict['region_code']].dropna().shape[0] > 0:
-        hosp_admits = df_st_testing_fmt['hospitalizedIncrease'][model_dict['region_code']]
-        model_dict['df_hist']['hosp_admits'] = hosp_admits.mask(hosp_admits < 0)
+    hosp_admits = testing['hospitalizedIncrease']
+    if np.any(~np.isnan(hosp_admits)):
+        d_hist['hosp_admits'] = np.where(hosp_admits < 0, np.nan, hosp_admits)
 
     if state_code == 'NY':
-        model_dict['df_hist'].loc['2020-06-04': ,'hosp_admits'] = hosp_admits.mask(hosp_admits == 0)
+        # NY's admissions are reported as zero rather than missing from June 4th; negatives are kept there.
+        from_jun4 = np.asarray(bundle['dates'] >= pd.Timestamp('2020-06-04'))
+        d_hist['hosp_admits'] = np.where(from_jun4, np.where(hosp_admits == 0, np.nan, hosp_admits),
+                                         d_hist.get('hosp_admits', np.nan))
 
-    model_dict['df_hist']['cases_tot'] = df_st_testing_fmt['cases'][model_dict['region_code']]
-    cases_daily = model_dict['df_hist']['cases_tot'].diff()
-    model_dict['df_hist']['cases_daily'] = cases_daily.mask(cases_daily < 0)
+    d_hist['cases_tot'] = testing['cases'].copy()
+    d_hist['cases_daily'] = _daily_from_tot(testing['cases'])
 
-    model_dict['df_hist']['pos_neg_tests_tot'] = df_st_testing_fmt['posNeg'][model_dict['region_code']]
-    pos_neg_tests_daily = model_dict['df_hist']['pos_neg_tests_tot'].diff()
-    model_dict['df_hist']['pos_neg_tests_daily'] = pos_neg_tests_daily.mask(pos_neg_tests_daily < 0)
+    d_hist['pos_neg_tests_tot'] = testing['posNeg'].copy()
+    d_hist['pos_neg_tests_daily'] = _daily_from_tot(testing['posNeg'])
 
-    try:
-        model_dict['df_hist']['hosp_beds_tot'] = df_hhs_hosp['Total Inpatient Beds'].loc[model_dict['region_code']]
-        model_dict['df_hist']['hosp_beds_avail'] = df_hhs_hosp['hosp_beds_avail'].loc[model_dict['region_code']]
-    except:
+    if bundle['hhs'] is not None:
+        d_hist['hosp_beds_tot'] = bundle['hhs']['Total Inpatient Beds'].copy()
+        d_hist['hosp_beds_avail'] = bundle['hhs']['hosp_beds_avail'].copy()
+    else:
         print('hosp capacity data not available for {}'.format(model_dict['region_code']))
 
+    model_dict['df_hist'] = pd.DataFrame(d_hist, index=bundle['dates'])
+
     model_dict['covid_params'] = covid_params.copy()
 
     if model_dict['df_hist']['deaths_daily'].mean() > 0.5:
@@ -782,16 +1251,10 @@ def make_model_dict_state(state_code, abbrev_us_state, df_census, df_st_testing_
 
     model_dict['d_to_forecast'] = int(d_to_forecast)
 
-    if df_mvmt.shape[0] > 0:
-        model_dict['df_mvmt'] = df_mvmt.loc[state_code]
-    else:
-        model_dict['df_mvmt'] = df_mvmt
-
-    if df_interventions.shape[0] > 0:
-        model_dict['df_interventions'] = df_interventions[
-            df_interventions.state_code.isin([state_code,'US'])].groupby('dt').first().reset_index()
-    else:
-        model_dict['df_interventions'] = df_interventions
+    if bundle['df_mvmt'] is None:
+        raise KeyError('No mobility data for {}'.format(state_code))
+    model_dict['df_mvmt'] = bundle['df_mvmt']
+    model_dict['df_interventions'] = bundle['df_interventions']
 
     model_dict['footnote_str'] = ''
     model_dict['chart_title'] = ''
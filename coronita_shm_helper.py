@@ -0,0 +1,119 @@
+import pandas as pd
+import numpy as np
+
+# Shared-memory data plane for the worker pools. The parent publishes each big input panel (testing, HHS
+# hospital, county frames) once: its numeric columns go into one multiprocessing.shared_memory block per dtype,
+# its row index into blocks of codes or values, and what a worker gets is a small descriptor (block names, dtypes,
+# shapes, column labels, index levels). attach_panel() turns a descriptor back into a DataFrame over read-only
+# views of those blocks, so worker memory and start-up serialization don't grow with the panels or the worker
+# count, whatever the start method. Non-numeric columns (covidtracking hashes, HHS date strings, ...) are left
+# out; the models only read numbers from these panels.
+
+# shared_memory handles a worker has attached to, kept open for the life of the process.
+_attached = {}
+
+def _to_shared(arr, l_shm):
+    from multiprocessing import shared_memory
+    arr = np.ascontiguousarray(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+    l_shm.append(shm)
+    return {'shm': shm.name, 'dtype': arr.dtype.str, 'shape': arr.shape}
+
+def _from_shared(block):
+    from multiprocessing import shared_memory
+    shm = _attached.get(block['shm'])
+    if shm is None:
+        shm = _attached[block['shm']] = shared_memory.SharedMemory(name=block['shm'])
+    arr = np.ndarray(block['shape'], dtype=np.dtype(block['dtype']), buffer=shm.buf)
+    arr.flags.writeable = False
+    return arr
+
+def _shareable(dtype):
+    return isinstance(dtype, np.dtype) and dtype.kind in 'biufmM'
+
+def _publish_index(index, l_shm):
+    # Level values stay in the descriptor (they're small); anything with one entry per row is shared.
+    if isinstance(index, pd.MultiIndex):
+        return {'kind': 'multi', 'levels': list(index.levels), 'names': list(index.names),
+                'codes': [_to_shared(codes, l_shm) for codes in index.codes]}
+    if _shareable(index.dtype):
+        return {'kind': 'values', 'values': _to_shared(index.to_numpy(), l_shm), 'name': index.name,
+                'freq': getattr(index, 'freq', None)}
+    codes, uniques = pd.factorize(index)
+    return {'kind': 'codes', 'codes': _to_shared(codes, l_shm), 'uniques': uniques, 'name': index.name}
+
+def _attach_index(desc):
+    if desc['kind'] == 'multi':
+        return pd.MultiIndex(levels=desc['levels'], codes=[_from_shared(codes) for codes in desc['codes']],
+                             names=desc['names'], verify_integrity=False)
+    if desc['kind'] == 'values':
+        if desc['freq'] is not None:
+            return pd.DatetimeIndex(_from_shared(desc['values']), freq=desc['freq'], name=desc['name'], copy=False)
+        return pd.Index(_from_shared(desc['values']), name=desc['name'], copy=False)
+    return pd.Index(desc['uniques'].take(_from_shared(desc['codes'])), name=desc['name'])
+
+def publish_frame(df, l_shm=None):
+    # Returns (descriptor, shared_memory blocks); the caller owns the blocks and must unlink them when done.
+    if l_shm is None:
+        l_shm = []
+    by_dtype = {}
+    for pos, dtype in enumerate(df.dtypes):
+        if _shareable(dtype):
+            by_dtype.setdefault(dtype, []).append(pos)
+
+    blocks = []
+    for dtype, positions in by_dtype.items():
+        # Stored column-major, so every column is one contiguous run of rows.
+        block = _to_shared(df.iloc[:, positions].to_numpy(dtype=dtype).T, l_shm)
+        block['columns'] = df.columns[positions]
+        blocks.append(block)
+
+    shared = [pos for positions in by_dtype.values() for pos in positions]
+    desc = {'index': _publish_index(df.index, l_shm), 'blocks': blocks,
+            'dropped': [col for pos, col in enumerate(df.columns) if pos not in set(shared)]}
+    return desc, l_shm
+
+def attach_panel(desc):
+    # Columns come back grouped by dtype; pandas copies a worker's private version only if something writes
+    # to it or consolidates it.
+    index = _attach_index(desc['index'])
+    l_frames = [pd.DataFrame(_from_shared(block).T, index=index, columns=block['columns'], copy=False)
+                for block in desc['blocks']]
+    if len(l_frames) == 0:
+        return pd.DataFrame(index=index)
+    if len(l_frames) == 1:
+        return l_frames[0]
+    return pd.concat(l_frames, axis=1, copy=False)
+
+def attach_panels(descriptors):
+    return {name: attach_panel(desc) for name, desc in descriptors.items()}
+
+class SharedPanels:
+    # Parent side: publishes a dict of frames and owns their blocks until close(). Hand .descriptors to the
+    # workers (e.g. through a pool initializer) and have them call attach_panels().
+
+    def __init__(self, frames):
+        self.descriptors = {}
+        self._shm = []
+        try:
+            for name, df in frames.items():
+                self.descriptors[name], _ = publish_frame(df, self._shm)
+        except:
+            self.close()
+            raise
+
+    def nbytes(self):
+        return sum(shm.size for shm in self._shm)
+
+    def close(self):
+        for shm in self._shm:
+            shm.close()
+            shm.unlink()
+        self._shm = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,77 @@
+import pandas as pd
+import numpy as np
+import functools
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Gaussian rolling windows on plain arrays. These reproduce rolling(window, win_type='gaussian', center=...)
+# .mean(std=...) / .std(std=...) from pandas, including its min_periods rules, without going through the
+# scipy window machinery on every call.
+
+@functools.lru_cache(maxsize=None)
+def gaussian_weights(window, std):
+    # Same vector as scipy.signal.windows.gaussian(window, std). Cached and read-only since it is shared.
+    n = np.arange(window) - (window - 1.0) / 2.0
+    weights = np.exp(-0.5 * (n / std) ** 2)
+    weights.flags.writeable = False
+    return weights
+
+def _rolling_windows(values, window, center):
+    # Returns (windows, pos) where windows[i, ..., k] is the k-th value of the window that lands on row i, padded
+    # with nan where the window runs off either end, and pos[i, k] is that value's row number in the input.
+    values = np.asarray(values, dtype='float64')
+    offset = (window - 1) // 2 if center else 0
+    n_rows = values.shape[0]
+    pad = [(window - 1, offset)] + [(0, 0)] * (values.ndim - 1)
+    padded = np.pad(values, pad, mode='constant', constant_values=np.nan)
+    windows = sliding_window_view(padded, window, axis=0)[offset:offset + n_rows]
+    pos = np.arange(n_rows)[:, None] + offset - (window - 1) + np.arange(window)[None, :]
+    if values.ndim == 2:
+        pos = pos[:, None, :]
+    return windows, pos
+
+def rolling_gaussian_mean(values, window, std, min_periods=None, center=False):
+    # values is 1-D or 2-D (rows are time). Rows with fewer than min_periods observations are nan; pandas'
+    # default is the full window.
+    weights = gaussian_weights(window, std)
+    min_periods = max(min_periods or window, 1)
+    windows, _ = _rolling_windows(values, window, center)
+    is_obs = ~np.isnan(windows)
+
+    tot = np.where(is_obs, windows, 0.0) @ weights
+    tot_wgt = is_obs @ weights
+    nobs = is_obs.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where((nobs >= min_periods) & (tot_wgt != 0), tot / tot_wgt, np.nan)
+
+def rolling_gaussian_std(values, window, std, min_periods=None, center=False, ddof=1):
+    # pandas' weighted var attaches weights[row % window] to each row rather than weighting by position within
+    # the window, and scales by window / (window - ddof). Both quirks are kept so results match.
+    weights = gaussian_weights(window, std)
+    min_periods = min_periods or window
+    windows, pos = _rolling_windows(values, window, center)
+    is_obs = ~np.isnan(windows)
+
+    w = np.where(is_obs, weights[pos % window], 0.0)
+    x = np.where(is_obs, windows, 0.0)
+    sum_w = w.sum(axis=-1)
+    nobs = is_obs.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (w * x).sum(axis=-1) / sum_w
+        t = (w * (x - mean[..., None]) ** 2).sum(axis=-1)
+        var = t * window / ((window - ddof) * sum_w)
+    var = np.where(nobs == 1, 0.0, np.clip(var, 0.0, None))
+    var = np.where((nobs >= min_periods) & (nobs > ddof), var, np.nan)
+    return np.sqrt(var)
+
+def gaussian_smooth(obj, window, std, min_periods=None, center=True):
+    # Series/DataFrame in, same shape and labels out.
+    smoothed = rolling_gaussian_mean(obj.to_numpy(dtype='float64'), window, std, min_periods, center)
+    if isinstance(obj, pd.DataFrame):
+        return pd.DataFrame(smoothed, index=obj.index, columns=obj.columns)
+    return pd.Series(smoothed, index=obj.index, name=obj.name)
+
+def gaussian_smooth_std(obj, window, std, min_periods=None, center=True, ddof=1):
+    smoothed = rolling_gaussian_std(obj.to_numpy(dtype='float64'), window, std, min_periods, center, ddof)
+    if isinstance(obj, pd.DataFrame):
+        return pd.DataFrame(smoothed, index=obj.index, columns=obj.columns)
+    return pd.Series(smoothed, index=obj.index, name=obj.name)
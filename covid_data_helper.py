@@ -1,5 +1,6 @@
 import pandas as pd
 import numpy as np
+import functools
 
 # From Roger Allen https://gist.github.com/rogerallen/1583593
 us_state_abbrev = {
@@ -63,26 +64,70 @@ us_state_abbrev = {
 abbrev_us_state = dict(map(reversed, us_state_abbrev.items()))
 idx = pd.IndexSlice
 
-def get_nys_region(): 
+# Run-scoped memo for the network fetchers below. Each source is downloaded and parsed once per process;
+# callers get a copy (frames, dicts such as the county geojson, lists) so in-place edits can't leak into later
+# calls. Read-only numpy arrays are shared as they are. Use clear_fetch_cache() to force a refetch.
+_fetch_cache = {}
+
+def _fetch_copy(result):
+    import copy
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return result.copy()
+    if isinstance(result, np.ndarray):
+        return result if not result.flags.writeable else result.copy()
+    if isinstance(result, dict):
+        return {key: _fetch_copy(value) for key, value in result.items()}
+    if isinstance(result, (list, tuple)):
+        return type(result)(_fetch_copy(value) for value in result)
+    return copy.deepcopy(result)
+
+def memoize_fetch(fetch_func):
+    @functools.wraps(fetch_func)
+    def wrapper(*args, **kwargs):
+        key = (fetch_func.__name__, args, tuple(sorted(kwargs.items())))
+        if key not in _fetch_cache:
+            _fetch_cache[key] = fetch_func(*args, **kwargs)
+        return _fetch_copy(_fetch_cache[key])
+    return wrapper
+
+def clear_fetch_cache(*fetch_names):
+    # With no arguments, drop everything. Otherwise drop only the named fetchers, e.g. 'get_census_pop'.
+    if len(fetch_names) == 0:
+        _fetch_cache.clear()
+        return
+    for key in [k for k in _fetch_cache.keys() if k[0] in fetch_names]:
+        del _fetch_cache[key]
+
+def parse_numeric_cols(df, cols=None):
+    # Column-wise numeric coercion for feeds that publish numbers as text, e.g. "1,234", "5.2%" or "#DIV/0!".
+    df = df.copy()
+    if cols is None:
+        cols = df.columns
+    for col in cols:
+        if df[col].dtype == object:
+            df[col] = pd.to_numeric(df[col].astype(str).str.replace(',', '', regex=False).str.replace('%', '', regex=False),
+                                    errors='coerce')
+    return df
+
+@memoize_fetch
+def get_nys_region():
     gsheet_nys = 'https://docs.google.com/spreadsheets/d/1yidLf5CUEsdFpaYSF5is_KSJ5M5Okm4p3c7eduBkM8s/export?format=csv&gid=1928535373'
     df_nys_region_raw = pd.read_csv(gsheet_nys, skiprows=2)
 
     df_nys_region = df_nys_region_raw.copy()
     df_nys_region['dt'] = pd.to_datetime(df_nys_region.Date)
     df_nys_region = df_nys_region.set_index('dt').iloc[:,2:]
-    df_nys_region = df_nys_region.stack().reset_index()
 
-    df_nys_region[['ny_region','metric']] = df_nys_region['level_1'].str.split(':', expand=True)
-
-    df_nys_region = df_nys_region.rename(columns={0:'value'})[['dt','ny_region','metric','value']]
-    df_nys_region = df_nys_region.set_index(['dt','ny_region','metric'])
-    df_nys_region = df_nys_region.unstack(2)['value']
-    df_nys_region = df_nys_region.swaplevel().sort_index()
-    df_nys_region.columns = df_nys_region.columns.str.lstrip()
-    df_nys_region = df_nys_region.apply(lambda x: 
-                        x.str.replace(',','').str.replace('%','').replace('#DIV/0!',np.nan).astype(float), axis=1)
+    # Headers look like "Region: Metric". Split them once instead of splitting every stacked cell.
+    region_metric = df_nys_region.columns.str.split(':', n=1)
+    df_nys_region.columns = pd.MultiIndex.from_arrays(
+        [region_metric.str[0], region_metric.str[1].str.lstrip()], names=['ny_region', 'metric'])
+    df_nys_region = df_nys_region.stack('ny_region')
+    df_nys_region = df_nys_region.swaplevel().sort_index().sort_index(axis=1)
+    df_nys_region = parse_numeric_cols(df_nys_region)
     return df_nys_region
 
+@memoize_fetch
 def get_nyt_counties():
     raw_reporting = pd.read_csv('https://github.com/nytimes/covid-19-data/raw/master/us-counties.csv')
     df_reporting = raw_reporting
@@ -94,31 +139,90 @@ def get_nyt_counties():
     return df_reporting
 
 
-def get_jhu_counties():
+jhu_key_cols = ['state', 'county', 'fips']
+jhu_dropcols = ['UID', 'iso2', 'iso3', 'code3', 'Country_Region', 'Lat', 'Long_', 'Combined_Key', 'Population']
+
+@memoize_fetch
+def get_jhu_counties_arrays():
     df_jhu_counties_cases_raw = pd.read_csv(
         'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv')
 
     df_jhu_counties_deaths_raw = pd.read_csv(
         'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_US.csv')
 
-    df_jhu_counties = pd.concat(
-        [process_jhu_counties(df_jhu_counties_cases_raw, 'cases'),
-         process_jhu_counties(df_jhu_counties_deaths_raw, 'deaths')], axis=1)
+    jhu_arrays = jhu_counties_to_arrays({'cases': df_jhu_counties_cases_raw,
+                                         'deaths': df_jhu_counties_deaths_raw})
     print('Got JHU county level data.')
+    return jhu_arrays
+
+def get_jhu_counties(as_arrays=False):
+    # as_arrays=True returns the compact county x date view, otherwise the long (dt, state, county, fips) frame.
+    jhu_arrays = get_jhu_counties_arrays()
+    if as_arrays:
+        return jhu_arrays
+    return jhu_counties_long(jhu_arrays)
+
+def jhu_wide_to_array(df_jhu_counties):
+    # Splits a wide JHU time series into its county keys (indexed by UID), a datetime64 date index parsed once
+    # from the header, and a (county x date) float array.
+    df_jhu_counties = df_jhu_counties.rename(columns={'FIPS':'fips','Admin2':'county','Province_State':'state'})
+    df_keys = df_jhu_counties[jhu_key_cols].copy()
+    df_keys['fips'] = df_keys['fips'].dropna().astype(str).replace('\.0', '', regex=True).str.zfill(5)
+    if 'UID' in df_jhu_counties.columns:
+        df_keys.index = df_jhu_counties['UID'].to_numpy()
+
+    date_cols = [x for x in df_jhu_counties.columns if x not in jhu_key_cols + jhu_dropcols]
+    dts = pd.DatetimeIndex(pd.to_datetime(date_cols, format='%m/%d/%y'), name='dt')
+    values = df_jhu_counties[date_cols].to_numpy(dtype='float64')
+    return df_keys, dts, values
+
+def jhu_counties_to_arrays(dict_jhu_raw):
+    # dict_jhu_raw maps series name -> raw wide JHU frame. All series are aligned on the county rows and dates of
+    # the first one, and rows are ordered by (state, county, fips) so the long view needs no sort.
+    jhu_arrays = {}
+    df_keys = None
+    for series_name, df_raw in dict_jhu_raw.items():
+        this_keys, this_dts, this_values = jhu_wide_to_array(df_raw)
+        if df_keys is None:
+            df_keys, dts = this_keys, this_dts
+            codes = [pd.factorize(df_keys[col], sort=True)[0] for col in jhu_key_cols]
+            row_order = np.lexsort(codes[::-1])
+            df_keys = df_keys.iloc[row_order]
+        row_idx = this_keys.index.get_indexer(df_keys.index)
+        col_idx = this_dts.get_indexer(dts)
+        values = np.full((df_keys.shape[0], dts.shape[0]), np.nan)
+        row_ok, col_ok = row_idx >= 0, col_idx >= 0
+        values[np.ix_(row_ok, col_ok)] = this_values[np.ix_(row_idx[row_ok], col_idx[col_ok])]
+        values.flags.writeable = False
+        jhu_arrays[series_name] = values
+
+    jhu_arrays['keys'] = df_keys.reset_index(drop=True)
+    jhu_arrays['dt'] = dts
+    jhu_arrays['series'] = list(dict_jhu_raw.keys())
+    return jhu_arrays
+
+def jhu_counties_long(jhu_arrays):
+    # Long (dt, state, county, fips) view built straight from the arrays: dates are the outer level and county
+    # rows are already sorted, so the result is lexsorted without a sort_index.
+    df_keys = jhu_arrays['keys']
+    dts = jhu_arrays['dt']
+    n_cty, n_dt = df_keys.shape[0], dts.shape[0]
+
+    levels = [dts]
+    codes = [np.repeat(np.arange(n_dt), n_cty)]
+    for col in jhu_key_cols:
+        key_codes, key_uniques = pd.factorize(df_keys[col], sort=True)
+        levels.append(key_uniques)
+        codes.append(np.tile(key_codes, n_dt))
+    long_idx = pd.MultiIndex(levels=levels, codes=codes, names=['dt'] + jhu_key_cols, verify_integrity=False)
+
+    df_jhu_counties = pd.DataFrame({series_name: jhu_arrays[series_name].T.ravel()
+                                    for series_name in jhu_arrays['series']}, index=long_idx)
+    df_jhu_counties = df_jhu_counties.dropna(how='all')
     return df_jhu_counties
 
 def process_jhu_counties(df_jhu_counties, series_name):
-    df_jhu_counties['FIPS'] = df_jhu_counties['FIPS'].dropna().astype(str).replace('\.0', '', regex=True).str.zfill(5)
-    dropcols = [x for x in df_jhu_counties.columns if x in
-                ['UID','iso2','iso3','code3','Country_Region','Lat','Long_','Combined_Key','Population']]
-
-    df_jhu_counties = df_jhu_counties.drop(dropcols, axis=1)
-
-    df_jhu_counties = df_jhu_counties.rename(columns={'FIPS':'fips','Admin2':'county','Province_State':'state'})
-    df_jhu_counties = df_jhu_counties.set_index(['state','county','fips'])
-    df_jhu_counties = df_jhu_counties.stack().reset_index().rename(columns={'level_3':'dt',0:series_name})
-    df_jhu_counties = df_jhu_counties.set_index(['dt','state','county','fips']).sort_index()
-    return df_jhu_counties
+    return jhu_counties_long(jhu_counties_to_arrays({series_name: df_jhu_counties}))
 
 def get_nyregionmap():
     df_reporting = get_nyt_counties()
@@ -149,6 +253,7 @@ def reporting_by_nys_region():
     
     return df_reporting_fmt
 
+@memoize_fetch
 def get_nycdoh_data():
     df_nycdoh_raw = pd.read_csv('https://github.com/nychealth/coronavirus-data/raw/master/case-hosp-death.csv')
     df_nycdoh = df_nycdoh_raw
@@ -157,6 +262,9 @@ def get_nycdoh_data():
     df_nycdoh = df_nycdoh.set_index('dt').sort_index()
     return df_nycdoh
 
+nycdoh_boro_prefixes = {'BK': 'Kings', 'QN': 'Queens', 'SI': 'Richmond', 'MN': 'Manhattan', 'BX': 'Bronx'}
+
+@memoize_fetch
 def get_nycdoh_boro():
     # df_nycdoh_raw = pd.read_csv('https://raw.githubusercontent.com/nychealth/coronavirus-data/master/boro/boroughs-case-hosp-death.csv')
     df_nycdoh_raw = pd.read_csv(
@@ -165,11 +273,13 @@ def get_nycdoh_boro():
     df_nycdoh['dt'] = pd.to_datetime(df_nycdoh['date_of_interest'])
     df_nycdoh = df_nycdoh.drop(columns=['date_of_interest'])
     df_nycdoh = df_nycdoh.set_index('dt').sort_index()
-    df_nycdoh = df_nycdoh.stack().reset_index().rename(columns={'level_1': 'metric', 0: 'value'})
-    df_nycdoh['county'] = df_nycdoh.metric.apply(lambda x: x[:2]).replace(
-        {'BK': 'Kings', 'QN': 'Queens', 'SI': 'Richmond', 'MN': 'Manhattan', 'BX': 'Bronx'})
-    df_nycdoh['metric'] = df_nycdoh.metric.apply(lambda x: x[3:])
-    df_nycdoh = df_nycdoh.set_index(['dt', 'county', 'metric']).unstack('metric')['value']
+
+    # Headers look like "BK_CASE_COUNT". Map the borough prefix once per column rather than once per cell.
+    metric_cols = df_nycdoh.columns.astype(str)
+    df_nycdoh.columns = pd.MultiIndex.from_arrays(
+        [pd.Categorical(metric_cols.str[:2]).rename_categories(lambda x: nycdoh_boro_prefixes.get(x, x)).astype(str),
+         metric_cols.str[3:]], names=['county', 'metric'])
+    df_nycdoh = df_nycdoh.stack('county').sort_index().sort_index(axis=1)
     df_nycdoh = df_nycdoh.rename(columns={'CASE_COUNT':'cases_daily',
                                           'DEATH_COUNT':'deaths_daily',
                                           'HOSPITALIZED_COUNT':'hosp_admits'})
@@ -182,6 +292,7 @@ def get_nycdoh_boro():
     print('Got NYC DOH data')
     return df_nycdoh
 
+@memoize_fetch
 def get_nysdoh_data():
     # df_nys_pub = pd.read_json('https://health.data.ny.gov/resource/xdss-u53e.json')
 
@@ -193,57 +304,96 @@ def get_nysdoh_data():
     print('Got NYS DOH data')
     return df_nys_pub
 
-def get_complete_county_data():
-    df_nys_pub = get_nysdoh_data()
-    df_nys_pub = df_nys_pub.reset_index()
-    df_nys_pub['state'] = 'NY'
+def fips_to_str(fips_int, width=5):
+    # Vectorized zero-padding of integer FIPS codes, e.g. 1001 -> '01001'.
+    return pd.Series(np.asarray(fips_int)).astype(str).str.zfill(width).to_numpy()
 
+@memoize_fetch
+def get_county_registry():
+    # One row per county ordered by FIPS. cty_code is the dense int32 row position, so county frames can be
+    # joined on integers and get their labels back with a take instead of a string merge.
     df_census = get_census_pop()
+    df_county_reg = df_census.loc[df_census['SUMLEV'] == 50, ['state', 'county', 'fips', 'pop2019']].copy()
+    df_county_reg['fips_int'] = df_county_reg['fips'].astype('int32')
+    df_county_reg = df_county_reg.sort_values('fips_int').drop_duplicates('fips_int').reset_index(drop=True)
+    df_county_reg['cty_code'] = np.arange(df_county_reg.shape[0], dtype='int32')
+    for col in ['state', 'county', 'fips']:
+        df_county_reg[col] = df_county_reg[col].astype('category')
+    return df_county_reg
+
+def county_codes(df_county_reg, fips):
+    # Vectorized FIPS -> cty_code lookup. Accepts ints, floats or zero-padded strings; unknown FIPS map to -1.
+    fips_int = pd.to_numeric(pd.Series(np.asarray(fips)), errors='coerce').fillna(-1).to_numpy(dtype='int64')
+    reg_fips = df_county_reg['fips_int'].to_numpy()
+    pos = np.searchsorted(reg_fips, fips_int).clip(0, reg_fips.shape[0] - 1)
+    return np.where(reg_fips[pos] == fips_int, pos, -1).astype('int32')
+
+def county_labels(df_county_reg, cty_code):
+    # state, county and zero-padded fips of each cty_code, as plain strings, in the order given.
+    df_labels = df_county_reg[['state', 'county', 'fips']].iloc[np.asarray(cty_code, dtype='int64')]
+    return df_labels.astype(str).reset_index(drop=True)
+
+def county_codes_by_name(df_county_reg, state, counties):
+    # cty_code lookup by county name within one state (census abbreviation); unknown names map to -1.
+    df_state_reg = df_county_reg[df_county_reg['state'] == state]
+    name_map = pd.Series(df_state_reg['cty_code'].to_numpy(), index=df_state_reg['county'].astype(str))
+    return pd.Series(np.asarray(counties)).map(name_map).fillna(-1).to_numpy(dtype='int32')
+
+@memoize_fetch
+def get_complete_county_data():
+    df_county_reg = get_county_registry()
 
-    df_nys_pub = pd.merge(df_nys_pub, df_census.loc[df_census['SUMLEV'] == 50,
-                                                    ['state', 'county', 'fips']], how='inner', on=['state', 'county'])
-    df_nys_pub['state'] = 'New York'
+    df_nys_pub = get_nysdoh_data()
+    df_nys_pub = df_nys_pub.reset_index()
+    df_nys_pub['cty_code'] = county_codes_by_name(df_county_reg, 'NY', df_nys_pub['county'])
+    df_nys_pub = df_nys_pub[df_nys_pub['cty_code'] >= 0]
     df_nys_pub = df_nys_pub.rename(columns={'cumulative_number_of_positives': 'cases'})
-    df_nys_pub = df_nys_pub[['dt', 'state', 'county', 'fips', 'cases']]
+    df_nys_pub = df_nys_pub[['dt', 'cty_code', 'cases']]
 
     df_counties = get_nyt_counties()
     df_counties = df_counties.reset_index()
-    df_counties = df_counties[~(df_counties.county == 'New York City')]
+    df_counties = df_counties[~(df_counties.county == 'New York City')].copy()
+    df_counties['cty_code'] = county_codes(df_county_reg, df_counties['fips'])
 
-    nycounties_notin_nyt = [x for x in df_nys_pub.fips.unique() if x not in df_counties.fips.unique()]
+    nycounties_notin_nyt = np.setdiff1d(df_nys_pub['cty_code'].unique(), df_counties['cty_code'].unique())
 
     df_nycdoh = get_nycdoh_boro()
     df_nycdoh = df_nycdoh.unstack('county').cumsum().stack('county').rename(columns={'deaths_daily': 'deaths'})
     df_nycdoh = df_nycdoh[['deaths']].reset_index()
+    df_nycdoh['cty_code'] = county_codes_by_name(df_county_reg, 'NY', df_nycdoh['county'])
 
-    df_notin_nyt = pd.merge(df_nys_pub[df_nys_pub.fips.isin(nycounties_notin_nyt)],
-                            df_nycdoh, how='outer', on=['dt', 'county'])
+    df_notin_nyt = pd.merge(df_nys_pub[df_nys_pub['cty_code'].isin(nycounties_notin_nyt)],
+                            df_nycdoh[['dt', 'cty_code', 'deaths']], how='left', on=['dt', 'cty_code'])
 
-    df_counties = pd.concat([df_counties.reset_index(), df_notin_nyt], axis=0)
+    df_counties = pd.concat([df_counties[['dt', 'cty_code', 'cases', 'deaths']], df_notin_nyt], axis=0)
+    df_counties = df_counties[df_counties['cty_code'] >= 0].copy()
 
-    df_counties = pd.merge(
-        df_census.loc[df_census['SUMLEV'] == 50, ['state','county','fips','pop2019']],
-        df_counties.reset_index()[['dt', 'fips', 'cases', 'deaths']],
-        on='fips', how='inner')
+    pop2019 = df_county_reg['pop2019'].to_numpy()
+    df_counties['pop2019'] = pop2019[df_counties['cty_code'].to_numpy()]
     df_counties['cases_per100k'] = df_counties['cases'].mul(1e5).div(df_counties['pop2019'])
 
-    # df_counties = df_counties.set_index(['dt','state','county','fips']).sort_index()
-
     df_goog_mob_cty = get_goog_mvmt_cty(get_goog_mvmt_us())
-    df_counties = pd.merge(df_counties[[x for x in df_counties.columns if x not in ['state','county']]],
-                           df_goog_mob_cty, on=['dt','fips'], how='outer')
-    df_counties = pd.merge(
-        df_census.loc[df_census['SUMLEV'] == 50, ['state', 'county', 'fips']],
-        df_counties,
-        on='fips', how='inner')
-    df_counties = df_counties.set_index(['dt', 'state', 'county', 'fips']).sort_index()
+    df_goog_mob_cty['cty_code'] = county_codes(df_county_reg, df_goog_mob_cty['fips'])
+    df_goog_mob_cty = df_goog_mob_cty[df_goog_mob_cty['cty_code'] >= 0].drop(columns='fips')
+    df_counties = pd.merge(df_counties, df_goog_mob_cty, on=['dt', 'cty_code'], how='outer')
+
+    # Keyed on (dt, cty_code); county_labels() gives the state, county and fips of a code from the registry.
+    df_counties['cty_code'] = df_counties['cty_code'].to_numpy(dtype='int32')
+    df_counties = df_counties.set_index(['dt', 'cty_code']).sort_index()
     print('Got Complete County Data')
     return df_counties
 
+covidtracking_url = 'https://api.covidtracking.com/v1/states/daily.csv'
+# The covidtracking metrics the model and summary code read, and the names they go by in df_st_testing_fmt.
+covidtracking_cols = ('death', 'positive', 'posNeg', 'hospitalizedCurrently', 'hospitalizedIncrease',
+                      'hospitalizedCumulative')
+covidtracking_renames = {'death': 'deaths', 'positive': 'cases'}
+
+@memoize_fetch
 def get_covid19_tracking_data():
     df_st_testing_raw = pd.read_csv(
     # 'https://raw.githubusercontent.com/COVID19Tracking/covid-tracking-data/master/data/states_daily_4pm_et.csv')
-        'https://api.covidtracking.com/v1/states/daily.csv')
+        covidtracking_url)
     df_st_testing = df_st_testing_raw
     df_st_testing['dt'] = pd.to_datetime(df_st_testing['date'], format="%Y%m%d")
     print("State Testing Data Last Observation: ", df_st_testing.date.max())
@@ -252,14 +402,37 @@ def get_covid19_tracking_data():
     print('Got COVID19 Tracking Data')
     return df_st_testing
 
+@memoize_fetch
+def get_covid19_tracking_panel(cols=covidtracking_cols):
+    # df_st_testing_fmt straight from the csv: only the declared metrics are parsed, as float64, and scattered
+    # into one dense (date, metric, state) array. The frame is a view of that array with the same layout as
+    # get_covid19_tracking_data().rename(...).unstack('code'): (metric, code) columns on a dt index.
+    cols = list(cols)
+    df_raw = pd.read_csv(covidtracking_url, usecols=['date', 'state'] + cols,
+                         dtype=dict({'date': 'int64', 'state': 'str'}, **{col: 'float64' for col in cols}))
+    print("State Testing Data Last Observation: ", df_raw['date'].max())
+
+    dates, date_pos = np.unique(df_raw['date'].to_numpy(), return_inverse=True)
+    codes, code_pos = np.unique(df_raw['state'].to_numpy(dtype='str'), return_inverse=True)
+    panel = np.full((dates.shape[0], len(cols), codes.shape[0]), np.nan)
+    panel[date_pos, :, code_pos] = df_raw[cols].to_numpy()
+
+    metrics = [covidtracking_renames.get(col, col) for col in cols]
+    df_st_testing_fmt = pd.DataFrame(panel.reshape(dates.shape[0], -1),
+                                     index=pd.DatetimeIndex(pd.to_datetime(dates.astype('str'), format="%Y%m%d"), name='dt'),
+                                     columns=pd.MultiIndex.from_product([metrics, codes], names=[None, 'code']),
+                                     copy=False)
+    print('Got COVID19 Tracking Data')
+    return df_st_testing_fmt
+
+@memoize_fetch
 def get_census_pop():
     df_census_raw = pd.read_csv(
     'https://www2.census.gov/programs-surveys/popest/datasets/2010-2019/counties/totals/co-est2019-alldata.csv', 
     encoding = "ISO-8859-1")
     df_census = df_census_raw.copy()
     df_census['county'] = df_census.CTYNAME.str.replace(' County','').str.replace(' Parish','')
-    df_census['fips'] = df_census.STATE.apply('{:0>2}'.format).astype(str).str.cat(
-        df_census.COUNTY.apply('{:0>3}'.format).astype(str))
+    df_census['fips'] = fips_to_str(df_census.STATE.astype(int) * 1000 + df_census.COUNTY.astype(int))
     df_census = df_census.rename(columns={'STNAME':'state','POPESTIMATE2019':'pop2019'})
     df_census['pop2019'] = pd.to_numeric(df_census.pop2019)
     df_census = df_census[['state','county','fips','SUMLEV', 'REGION','DIVISION', 'pop2019']]
@@ -267,6 +440,7 @@ def get_census_pop():
     print('Got Census Data')
     return df_census
 
+@memoize_fetch
 def get_goog_mvmt_us():
     df_goog_mob_raw = pd.read_csv('https://www.gstatic.com/covid19/mobility/Global_Mobility_Report.csv',
                                   low_memory=False)
@@ -279,7 +453,7 @@ def get_goog_mvmt_us():
     df_goog_mob_us['state'] = df_goog_mob_us['state'].replace(us_state_abbrev)
     df_goog_mob_us['county'] = df_goog_mob_us['county'].str.replace(' Parish', '', regex=True
                                                                     ).replace(' County', '', regex=True)
-    df_goog_mob_us['fips'] = df_goog_mob_us['fips'].fillna(0).astype(int).apply('{:0>5}'.format)
+    df_goog_mob_us['fips'] = fips_to_str(df_goog_mob_us['fips'].fillna(0).astype(int))
     print('Got Google Movement Data')
     return df_goog_mob_us
 
@@ -322,92 +496,143 @@ def get_goog_mvmt_state(df_goog_mob_us):
     df_goog_mob_state = df_goog_mob_state.set_index(key_cols)
     return df_goog_mob_state
 
-def get_state_policy_events():
-    import requests
+kff_policy_url = 'https://www.kff.org/report-section/state-data-and-policy-actions-to-address-coronavirus-sources/'
+us_holidays_url = 'https://gist.githubusercontent.com/shivaas/4758439/raw/b0d3ddec380af69930d0d67a9e0519c047047ff8/US%2520Bank%2520holidays'
+kff_text_blacklist = {'[document]', 'noscript', 'header', 'html', 'meta', 'head', 'input', 'script'}
+
+def parse_kff_policy_page(html_page):
     import re
     from bs4 import BeautifulSoup
 
-    url = 'https://www.kff.org/report-section/state-data-and-policy-actions-to-address-coronavirus-sources/'
-    res = requests.get(url)
-    html_page = res.content
-
-    res = requests.get(url)
-    html_page = res.content
     soup = BeautifulSoup(html_page, 'html.parser')
-    text = soup.find_all(text=True)
-
-    output = ''
-    blacklist = [
-        '[document]',
-        'noscript',
-        'header',
-        'html',
-        'meta',
-        'head',
-        'input',
-        'script']
-
-    for t in text:
-        if t.parent.name not in blacklist:
-            output += '{} '.format(t)
-
-    rawlist = list(map(str.strip, output.split('\n')))
-    outlist = []
-    this_state = ''
-    # us_states = [x.upper() for x in us_state_abbrev.keys()]
-    us_states = {k.upper(): v for k, v in us_state_abbrev.items()}
-
-    for linenum in range(len(rawlist)):
-        thisstr = rawlist[linenum]
-
-        if thisstr.strip().upper() in us_states.keys():
-            change_dir = 'restricting'
-            this_state_abbrev = us_states[thisstr.strip().upper()]
-            this_state = abbrev_us_state[this_state_abbrev]
-        elif thisstr.strip()[:6] == 'Easing':
-            change_dir = 'easing'
-        elif this_state != '' and thisstr.strip()[:4] not in ['http', '']:
-
-            #         idx_before_urls = thisstr.find(':')
-            if re.search("[A-Za-z]", thisstr) != None:
-                idx_before_urls = re.search("[A-Za-z]", thisstr).start()
-            else:
-                idx_before_urls = None
-
-            dates = re.findall(r'\d+/\d+', thisstr[:idx_before_urls])
-            if len(dates) > 0:
-                last_dt = dates[-1]
-
-                ld_idx = thisstr.find(last_dt)
 
-                name_url = thisstr[ld_idx + len(last_dt):]
-                l_name_url = re.split(":", name_url, 1)
-
-                name = l_name_url[0].strip()
-                if len(l_name_url) > 1:
-                    urls = l_name_url[1].strip()
+    us_states = {k.upper(): v for k, v in us_state_abbrev.items()}
+    re_letter = re.compile('[A-Za-z]')
+    re_date = re.compile(r'\d+/\d+')
+
+    def parse_section(section):
+        text_parts = ['{} '.format(t) for t in section.find_all(string=True)
+                      if t.parent.name not in kff_text_blacklist]
+        rawlist = [x.strip() for x in ''.join(text_parts).split('\n')]
+
+        rows = []
+        this_state = ''
+        this_state_abbrev = ''
+        change_dir = 'restricting'
+        urls = ''
+
+        for thisstr in rawlist:
+            if thisstr.upper() in us_states:
+                change_dir = 'restricting'
+                this_state_abbrev = us_states[thisstr.upper()]
+                this_state = abbrev_us_state[this_state_abbrev]
+            elif thisstr[:6] == 'Easing':
+                change_dir = 'easing'
+            elif this_state != '' and thisstr[:4] not in ['http', '']:
+                first_letter = re_letter.search(thisstr)
+                idx_before_urls = first_letter.start() if first_letter is not None else None
+
+                dates = re_date.findall(thisstr[:idx_before_urls])
+                if len(dates) > 0:
+                    last_dt = dates[-1]
+                    ld_idx = thisstr.find(last_dt)
+
+                    l_name_url = thisstr[ld_idx + len(last_dt):].split(':', 1)
+                    name = l_name_url[0].strip()
+                    if len(l_name_url) > 1:
+                        urls = l_name_url[1].strip()
+
+                    rows.append([this_state, this_state_abbrev, dates[0] + '/2020', dates, name, change_dir, urls])
+        return rows
+
+    # Collect rows from every top-level main/article section (the state lists can be split across
+    # several), then parse the whole document too and keep it if it finds more rows than the sections.
+    candidates = soup.find_all(['main', 'article'])
+    outlist = []
+    for section in candidates:
+        if section.find_parent(['main', 'article']) is None:
+            outlist += parse_section(section)
 
-                outlist.append([this_state, this_state_abbrev, dates[0] + '/2020', dates, name, change_dir, urls])
+    doc_list = parse_section(soup)
+    if len(doc_list) > len(outlist):
+        outlist = doc_list
 
     df_out = pd.DataFrame(outlist,
                           columns=['state', 'state_code', 'dt', 'all_dates',
                                    'event_name', 'social_distancing_direction', 'urls'])
     df_out.loc[df_out['social_distancing_direction'] == 'easing', 'event_name'] = 'Easing: ' + df_out['event_name']
+    return df_out
 
-    df_holidays = pd.read_csv(
-        'https://gist.githubusercontent.com/shivaas/4758439/raw/b0d3ddec380af69930d0d67a9e0519c047047ff8/US%2520Bank%2520holidays',
-        header=None, names=['idx', 'dt', 'event_name'], usecols=[1, 2])
+def get_us_holidays(cache_dir='./data/cache'):
+    import os
+    import requests
 
+    # The gist URL is pinned to a revision, so it only ever needs to be downloaded once.
+    cache_path = os.path.join(cache_dir, 'us_bank_holidays.csv')
+    if not os.path.exists(cache_path):
+        res = requests.get(us_holidays_url)
+        res.raise_for_status()
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path, 'wb') as f:
+            f.write(res.content)
+
+    df_holidays = pd.read_csv(cache_path, header=None, names=['idx', 'dt', 'event_name'], usecols=[1, 2])
     df_holidays['state'] = 'US'
     df_holidays['state_code'] = 'US'
     df_holidays['social_distancing_direction'] = 'holiday'
+    return df_holidays
+
+@memoize_fetch
+def get_state_policy_events(cache_dir='./data/cache'):
+    import os
+    import json
+    import hashlib
+    import requests
 
-    df_out = pd.concat([df_out, df_holidays])
+    # The parsed table is cached on disk next to the page's hash and validators. An unchanged page costs one
+    # conditional request (304) or, if the server ignores validators, one download and a hash check.
+    meta_path = os.path.join(cache_dir, 'kff_policy_meta.json')
+    table_path = os.path.join(cache_dir, 'kff_policy_events.pkl')
+
+    meta = {}
+    if os.path.exists(meta_path) and os.path.exists(table_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+
+    res = requests.get(kff_policy_url, headers=headers)
+
+    if res.status_code == 304:
+        df_out = pd.read_pickle(table_path)
+        print('KFF Policy page unchanged')
+    else:
+        # An error page must not be parsed or replace the cached table.
+        res.raise_for_status()
+        page_hash = hashlib.sha256(res.content).hexdigest()
+        if page_hash == meta.get('content_hash'):
+            df_out = pd.read_pickle(table_path)
+            print('KFF Policy page unchanged')
+        else:
+            df_out = pd.concat([parse_kff_policy_page(res.content), get_us_holidays(cache_dir)])
+            df_out['dt'] = pd.to_datetime(df_out['dt'])
+
+            os.makedirs(cache_dir, exist_ok=True)
+            df_out.to_pickle(table_path)
+        meta = {'content_hash': page_hash,
+                'etag': res.headers.get('ETag'),
+                'last_modified': res.headers.get('Last-Modified')}
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
 
-    df_out['dt'] = pd.to_datetime(df_out['dt'])
     print('Got KFF Policy dates')
     return df_out
 
+@memoize_fetch
 def get_counties_geo():
     from urllib.request import urlopen
     import json
@@ -416,6 +641,7 @@ def get_counties_geo():
     print('Got counties geo json')
     return counties
 
+@memoize_fetch
 def get_hhs_hosp():
     hhs_json = pd.read_json(
         'https://healthdata.gov/api/3/action/package_show?id=060e4acc-241d-4d19-a929-f5f7b653c648')